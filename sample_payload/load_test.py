@@ -0,0 +1,477 @@
+"""
+Load generator and latency benchmark of /predict_income.
+
+Payloads are drawn from training/adult.csv, mixed with configurable fractions of the
+invalid payloads of web/tests/test_files. Requests are sent with asyncio over pooled
+keep-alive connections, either by a fixed number of closed-loop clients (--concurrency)
+or at a target rate with Poisson arrivals (--rate). The app can also be loaded
+in-process through the Flask test client (--in-process), without any server or redis.
+
+Use: python load_test.py --host 0.0.0.0:1337 --concurrency 16 --requests 5000
+     python load_test.py --host 0.0.0.0:1337 --rate 200 --duration 30 --output run.json
+     python load_test.py --in-process --requests 2000 --compare run.json
+"""
+
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+PROJECT_DIR = os.path.join(ROOT_DIR, 'web', 'project')
+ADULT_CSV = os.path.join(ROOT_DIR, 'training', 'adult.csv')
+TEST_DATA_DIR = os.path.join(ROOT_DIR, 'web', 'tests', 'test_files')
+
+NUMERIC_COLUMNS = ['age', 'fnlwgt', 'education.num', 'capital.gain', 'capital.loss', 'hours.per.week']
+DROP_COLUMNS = ['income']
+
+# payload kind -> error_type the endpoint answers with, None for a prediction
+EXPECTED_ERRORS = {
+    'valid' : None,
+    'excess' : None,
+    'missing' : 'missing_fields',
+    'invalid_dtype' : 'invalid_data_type',
+    'invalid_category' : 'invalid_categorical_data',
+    'negative' : 'fields_with_negative'
+}
+
+CACHE_HEADER = 'x-prediction-cache'
+PERCENTILES = [50, 95, 99, 99.9]
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--host', help='Target host of the endpoint. (i.e. "0.0.0.0:1337")', default='0.0.0.0:1337')
+    target.add_argument('--in-process', help='Loads web/project/app.py in-process instead of a server', action='store_true')
+    parser.add_argument('--path', help='Path of the endpoint', default='/predict_income')
+
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--concurrency', help='Number of closed-loop clients', type=int, default=16)
+    mode.add_argument('--rate', help='Target requests per second (open loop, Poisson arrivals)', type=float)
+    parser.add_argument('--connections', help='Connection pool size of --rate', type=int, default=64)
+
+    parser.add_argument('--requests', help='Number of timed requests', type=int, default=2000)
+    parser.add_argument('--duration', help='Seconds to run instead of a number of requests', type=float)
+    parser.add_argument('--warmup', help='Untimed requests sent first', type=int, default=100)
+
+    parser.add_argument('--data', help='CSV of the valid payloads', default=ADULT_CSV)
+    parser.add_argument('--payload-list', help='JSON list of valid payloads, used instead of --data')
+    parser.add_argument('--mix', help='Fractions of the other payload kinds, '
+                                      'i.e. "missing=0.02,invalid_dtype=0.01". '
+                                      f'Kinds: {", ".join(k for k in EXPECTED_ERRORS if k != "valid")}', default='')
+    parser.add_argument('--seed', type=int, default=0)
+
+    parser.add_argument('--json', help='Prints the report as a single JSON line', action='store_true')
+    parser.add_argument('--output', help='Writes the report to this JSON file')
+    parser.add_argument('--compare', help='Report JSON of a previous run to compare with')
+
+    args = parser.parse_args()
+    return args
+
+
+def load_json(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def load_csv_payloads(path : str) -> list:
+    """Rows of the training CSV as raw payloads"""
+    with open(path, 'r', newline='') as f:
+        rows = list(csv.DictReader(f))
+
+    for row in rows:
+        for col in DROP_COLUMNS:
+            row.pop(col, None)
+        for col in NUMERIC_COLUMNS:
+            if col in row:
+                row[col] = int(row[col])
+    return rows
+
+
+def parse_mix(mix : str) -> dict:
+    fractions = {}
+    for item in filter(None, mix.split(',')):
+        kind, _, fraction = item.partition('=')
+        if kind not in EXPECTED_ERRORS or kind == 'valid':
+            raise ValueError(f'Unknown payload kind: {kind}')
+        fractions[kind] = float(fraction)
+
+    fractions['valid'] = 1.0 - sum(fractions.values())
+    if fractions['valid'] < 0:
+        raise ValueError('The fractions of --mix add up to more than 1')
+    return fractions
+
+
+class PayloadMix:
+    """Draws request bodies of the configured payload kinds"""
+
+    def __init__(self, valid_payloads : list, fractions : dict, seed : int = 0):
+        self.kinds = list(fractions)
+        self.weights = [fractions[kind] for kind in self.kinds]
+        self.rng = random.Random(seed)
+
+        self.bodies = {'valid' : [json.dumps(payload).encode() for payload in valid_payloads]}
+        for kind in self.kinds:
+            if kind != 'valid':
+                self.bodies[kind] = [json.dumps(load_json(os.path.join(TEST_DATA_DIR, f'payload_{kind}.json'))).encode()]
+
+    def sample(self, n : int) -> list:
+        """
+        Returns:
+            list: n (kind, json body) tuples
+        """
+        kinds = self.rng.choices(self.kinds, weights=self.weights, k=n)
+        return [(kind, self.rng.choice(self.bodies[kind])) for kind in kinds]
+
+
+class HttpClient:
+    """Minimal HTTP/1.1 client over one keep-alive connection"""
+
+    def __init__(self, host : str):
+        self.host = host
+        self.address, _, port = host.partition(':')
+        self.port = int(port or 80)
+        self.reader = None
+        self.writer = None
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def post(self, path : str, body : bytes):
+        """
+        Returns:
+            tuple: (status code, dict of lower-cased headers, body)
+        """
+        for attempt in range(2):
+            reused = self.writer is not None
+            if not reused:
+                self.reader, self.writer = await asyncio.open_connection(self.address, self.port)
+
+            try:
+                return await self.send(path, body)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                self.close()
+                # only a connection closed by the server while idle is retried
+                if not reused or attempt == 1:
+                    raise
+
+    async def send(self, path : str, body : bytes):
+        self.writer.write(
+            f'POST {path} HTTP/1.1\r\n'
+            f'Host: {self.host}\r\n'
+            'Content-Type: application/json\r\n'
+            f'Content-Length: {len(body)}\r\n\r\n'.encode() + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionResetError('connection closed by the server')
+        version, status = status_line.split(b' ', 2)[:2]
+
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+
+        if 'content-length' in headers:
+            response = await self.reader.readexactly(int(headers['content-length']))
+        else:
+            response = await self.reader.read()
+            headers['connection'] = 'close'
+
+        if headers.get('connection', '').lower() == 'close' or version == b'HTTP/1.0':
+            self.close()
+
+        return int(status), headers, response
+
+
+class InProcessClient:
+    """Sends requests to the Flask app through its test client, on a thread pool"""
+
+    def __init__(self, app, executor):
+        self.app = app
+        self.executor = executor
+
+    def close(self):
+        pass
+
+    def send(self, path : str, body : bytes):
+        response = self.app.test_client().post(path, data=body, content_type='application/json')
+        return response.status_code, {k.lower() : v for k, v in response.headers.items()}, response.data
+
+    async def post(self, path : str, body : bytes):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.send, path, body)
+
+
+def load_app():
+    """Imports web/project/app.py with its dependencies and without redis"""
+    env = {
+        'REF_JSON' : os.path.join(PROJECT_DIR, 'dependencies', 'standard_payload.json'),
+        'TRANSFORMER_FILE' : os.path.join(PROJECT_DIR, 'dependencies', 'data_transformer.pkl'),
+        'MODEL_FILE' : os.path.join(PROJECT_DIR, 'dependencies', 'model.txt'),
+        'CACHE_TYPE' : 'NullCache',
+        'CACHE_REDIS_HOST' : '',
+        'CACHE_REDIS_PORT' : '',
+        'CACHE_REDIS_DB' : '',
+        'CACHE_REDIS_URL' : '',
+        'CACHE_DEFAULT_TIMEOUT' : '0'
+    }
+    for k, v in env.items():
+        os.environ.setdefault(k, v)
+
+    sys.path.insert(0, PROJECT_DIR)
+    from app import app
+    return app
+
+
+class Recorder:
+    """Outcome of every timed request"""
+
+    def __init__(self):
+        self.latencies = []
+        self.kinds = []
+        self.status_codes = []
+        self.error_types = []
+        self.cache = []
+        self.transport_errors = 0
+
+    def record(self, kind : str, latency : float, status : int, headers : dict, body : bytes):
+        self.latencies.append(latency)
+        self.kinds.append(kind)
+        self.status_codes.append(status)
+        self.cache.append(headers.get(CACHE_HEADER))
+
+        try:
+            response = json.loads(body)
+            error_type = None if response['status'] == 'success' else response.get('error_type', 'unknown')
+        except (ValueError, KeyError, TypeError):
+            error_type = 'invalid_response'
+        self.error_types.append(error_type)
+
+    def report(self, elapsed : float, config : dict) -> dict:
+        num_requests = len(self.latencies)
+        latencies = np.array(self.latencies) * 1e3
+        p50, p95, p99, p999 = np.percentile(latencies, PERCENTILES) if num_requests > 0 else [float('nan')] * 4
+
+        error_responses = sum(error_type is not None for error_type in self.error_types)
+        unexpected = sum(EXPECTED_ERRORS[kind] != error_type for kind, error_type in zip(self.kinds, self.error_types))
+
+        by_kind = {}
+        for kind, error_type in zip(self.kinds, self.error_types):
+            counts = by_kind.setdefault(kind, {'requests' : 0, 'error_responses' : 0, 'unexpected' : 0})
+            counts['requests'] += 1
+            counts['error_responses'] += error_type is not None
+            counts['unexpected'] += EXPECTED_ERRORS[kind] != error_type
+
+        status_codes = {}
+        for status in self.status_codes:
+            status_codes[str(status)] = status_codes.get(str(status), 0) + 1
+
+        hits = self.cache.count('hit')
+        misses = self.cache.count('miss')
+
+        return {
+            'config' : config,
+            'requests' : num_requests,
+            'duration_s' : elapsed,
+            'throughput_rps' : num_requests / elapsed if elapsed > 0 else 0.0,
+            'latency_ms' : {
+                'p50' : float(p50),
+                'p95' : float(p95),
+                'p99' : float(p99),
+                'p999' : float(p999),
+                'mean' : float(latencies.mean()) if num_requests > 0 else float('nan'),
+                'max' : float(latencies.max()) if num_requests > 0 else float('nan')
+            },
+            'status_codes' : status_codes,
+            'transport_errors' : self.transport_errors,
+            'error_responses' : error_responses,
+            'error_rate' : error_responses / num_requests if num_requests > 0 else 0.0,
+            'unexpected_responses' : unexpected,
+            'by_kind' : by_kind,
+            'cache' : {
+                'hits' : hits,
+                'misses' : misses,
+                'hit_rate' : hits / (hits + misses) if hits + misses > 0 else None
+            }
+        }
+
+
+async def send_one(client, path : str, request : tuple, scheduled : float, recorder : Recorder):
+    kind, body = request
+    try:
+        status, headers, response = await client.post(path, body)
+    except (OSError, asyncio.IncompleteReadError):
+        client.close()
+        recorder.transport_errors += 1
+        return
+    recorder.record(kind, time.perf_counter() - scheduled, status, headers, response)
+
+
+async def run_closed_loop(clients : list, path : str, requests : list, deadline : float, recorder : Recorder):
+    """Every client sends its next request as soon as the previous one is answered"""
+    pending = iter(requests)
+
+    async def worker(client):
+        for request in pending:
+            if time.perf_counter() > deadline:
+                return
+            await send_one(client, path, request, time.perf_counter(), recorder)
+
+    await asyncio.gather(*[worker(client) for client in clients])
+
+
+async def run_open_loop(clients : list, path : str, requests : list, rate : float, deadline : float,
+                        recorder : Recorder, seed : int = 0):
+    """Requests are sent on a Poisson schedule, whether or not earlier ones were answered.
+       The latency is measured from the scheduled time, so waiting for a free connection counts.
+    """
+    pool = asyncio.Queue()
+    for client in clients:
+        pool.put_nowait(client)
+
+    async def send_scheduled(request, scheduled):
+        client = await pool.get()
+        try:
+            await send_one(client, path, request, scheduled, recorder)
+        finally:
+            pool.put_nowait(client)
+
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    scheduled = start
+    tasks = []
+
+    for request in requests:
+        scheduled += rng.expovariate(rate)
+        if scheduled > deadline:
+            break
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(send_scheduled(request, scheduled)))
+
+    await asyncio.gather(*tasks)
+
+
+async def run_load(args, payload_mix : PayloadMix, num_requests : int, duration : float = None) -> dict:
+    if args.in_process:
+        app = load_app()
+        size = args.connections if args.rate else args.concurrency
+        executor = ThreadPoolExecutor(max_workers=size)
+        clients = [InProcessClient(app, executor) for _ in range(size)]
+    elif args.rate:
+        clients = [HttpClient(args.host) for _ in range(args.connections)]
+    else:
+        clients = [HttpClient(args.host) for _ in range(args.concurrency)]
+
+    if duration is not None:
+        # enough requests for the whole duration, the deadline stops the run
+        num_requests = int((args.rate or 20000) * duration * 1.2) + 1
+    requests = payload_mix.sample(num_requests)
+
+    recorder = Recorder()
+    start = time.perf_counter()
+    deadline = start + duration if duration is not None else float('inf')
+
+    if args.rate:
+        await run_open_loop(clients, args.path, requests, args.rate, deadline, recorder, args.seed)
+    else:
+        await run_closed_loop(clients, args.path, requests, deadline, recorder)
+
+    elapsed = time.perf_counter() - start
+    for client in clients:
+        client.close()
+
+    config = {
+        'target' : 'in-process' if args.in_process else args.host,
+        'path' : args.path,
+        'mode' : 'rate' if args.rate else 'concurrency',
+        'rate' : args.rate,
+        'concurrency' : None if args.rate else args.concurrency,
+        'connections' : args.connections if args.rate else None,
+        'mix' : dict(zip(payload_mix.kinds, payload_mix.weights)),
+        'seed' : args.seed
+    }
+    return recorder.report(elapsed, config)
+
+
+def flatten(report : dict) -> dict:
+    """Throughput, latency and rates of a report, the values compared between runs"""
+    values = {'throughput_rps' : report['throughput_rps']}
+    values.update({f'latency_{k}_ms' : v for k, v in report['latency_ms'].items()})
+    values['error_rate'] = report['error_rate']
+    values['cache_hit_rate'] = report['cache']['hit_rate']
+    return values
+
+
+def print_report(report : dict):
+    latency = report['latency_ms']
+    print(f"requests: {report['requests']} in {report['duration_s']:.2f} s "
+          f"({report['throughput_rps']:.1f} req/s, target {report['config']['target']})")
+    print('latency ms: ' + '  '.join(f'{k} {v:.2f}' for k, v in latency.items()))
+    print(f"status codes: {report['status_codes']}, transport errors: {report['transport_errors']}")
+    print(f"error responses: {report['error_responses']} ({report['error_rate']:.2%}), "
+          f"unexpected: {report['unexpected_responses']}")
+    for kind, counts in report['by_kind'].items():
+        print(f"  {kind}: {counts['requests']} requests, {counts['error_responses']} errors, "
+              f"{counts['unexpected']} unexpected")
+    cache = report['cache']
+    hit_rate = 'n/a' if cache['hit_rate'] is None else f"{cache['hit_rate']:.2%}"
+    print(f"cache: {cache['hits']} hits, {cache['misses']} misses ({hit_rate})")
+
+
+def print_comparison(baseline : dict, report : dict):
+    print(f"{'metric':>18}  {'baseline':>10}  {'current':>10}  {'change':>8}")
+    current = flatten(report)
+    for k, base in flatten(baseline).items():
+        value = current[k]
+        if base is None or value is None:
+            continue
+        change = f'{(value - base) / base:+.1%}' if base else 'n/a'
+        print(f'{k:>18}  {base:>10.3f}  {value:>10.3f}  {change:>8}')
+
+
+def main():
+    args = get_args()
+
+    if args.payload_list:
+        valid_payloads = load_json(args.payload_list)
+    else:
+        valid_payloads = load_csv_payloads(args.data)
+    payload_mix = PayloadMix(valid_payloads, parse_mix(args.mix), args.seed)
+
+    if args.warmup > 0:
+        asyncio.run(run_load(args, payload_mix, args.warmup))
+    report = asyncio.run(run_load(args, payload_mix, args.requests, args.duration))
+
+    if args.json:
+        print(json.dumps(report))
+    else:
+        print_report(report)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+
+    if args.compare:
+        print_comparison(load_json(args.compare), report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Time train.py spends preparing its data before the tuning starts, without the cache
+(--no-cache), with an empty cache (cold) and with the cache of a previous run (warm), on
+adult.csv and on the rows of adult.csv repeated 10 times.
+
+The preparation reads and encodes the CSV and constructs the lgb.Dataset of every
+max_bin of the parallel search. Every case runs in a new process, its peak RSS is the
+ru_maxrss of that process.
+
+Use: python bench_dataset_cache.py adult.csv
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+COPIES = [1, 10]
+
+PREPARE_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import lightgbm as lgb
+from dataset_cache import DatasetCache
+from hyper_opt import max_bin_values
+from preprocess import DataTransformer
+from train import load_cached_ds, load_transform_ds
+from utils import feats_label_cols
+
+src, cache_dir = sys.argv[1:]
+if cache_dir == '-':
+    df_tr, _, _ = load_transform_ds(src, DataTransformer())
+    feats_col, label_col = feats_label_cols(df_tr)
+    X, y = df_tr[feats_col], df_tr[label_col]
+    for max_bin in max_bin_values():
+        lgb.Dataset(X, label=y, params={'max_bin' : max_bin, 'feature_pre_filter' : False, 'verbose' : -1}).construct()
+else:
+    cache = DatasetCache(cache_dir, src)
+    _, (df_tr, _, _) = load_cached_ds(src, cache)
+    feats_col, label_col = feats_label_cols(df_tr)
+    X, y = df_tr[feats_col], df_tr[label_col]
+    for max_bin in max_bin_values():
+        cache.lgb_dataset(X, y, max_bin)
+print(time.perf_counter() - start, file=sys.stderr)
+"""
+
+
+def make_input(src, copies, path):
+    with open(src) as f:
+        header = f.readline()
+        body = f.read()
+    with open(path, 'w') as f:
+        f.write(header)
+        for _ in range(copies):
+            f.write(body)
+
+
+def run(src, cache_dir):
+    """
+    Returns:
+        tuple: (seconds, peak RSS in MB)
+    """
+    process = subprocess.Popen([sys.executable, '-c', PREPARE_SCRIPT, src, cache_dir],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    stderr = process.stderr.read()
+    _, status, rusage = os.wait4(process.pid, 0)
+    if os.waitstatus_to_exitcode(status) != 0:
+        raise RuntimeError(stderr)
+    return float(stderr.strip().splitlines()[-1]), rusage.ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('src', help='Source CSV File of Adult Census Income dataset.')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        print(f'{"copies":>6}  {"cache":>8}  {"seconds":>8}  {"peak RSS MB":>11}')
+        for copies in COPIES:
+            src = os.path.join(work_dir, f'adult-{copies}.csv')
+            make_input(args.src, copies, src)
+            cache_dir = os.path.join(work_dir, 'cache')
+
+            for name, cache in [('none', '-'), ('cold', cache_dir), ('warm', cache_dir)]:
+                seconds, peak = run(src, cache)
+                print(f'{copies:>6}  {name:>8}  {seconds:8.2f}  {peak:11.1f}', flush=True)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
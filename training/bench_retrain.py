@@ -0,0 +1,110 @@
+"""
+Time to a new model and accuracy of retrain.py (continue and refit) against a full retrain
+with train.py (hyperparameter search and training from zero trees).
+
+adult.csv is split into:
+- holdout: 10% of the rows, on which every model is evaluated
+- new: 10% of the rows, and every row of HELD_BACK_COUNTRIES, never seen by the base model
+- old: the other rows, on which the base model is trained with train.py
+
+The full retrain runs train.py on old + new. The base model itself is evaluated with the new
+countries appended to its encoders, as it would score them without a retrain.
+
+Use: python bench_retrain.py adult.csv
+"""
+
+import argparse
+import copy
+import os
+import shutil
+import tempfile
+import time
+
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+from sklearn.metrics import accuracy_score, roc_auc_score
+
+from hyper_opt import tune_lgb_hyperparams_parallel
+from preprocess import DataTransformer
+from retrain import read_new_rows, retrain, trained_params
+from train import load_transform_ds, train_lgbm
+from utils import feats_label_cols, save_model
+
+HELD_BACK_COUNTRIES = ['canada', 'germany', 'india']
+
+
+def make_inputs(src, work_dir, seed=0):
+    df = pd.read_csv(src).sample(frac=1.0, random_state=seed).reset_index(drop=True)
+    holdout = df[:len(df) // 10]
+    rest = df[len(df) // 10:]
+
+    held_back = rest['native.country'].str.lower().isin(HELD_BACK_COUNTRIES)
+    new = pd.concat([rest[held_back], rest[~held_back][:len(df) // 10]])
+    old = rest[~held_back][len(df) // 10:]
+
+    paths = {}
+    for name, part in [('holdout', holdout), ('new', new), ('old', old), ('full', pd.concat([old, new]))]:
+        paths[name] = os.path.join(work_dir, f'{name}.csv')
+        part.to_csv(paths[name], index=False)
+    return paths
+
+
+def train_full(path, work_dir):
+    """train.py, the model saved to work_dir. Returns (Booster, DataTransformer, model.txt path)"""
+    data_transformer = DataTransformer()
+    df_tr, df_val, df_ts = load_transform_ds(path, data_transformer)
+    feats_col, label_col = feats_label_cols(df_tr)
+    opt_hparam = tune_lgb_hyperparams_parallel(df_tr[feats_col], df_tr[label_col], random_state=0)
+    clf = train_lgbm(df_tr, df_val, df_ts, opt_hparam, feats_col, label_col)
+
+    model_path = os.path.join(work_dir, f'{os.path.basename(path)}.txt')
+    save_model(clf, model_path)
+    return clf, data_transformer, model_path
+
+
+def scores(clf, data_transformer, df_holdout):
+    data_transformer = copy.deepcopy(data_transformer)
+    data_transformer.extend(df_holdout)
+    df_transform = data_transformer.transform(df_holdout)
+    y_true = df_transform[feats_label_cols(df_transform)[1]]
+    y_pred = clf.predict(df_transform[clf.feature_name()], num_iteration=clf.best_iteration or None)
+    return accuracy_score(y_true, y_pred > 0.5), roc_auc_score(y_true, y_pred)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('src', help='Source CSV File of Adult Census Income dataset.')
+    args = parser.parse_args()
+
+    np.random.seed(0)
+    work_dir = tempfile.mkdtemp()
+    try:
+        paths = make_inputs(args.src, work_dir)
+        df_holdout = read_new_rows(paths['holdout'])
+        df_new = read_new_rows(paths['new'])
+        print(f'{len(df_new)} new rows, {len(read_new_rows(paths["old"]))} old rows, {len(df_holdout)} holdout rows')
+
+        _, base_transformer, base_path = train_full(paths['old'], work_dir)
+        rows = [('base model', '-', *scores(lgb.Booster(model_file=base_path), base_transformer, df_holdout))]
+
+        start = time.perf_counter()
+        clf, data_transformer, _ = train_full(paths['full'], work_dir)
+        rows.append(('full retrain', time.perf_counter() - start, *scores(clf, data_transformer, df_holdout)))
+
+        for mode in ['continue', 'refit']:
+            start = time.perf_counter()
+            clf, data_transformer, _, _ = retrain(df_new, lgb.Booster(model_file=base_path), copy.deepcopy(base_transformer),
+                                                  trained_params(base_path), mode)
+            rows.append((f'retrain.py {mode}', time.perf_counter() - start, *scores(clf, data_transformer, df_holdout)))
+
+        print(f'{"model":>20}  {"seconds":>8}  {"accuracy":>8}  {"auc":>6}')
+        for name, seconds, accuracy, auc in rows:
+            seconds = f'{seconds:.1f}' if seconds != '-' else seconds
+            print(f'{name:>20}  {seconds:>8}  {accuracy:8.4f}  {auc:6.4f}')
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
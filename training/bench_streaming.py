@@ -0,0 +1,103 @@
+"""
+Peak RSS and wall-clock time of train.py loading a synthetic dataset 50 times the size of
+adult.csv in memory, against --stream, both training 100 rounds with fixed parameters and
+evaluating the model (no tuning).
+
+The synthetic rows are drawn from adult.csv with replacement, their fnlwgt scaled by a
+random factor between 0.9 and 1.1 so that the copies of a row are not identical. Every
+mode runs in a new process, its peak RSS is the ru_maxrss of that process.
+
+Use: python bench_streaming.py adult.csv
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+COPIES = 50
+
+PARAMS = {
+    'objective' : 'binary',
+    'metric' : 'auc',
+    'learning_rate' : 0.1,
+    'num_leaves' : 31,
+    'max_bin' : 50,
+    'is_unbalance' : True,
+    'verbose' : -1,
+}
+
+TRAIN_SCRIPT = f"""
+import sys, tempfile, time
+start = time.perf_counter()
+import streaming
+from preprocess import DataTransformer
+from train import load_transform_ds, train_lgbm
+from utils import evaluate_model, feats_label_cols
+
+src, mode = sys.argv[1:]
+if mode == 'memory':
+    df_tr, df_val, df_ts = load_transform_ds(src, DataTransformer())
+    feats_col, label_col = feats_label_cols(df_tr)
+    clf = train_lgbm(df_tr, df_val, df_ts, {PARAMS!r}, feats_col, label_col, num_round=100)
+    evaluate_model(clf, df_val, df_ts, feats_col, label_col)
+else:
+    with tempfile.TemporaryDirectory() as work_dir:
+        data_transformer, num_rows = streaming.fit_streaming(src)
+        splits, _ = streaming.encode_streaming(src, data_transformer, num_rows, work_dir)
+        clf = streaming.train_lgbm_streaming(splits, {PARAMS!r}, num_round=100)
+        streaming.evaluate_model_streaming(clf, splits)
+print(time.perf_counter() - start, file=sys.stderr)
+"""
+
+
+def make_input(src, copies, path, seed=0):
+    df = pd.read_csv(src)
+    rng = np.random.RandomState(seed)
+    for copy in range(copies):
+        df_copy = df.sample(frac=1.0, replace=True, random_state=rng)
+        df_copy['fnlwgt'] = (df_copy['fnlwgt'] * rng.uniform(0.9, 1.1, len(df_copy))).round().astype(int)
+        df_copy.to_csv(path, mode='a' if copy else 'w', header=not copy, index=False)
+
+
+def run(src, mode):
+    """
+    Returns:
+        tuple: (seconds, peak RSS in MB)
+    """
+    process = subprocess.Popen([sys.executable, '-c', TRAIN_SCRIPT, src, mode],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    stderr = process.stderr.read()
+    _, status, rusage = os.wait4(process.pid, 0)
+    if os.waitstatus_to_exitcode(status) != 0:
+        raise RuntimeError(stderr)
+    return float(stderr.strip().splitlines()[-1]), rusage.ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('src', help='Source CSV File of Adult Census Income dataset.')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        src = os.path.join(work_dir, 'adult.csv')
+        make_input(args.src, COPIES, src)
+        num_rows = sum(1 for _ in open(src)) - 1
+        print(f'{COPIES}x adult.csv, {num_rows} rows, {os.path.getsize(src) / 1024 ** 2:.0f} MB')
+
+        print(f'{"mode":>8}  {"seconds":>8}  {"peak RSS MB":>11}')
+        for mode in ['memory', 'stream']:
+            seconds, peak = run(src, mode)
+            print(f'{mode:>8}  {seconds:8.1f}  {peak:11.1f}', flush=True)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
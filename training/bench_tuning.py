@@ -0,0 +1,64 @@
+"""
+Wall-clock time and best AUC of tune_lgb_hyperparams (40 trials one after another, 100
+rounds each) against tune_lgb_hyperparams_parallel with the same budget of 40 trials,
+on the training split of train.py.
+
+The parameters selected by every search are cross-validated the same way afterwards
+(3 folds of the same seed, up to 2000 rounds with early stopping), so that the AUC does
+not depend on how each search measured its own trials.
+
+Use: python bench_tuning.py adult.csv
+"""
+
+import argparse
+import os
+import time
+from importlib.metadata import version
+
+import lightgbm as lgb
+
+from preprocess import DataTransformer
+from hyper_opt import tune_lgb_hyperparams, tune_lgb_hyperparams_parallel
+from train import load_transform_ds
+from utils import feats_label_cols
+
+
+def cv_auc(params, X, y):
+    params = dict(params, verbose=-1)
+    train_data = lgb.Dataset(X, label=y, params={'max_bin' : params['max_bin'], 'verbose' : -1})
+    cv_result = lgb.cv(params, train_data, num_boost_round=2000, nfold=3, stratified=True, seed=0,
+                       early_stopping_rounds=50, verbose_eval=False, metrics=['auc'])
+    return max(cv_result['auc-mean'])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('src', help='Source CSV File of Adult Census Income dataset.')
+    args = parser.parse_args()
+
+    df_tr, _, _ = load_transform_ds(args.src, DataTransformer())
+    feats_col, label_col = feats_label_cols(df_tr)
+    X, y = df_tr[feats_col], df_tr[label_col]
+    cores = len(os.sched_getaffinity(0))
+
+    searches = [('current', lambda history: tune_lgb_hyperparams(X, y))]
+    for workers in sorted({1, cores, 2 * cores}):
+        searches.append((f'parallel, {workers} workers',
+                         lambda history, workers=workers: tune_lgb_hyperparams_parallel(
+                             X, y, workers=workers, random_state=0, history=history)))
+
+    print(f'{cores} cores, {len(X)} training rows, lightgbm {version("lightgbm")}, '
+          f'bayesian-optimization {version("bayesian-optimization")}')
+    print(f'{"search":>22}  {"seconds":>8}  {"pruned":>6}  {"cv auc":>7}')
+    for name, search in searches:
+        history = []
+        start = time.perf_counter()
+        params = search(history)
+        seconds = time.perf_counter() - start
+
+        pruned = sum(result['pruned'] for _, result in history) if history else '-'
+        print(f'{name:>22}  {seconds:8.1f}  {pruned:>6}  {cv_auc(params, X, y):7.4f}', flush=True)
+
+
+if __name__ == '__main__':
+    main()
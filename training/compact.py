@@ -0,0 +1,372 @@
+"""
+Compaction of a trained model: fewer trees and fewer leaves, for a lower prediction latency.
+
+Every candidate keeps the first `trees` trees of the model (num_iteration) and merges, from
+the bottom of every tree up, sibling leaves as long as the original leaves under the merged
+leaf have values within `merge_tolerance` of each other. Each merged leaf takes their mean
+value, weighted by their hessian (leaf_weight), so a row moved to a merged leaf changes the
+raw score of that tree by at most the tolerance.
+
+Every candidate is scored on labeled rows the model was not trained on (F1 and AUC): by
+default the validation split of train.py on the given CSV, found again from the seed of its
+shuffle, or with --rows all every row of a CSV held out from the training. Its single-row
+(Model.predict) and batch (Model.predict_batch) latency is measured with the Model of the
+web service. The candidates that no other candidate beats on both the latency and the AUC
+form the Pareto frontier, written with all the others to a CSV file.
+
+A candidate can then be exported, like train.py, to a directory such as
+web/project/dependencies, either given by --trees and --merge-tolerance, or chosen as the
+fastest candidate of the frontier within --max-auc-loss of the AUC of the whole model.
+
+Use: python compact.py model/ adult.csv --out frontier.csv   (model/ trained by train.py on adult.csv)
+     python compact.py model/ heldout.csv --rows all --max-auc-loss 0.002 --export ../web/project/dependencies
+"""
+
+import argparse
+import csv
+import json
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+from sklearn.metrics import roc_auc_score
+
+from utils import shuffle_ds, split_ds, feats_label_cols, scores, evaluate_on_ds, save_model_transformer
+
+
+MERGE_TOLERANCES = [0.0, 0.02, 0.05, 0.1, 0.2]
+
+# per-node and per-leaf arrays of a tree in model.txt
+NODE_KEYS = ['split_feature', 'split_gain', 'threshold', 'decision_type', 'internal_value',
+             'internal_weight', 'internal_count']
+LEAF_KEYS = ['leaf_value', 'leaf_weight', 'leaf_count']
+
+FIELDS = ['trees', 'merge_tolerance', 'leaves', 'f1', 'auc', 'single_us', 'batch_us_per_row', 'pareto']
+
+# the latency is measured with the Model of the web service, run in a subprocess from there
+WEB_PROJECT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'web', 'project')
+
+# latency of Model.predict on one payload and of Model.predict_batch on all of them, for
+# every model file, printed as a JSON list. The models are timed in turn for several rounds,
+# and the best median of every model is kept, so that the warm-up of the process and the
+# drift of the machine do not favour the ones timed last.
+LATENCY_SCRIPT = """
+import json, os, sys, time
+os.environ['METRICS_ENABLED'] = '0'
+import numpy as np
+from model_predict import Model
+
+transformer_file, engine, payloads_file, rounds, *model_files = sys.argv[1:]
+with open(payloads_file) as f:
+    payloads = json.load(f)
+
+def median_latency(fn, repeat, warmup=10):
+    for _ in range(warmup):
+        fn()
+    latencies = np.empty(repeat)
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn()
+        latencies[i] = time.perf_counter() - start
+    return float(np.median(latencies))
+
+models = [Model(model_file=model_file, transformer_file=transformer_file, engine=engine) for model_file in model_files]
+results = [[np.inf, np.inf] for _ in models]
+for _ in range(int(rounds)):
+    for model, result in zip(models, results):
+        result[0] = min(result[0], median_latency(lambda: model.predict(payloads[0]), repeat=200) * 1e6)
+        result[1] = min(result[1], median_latency(lambda: model.predict_batch(payloads), repeat=20) * 1e6 / len(payloads))
+print(json.dumps(results))
+"""
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model', help='Directory of the model.txt and data_transformer.pkl to compact')
+    parser.add_argument('src', help='CSV File of labeled rows of Adult Census Income dataset the candidates are scored on')
+    parser.add_argument('--rows', default='validation', choices=['validation', 'all'],
+                        help='Scores the validation split of train.py on src, the CSV the model was trained on, '
+                             'or every row of src, a CSV held out from the training')
+    parser.add_argument('--out', default='frontier.csv', help='CSV File of every candidate and whether it is on the frontier')
+    parser.add_argument('--cutoffs', type=int, nargs='*', help='Numbers of trees to keep. Defaults to every tenth of the model.')
+    parser.add_argument('--tolerances', type=float, nargs='*', default=MERGE_TOLERANCES, help='Merge tolerances')
+    parser.add_argument('--engine', default='lightgbm', choices=['lightgbm', 'numpy'], help='Engine of the timed Model')
+    parser.add_argument('--latency', default='batch', choices=['single', 'batch'],
+                        help='Latency the frontier is computed on')
+    parser.add_argument('--batch-size', type=int, default=1000, help='Rows of the timed predict_batch calls')
+    parser.add_argument('--export', default=None, help='Directory the chosen candidate is exported to')
+    parser.add_argument('--max-auc-loss', type=float, default=None,
+                        help='Exports the fastest candidate of the frontier within this AUC of the whole model')
+    parser.add_argument('--trees', type=int, default=None, help='Exports the candidate with this many trees')
+    parser.add_argument('--merge-tolerance', type=float, default=0.0, help='Merge tolerance of the exported candidate')
+    args = parser.parse_args()
+
+    return args
+
+
+def split_model_string(model_str):
+    """
+    Returns:
+        tuple: (header lines, list of tree dicts in file order, lines from 'end of trees' on)
+    """
+    lines = model_str.split('\n')
+    end = lines.index('end of trees')
+    header = []
+    trees = []
+
+    for line in lines[:end]:
+        if line.startswith('Tree='):
+            trees.append({})
+        elif trees and '=' in line:
+            key, _, value = line.partition('=')
+            trees[-1][key] = value
+        elif not trees:
+            header.append(line)
+
+    return header, trees, lines[end:]
+
+
+def merge_leaves(tree, tolerance):
+    """Merges the sibling leaves of a tree dict of model.txt, until no such siblings are left,
+       as long as the original leaf values under the merged leaf differ by at most tolerance
+
+    Returns:
+        dict: New tree dict, with the nodes and leaves renumbered
+    """
+    if int(tree['num_leaves']) == 1 or int(tree.get('num_cat', 0)) > 0:
+        return tree
+
+    nodes = {key : tree[key].split(' ') for key in NODE_KEYS}
+    leaves = {key : tree[key].split(' ') for key in LEAF_KEYS}
+    left_child = [int(child) for child in tree['left_child'].split(' ')]
+    right_child = [int(child) for child in tree['right_child'].split(' ')]
+
+    # low and high are the smallest and largest original leaf values under a merged leaf, so
+    # that merges cascading up the tree never move a row by more than the tolerance
+    def leaf(value, weight, count, low, high):
+        return ('leaf', value, weight, count, low, high)
+
+    def collapse(node):
+        if node < 0:
+            value = float(leaves['leaf_value'][~node])
+            return leaf(value, float(leaves['leaf_weight'][~node]), int(leaves['leaf_count'][~node]), value, value)
+
+        left, right = collapse(left_child[node]), collapse(right_child[node])
+        if left[0] == 'leaf' and right[0] == 'leaf':
+            low, high = min(left[4], right[4]), max(left[5], right[5])
+            if high - low <= tolerance:
+                weight = left[2] + right[2]
+                value = (left[1] * left[2] + right[1] * right[2]) / weight if weight > 0 else (left[1] + right[1]) / 2
+                return leaf(value, weight, left[3] + right[3], low, high)
+        return ('node', node, left, right)
+
+    root = collapse(0)
+    if root[0] == 'leaf':
+        return {'num_leaves' : '1', 'num_cat' : '0', 'leaf_value' : repr(root[1]),
+                'is_linear' : tree.get('is_linear', '0'), 'shrinkage' : tree['shrinkage']}
+
+    new_nodes = {key : [] for key in NODE_KEYS + ['left_child', 'right_child']}
+    new_leaves = {key : [] for key in LEAF_KEYS}
+
+    def write(item):
+        if item[0] == 'leaf':
+            new_leaves['leaf_value'].append(repr(item[1]))
+            new_leaves['leaf_weight'].append(repr(item[2]))
+            new_leaves['leaf_count'].append(str(item[3]))
+            return ~(len(new_leaves['leaf_value']) - 1)
+
+        _, node, left, right = item
+        index = len(new_nodes['split_feature'])
+        for key in NODE_KEYS:
+            new_nodes[key].append(nodes[key][node])
+        new_nodes['left_child'].append(None)
+        new_nodes['right_child'].append(None)
+        new_nodes['left_child'][index] = str(write(left))
+        new_nodes['right_child'][index] = str(write(right))
+        return index
+
+    write(root)
+
+    new_tree = dict(tree)
+    new_tree['num_leaves'] = str(len(new_leaves['leaf_value']))
+    for key, values in list(new_nodes.items()) + list(new_leaves.items()):
+        new_tree[key] = ' '.join(values)
+    return new_tree
+
+
+def compact_model_string(model_str, trees, tolerance):
+    """Model string of the first `trees` trees of model_str, with their leaves merged"""
+    header, model_trees, trailer = split_model_string(model_str)
+
+    # the tree sizes are only an index for parallel loading, LightGBM reads the trees in
+    # order without them
+    lines = [line for line in header if not line.startswith('tree_sizes=')]
+    for index, tree in enumerate(model_trees[:trees]):
+        lines.append(f'Tree={index}')
+        lines.extend(f'{key}={value}' for key, value in merge_leaves(tree, tolerance).items())
+        lines.append('')
+    lines.append('')
+
+    return '\n'.join(lines + trailer)
+
+
+def read_rows(path):
+    df = pd.read_csv(path)
+    return df.applymap(lambda s:s.lower() if type(s) == str else s)
+
+
+def score_candidate(booster, df_transform):
+    """
+    Returns:
+        dict: leaves, f1 and auc of the candidate
+    """
+    label_col = feats_label_cols(df_transform)[1]
+    y_pred = booster.predict(df_transform[booster.feature_name()])
+    y_true = df_transform[label_col]
+
+    return {
+        'leaves' : sum(tree['num_leaves'] for tree in booster.dump_model()['tree_info']),
+        'f1' : scores(y_true, y_pred)['f1'],
+        'auc' : roc_auc_score(y_true, y_pred),
+    }
+
+
+def time_candidates(model_paths, transformer_path, payloads, engine, rounds=5):
+    """Latency of the Model of the web service with every model file, measured in a single
+       process started from web/project, whose utils and preprocess modules differ from
+       the ones of training
+
+    Returns:
+        list: (single_us, batch_us_per_row) of every model file
+    """
+    with tempfile.NamedTemporaryFile('w', suffix='.json') as f:
+        json.dump(payloads, f)
+        f.flush()
+        output = subprocess.run([sys.executable, '-c', LATENCY_SCRIPT, os.path.abspath(transformer_path), engine, f.name,
+                                 str(rounds), *[os.path.abspath(path) for path in model_paths]],
+                                cwd=WEB_PROJECT_DIR, check=True, stdout=subprocess.PIPE, text=True).stdout
+
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def pareto(candidates, latency_key):
+    """Marks the candidates that no other one beats on both latency_key and the AUC"""
+    for candidate in candidates:
+        candidate['pareto'] = not any(
+            other[latency_key] <= candidate[latency_key] and other['auc'] >= candidate['auc']
+            and (other[latency_key] < candidate[latency_key] or other['auc'] > candidate['auc'])
+            for other in candidates)
+    return candidates
+
+
+def sweep(model_str, transformer_path, df_transform, payloads, cutoffs, tolerances, engine='lightgbm',
+          latency_key='single_us'):
+    """Evaluates every (cutoff, tolerance) candidate of the model string
+
+    Returns:
+        list: One dict of FIELDS per candidate
+    """
+    candidates = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        model_paths = []
+        for trees in cutoffs:
+            for tolerance in tolerances:
+                candidate_str = compact_model_string(model_str, trees, tolerance)
+                model_paths.append(os.path.join(work_dir, f'model-{trees}-{tolerance}.txt'))
+                with open(model_paths[-1], 'w') as f:
+                    f.write(candidate_str)
+
+                candidate = {'trees' : trees, 'merge_tolerance' : tolerance}
+                candidate.update(score_candidate(lgb.Booster(model_str=candidate_str), df_transform))
+                candidates.append(candidate)
+
+        latencies = time_candidates(model_paths, transformer_path, payloads, engine)
+
+    for candidate, (single_us, batch_us_per_row) in zip(candidates, latencies):
+        candidate.update(single_us=single_us, batch_us_per_row=batch_us_per_row)
+    return pareto(candidates, latency_key)
+
+
+def write_frontier(candidates, path):
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(candidates)
+
+
+def choose(candidates, num_trees, max_auc_loss, latency_key):
+    """Fastest candidate of the frontier within max_auc_loss of the AUC of the whole model"""
+    full_auc = next(candidate['auc'] for candidate in candidates
+                    if candidate['trees'] == num_trees and candidate['merge_tolerance'] == 0)
+    within = [candidate for candidate in candidates if candidate['pareto'] and candidate['auc'] >= full_auc - max_auc_loss]
+    return min(within, key=lambda candidate: candidate[latency_key])
+
+
+def main():
+    args = get_args()
+
+    model_file = os.path.join(args.model, 'model.txt')
+    transformer_path = os.path.join(args.model, 'data_transformer.pkl')
+    with open(model_file) as f:
+        model_str = f.read()
+    with open(transformer_path, 'rb') as f:
+        data_transformer = pickle.load(f)
+
+    df = read_rows(args.src)
+    if args.rows == 'validation':
+        # the same rows as the validation split of train.py, which shuffles the encoded rows
+        # in the order of the CSV
+        df = split_ds(shuffle_ds(df))[1]
+    df_transform = data_transformer.transform(df)
+    payloads = json.loads(df.drop(columns=['income'])[:args.batch_size].to_json(orient='records'))
+
+    num_trees = lgb.Booster(model_str=model_str).num_trees()
+    # the whole model, without merging, is the reference of --max-auc-loss
+    cutoffs = sorted({min(max(1, trees), num_trees) for trees in args.cutoffs or
+                      [num_trees * step // 10 for step in range(1, 11)]} | {num_trees})
+    tolerances = sorted(set(args.tolerances) | {0.0})
+    latency_key = 'single_us' if args.latency == 'single' else 'batch_us_per_row'
+
+    if args.trees is not None:
+        chosen = {'trees' : args.trees, 'merge_tolerance' : args.merge_tolerance}
+    else:
+        print(f'Sweeping {len(cutoffs)} cut-offs and {len(tolerances)} merge tolerances of {num_trees} trees')
+        candidates = sweep(model_str, transformer_path, df_transform, payloads, cutoffs, tolerances, args.engine,
+                           latency_key)
+        write_frontier(candidates, args.out)
+        print(f'Frontier written to {args.out}')
+
+        frontier = sorted((c for c in candidates if c['pareto']), key=lambda candidate: candidate[latency_key])
+        print(f'{"trees":>6}  {"merge":>6}  {"leaves":>6}  {"f1":>6}  {"auc":>6}  {"single us":>9}  {"batch us/row":>12}')
+        for c in frontier:
+            print(f'{c["trees"]:>6}  {c["merge_tolerance"]:>6}  {c["leaves"]:>6}  {c["f1"]:6.4f}  {c["auc"]:6.4f}  '
+                  f'{c["single_us"]:9.1f}  {c["batch_us_per_row"]:12.2f}')
+
+        if args.max_auc_loss is None:
+            return
+        chosen = choose(candidates, num_trees, args.max_auc_loss, latency_key)
+
+    if args.export is None:
+        return
+
+    clf = lgb.Booster(model_str=compact_model_string(model_str, chosen['trees'], chosen['merge_tolerance']))
+    print('')
+    print(f'Evaluating the model with {chosen["trees"]} trees and merge tolerance {chosen["merge_tolerance"]}')
+    evaluate_on_ds(clf, df_transform, clf.feature_name(), feats_label_cols(df_transform)[1], msg='Scored Rows')
+
+    print('')
+    print(f'Saving Model and Transformer to Directory {args.export}')
+    pickle_path, model_path, bundle_path = save_model_transformer(clf, data_transformer, args.export)
+
+    print('Pickle Saved to ', pickle_path)
+    print('Model Saved to ', model_path)
+    print('Bundle Saved to ', bundle_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""
+Cache of the preprocessed training data, so that train.py only parses and encodes
+adult.csv when it or the preprocessing changed.
+
+An entry is keyed by the content hash of the CSV, of preprocess.py and binning.py (the columns,
+the ranges and the code of the DataTransformer) and of this module with utils.shuffle_ds (the
+reading and the shuffle of read_transform), and holds:
+
+- data_transformer.pkl: the fitted DataTransformer
+- data.npy: the encoded and shuffled dataset, memory-mapped by later runs
+- columns.json: its column names
+- lgb-<digest>-<max_bin>.bin: LightGBM binary datasets (save_binary) of the matrices given
+  to lgb_dataset, keyed by their content and the max_bin of their binning
+
+    .dataset_cache/
+        3f9a2c...           data_transformer.pkl  data.npy  columns.json  lgb-81c0...-50.bin
+"""
+
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import shutil
+
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+
+import binning
+import preprocess
+from utils import save_pickle, shuffle_ds, SHUFFLE_SEED
+
+
+# 2: shuffled with utils.SHUFFLE_SEED
+CACHE_FORMAT = 2
+
+
+def file_digest(path, digest=None):
+    digest = digest or hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest
+
+
+def cache_key(csv_path):
+    """Changes whenever the CSV, the code of the transformer, of read_transform or the format of the cache changes"""
+    digest = hashlib.sha1(f'dataset-cache-{CACHE_FORMAT}'.encode())
+    file_digest(csv_path, digest)
+    file_digest(preprocess.__file__, digest)
+    file_digest(binning.__file__, digest)
+    file_digest(__file__, digest)
+    digest.update(f'{inspect.getsource(shuffle_ds)}{SHUFFLE_SEED}'.encode())
+    return digest.hexdigest()
+
+
+def read_transform(path, data_transformer):
+    """Fits data_transformer on the CSV and returns the encoded and shuffled dataset,
+       as saved in the cache (its code is part of cache_key)
+    """
+    df = pd.read_csv(path)
+    df = df.applymap(lambda s:s.lower() if type(s) == str else s)
+
+    df_transform = data_transformer.fit_transform(df)
+    return shuffle_ds(df_transform)
+
+
+class DatasetCache:
+
+    def __init__(self, cache_dir, csv_path):
+        self.cache_dir = cache_dir
+        self.key = cache_key(csv_path)
+        self.path = os.path.join(cache_dir, self.key[:16])
+
+    def exists(self):
+        return os.path.isdir(self.path)
+
+    def save(self, data_transformer, df_transform):
+        """Saves the fitted transformer and the encoded dataset"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # a concurrent or interrupted run never leaves a partial entry
+        tmp_path = os.path.join(self.cache_dir, f'.{self.key[:16]}.{os.getpid()}')
+        os.makedirs(tmp_path)
+        save_pickle(data_transformer, os.path.join(tmp_path, 'data_transformer.pkl'))
+        np.save(os.path.join(tmp_path, 'data.npy'), df_transform.to_numpy())
+        with open(os.path.join(tmp_path, 'columns.json'), 'w') as f:
+            json.dump(df_transform.columns.tolist(), f)
+
+        try:
+            os.rename(tmp_path, self.path)
+        except OSError:
+            # saved by another run in the meantime
+            shutil.rmtree(tmp_path)
+
+    def load(self):
+        """
+        Returns:
+            tuple: (fitted DataTransformer, encoded dataset over the memory-mapped data.npy)
+        """
+        with open(os.path.join(self.path, 'data_transformer.pkl'), 'rb') as f:
+            data_transformer = pickle.load(f)
+        with open(os.path.join(self.path, 'columns.json')) as f:
+            columns = json.load(f)
+
+        data = np.load(os.path.join(self.path, 'data.npy'), mmap_mode='r')
+        return data_transformer, pd.DataFrame(data, columns=columns, copy=False)
+
+    def lgb_binary(self, X, y, max_bin):
+        """Path of the binary file of the lgb.Dataset of (X, y), saved if a previous run did not"""
+        digest = hashlib.sha1(np.ascontiguousarray(X).tobytes())
+        digest.update(np.ascontiguousarray(y).tobytes())
+        digest.update(json.dumps(list(X.columns)).encode())
+        bin_path = os.path.join(self.path, f'lgb-{digest.hexdigest()[:16]}-{max_bin}.bin')
+
+        if not os.path.exists(bin_path):
+            save_lgb_binary(X, y, max_bin, bin_path)
+        return bin_path
+
+    def lgb_dataset(self, X, y, max_bin):
+        """Constructed lgb.Dataset of (X, y), loaded from its binary file (lgb_binary)"""
+        return load_lgb_binary(self.lgb_binary(X, y, max_bin), max_bin)
+
+
+def lgb_dataset_params(max_bin):
+    """feature_pre_filter is disabled so that min_data_in_leaf can vary between the trainings
+       sharing a Dataset
+    """
+    return {'max_bin' : max_bin, 'feature_pre_filter' : False, 'verbose' : -1}
+
+
+def save_lgb_binary(X, y, max_bin, bin_path):
+    dataset = lgb.Dataset(X, label=y, params=lgb_dataset_params(max_bin)).construct()
+
+    # a concurrent or interrupted run never leaves a partial file
+    tmp_path = f'{bin_path}.{os.getpid()}'
+    dataset.save_binary(tmp_path)
+    os.replace(tmp_path, bin_path)
+    return bin_path
+
+
+def load_lgb_binary(bin_path, max_bin):
+    return lgb.Dataset(bin_path, params=lgb_dataset_params(max_bin)).construct()
@@ -0,0 +1,123 @@
+import numpy as np
+
+from binning import get_range, get_range_vectorized
+
+
+class FeatureEncoder:
+    """Serving-time encoder compiled from a fitted DataTransformer. The classes of every
+       LabelEncoder become a plain dict lookup, so validated payloads are encoded straight
+       into numeric rows, without sklearn or pandas.
+    """
+
+    def __init__(self, categories : list, ranges : list, feature_names : list = None):
+        """
+        Args:
+            categories (list): (column, classes) of every label encoded feature
+            ranges (list): (column, scale, num_range) of every ordinal feature
+            feature_names (list, optional): Column order of the encoded rows. Defaults to
+                                            the categorical columns followed by the ordinal ones.
+        """
+        self.categories = categories
+        self.ranges = ranges
+
+        default_names = [col for col, _ in categories] + [col for col, _, _ in ranges]
+        if feature_names is None:
+            feature_names = default_names
+        if sorted(feature_names) != sorted(default_names):
+            raise ValueError(f'feature_names {feature_names} do not match the encoded columns {default_names}')
+
+        self.feature_names = list(feature_names)
+        position = {col : idx for idx, col in enumerate(self.feature_names)}
+
+        self.lookups = [(col, {value : code for code, value in enumerate(classes)}, position[col])
+                        for col, classes in categories]
+        self.bins = [(col, scale, num_range, position[col]) for col, scale, num_range in ranges]
+
+    @classmethod
+    def from_transformer(cls, data_transformer, feature_names : list = None):
+        """Compiles the encoder of a fitted DataTransformer. By default the output columns
+           follow the column order of DataTransformer.transform_features
+
+        Args:
+            data_transformer (DataTransformer): Fitted DataTransformer
+            feature_names (list, optional): Column order of the encoded rows (i.e. Booster.feature_name())
+
+        Returns:
+            FeatureEncoder: Compiled encoder
+        """
+        categories = [(col, encoder.classes_.tolist())
+                      for col, encoder in data_transformer.cat_transformer.transformers[0:-1]]
+
+        ord_transformer = data_transformer.ord_transformer
+        ranges = [(col, *ord_transformer.ranges[col]) for col, _ in ord_transformer.transformers]
+
+        return cls(categories, ranges, feature_names)
+
+    def unseen_labels_error(self, records : list) -> ValueError:
+        """Builds the error raised when a categorical value was never seen during fit"""
+        for col, table, _ in self.lookups:
+            for record in records:
+                value = record[col]
+                if not isinstance(value, str) or value not in table:
+                    return ValueError(f'{col} contains previously unseen label: {value!r}')
+        return ValueError('payload contains previously unseen labels')
+
+    def encode_into(self, record : dict, out : np.ndarray) -> np.ndarray:
+        """Encodes a single validated payload into a preallocated row
+
+        Args:
+            record (dict): Validated payload
+            out (np.ndarray): Row of len(feature_names) to be filled
+
+        Returns:
+            np.ndarray: The filled row
+        """
+        try:
+            for col, table, idx in self.lookups:
+                out[idx] = table[record[col]]
+        except (KeyError, TypeError):
+            raise self.unseen_labels_error([record])
+
+        for col, scale, num_range, idx in self.bins:
+            out[idx] = get_range(record[col], scale, num_range)
+
+        return out
+
+    def encode(self, record : dict) -> np.ndarray:
+        """Encodes a single validated payload
+
+        Args:
+            record (dict): Validated payload
+
+        Returns:
+            np.ndarray: float64 matrix of shape (1, len(feature_names))
+        """
+        out = np.empty((1, len(self.feature_names)), dtype=np.float64)
+        self.encode_into(record, out[0])
+        return out
+
+    def encode_batch(self, records : list, out : np.ndarray = None) -> np.ndarray:
+        """Encodes multiple validated payloads, one column at a time
+
+        Args:
+            records (list): Validated payloads
+            out (np.ndarray, optional): float64 matrix of the output shape to be written into,
+                                        i.e. a buffer in shared memory. Allocated if None.
+
+        Returns:
+            np.ndarray: float64 matrix of shape (len(records), len(feature_names))
+        """
+        if out is None:
+            out = np.empty((len(records), len(self.feature_names)), dtype=np.float64)
+
+        try:
+            for col, table, idx in self.lookups:
+                out[:, idx] = [table[record[col]] for record in records]
+        except (KeyError, TypeError):
+            raise self.unseen_labels_error(records)
+
+        for col, scale, num_range, idx in self.bins:
+            values = np.fromiter((record[col] for record in records), dtype=np.float64, count=len(records))
+            out[:, idx] = get_range_vectorized(values, scale, num_range)
+
+        return out
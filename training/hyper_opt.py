@@ -1,7 +1,51 @@
-from bayes_opt import BayesianOptimization
+from bayes_opt import BayesianOptimization, UtilityFunction
 
 import lightgbm as lgb
+import multiprocessing
+import numpy as np
 import pandas as pd
+import os
+import queue
+import tempfile
+
+from dataset_cache import save_lgb_binary, load_lgb_binary
+
+
+HYPER_BOUNDS = {
+        'learning_rate': (0.01, 1.0),
+        'num_leaves': (24, 80),
+        'feature_fraction': (0.1, 0.9),
+        'bagging_fraction': (0.8, 1),
+        'max_depth': (5, 30),
+        'max_bin':(20,90),
+        'min_data_in_leaf': (20, 80),
+        'min_sum_hessian_in_leaf':(0,100),
+        'subsample': (0.01, 1.0)
+}
+
+# the binning of a Dataset cannot change once it is constructed, so the parallel search
+# rounds max_bin to a multiple of this step and constructs one Dataset per value
+MAX_BIN_STEP = 10
+
+# exploration of the concurrent suggestions, one per pending trial, so that the trials
+# running at the same time do not evaluate the same point
+KAPPAS = [2.576, 1.0, 5.0, 10.0]
+
+
+def lgb_params(learning_rate,num_leaves, feature_fraction, bagging_fraction, max_depth, max_bin, min_data_in_leaf,min_sum_hessian_in_leaf,subsample):
+    return {
+        'application':'binary',
+        'metric':'auc',
+        'learning_rate' : max(min(learning_rate, 1), 0),
+        'num_leaves' : int(round(num_leaves)),
+        'feature_fraction' : max(min(feature_fraction, 1), 0),
+        'bagging_fraction' : max(min(bagging_fraction, 1), 0),
+        'max_depth' : int(round(max_depth)),
+        'max_bin' : int(round(max_bin)),
+        'min_data_in_leaf' : int(round(min_data_in_leaf)),
+        'min_sum_hessian_in_leaf' : min_sum_hessian_in_leaf,
+        'subsample' : max(min(subsample, 1), 0)
+    }
 
 
 def tune_lgb_hyperparams(X,y, init_round=15, opt_round=25, n_folds=3):
@@ -9,37 +53,13 @@ def tune_lgb_hyperparams(X,y, init_round=15, opt_round=25, n_folds=3):
     train_data = lgb.Dataset(data=X, label=y, free_raw_data=False)
     
     # parameters
-    def lgb_eval(learning_rate,num_leaves, feature_fraction, bagging_fraction, max_depth, max_bin, min_data_in_leaf,min_sum_hessian_in_leaf,subsample):
-        params = {
-            'application':'binary', 
-            'metric':'auc',
-            'learning_rate' : max(min(learning_rate, 1), 0),
-            'num_leaves' : int(round(num_leaves)),
-            'feature_fraction' : max(min(feature_fraction, 1), 0),
-            'bagging_fraction' : max(min(bagging_fraction, 1), 0),
-            'max_depth' : int(round(max_depth)),
-            'max_bin' : int(round(max_bin)),
-            'min_data_in_leaf' : int(round(min_data_in_leaf)),
-            'min_sum_hessian_in_leaf' : min_sum_hessian_in_leaf,
-            'subsample' : max(min(subsample, 1), 0)
-        }
+    def lgb_eval(**point):
+        params = lgb_params(**point)
 
         cv_result = lgb.cv(params, train_data, nfold=n_folds, stratified=True, verbose_eval=False, metrics=['auc'])
         return max(cv_result['auc-mean'])
 
-    hyper_bounds = {
-            'learning_rate': (0.01, 1.0),
-            'num_leaves': (24, 80),
-            'feature_fraction': (0.1, 0.9),
-            'bagging_fraction': (0.8, 1),
-            'max_depth': (5, 30),
-            'max_bin':(20,90),
-            'min_data_in_leaf': (20, 80),
-            'min_sum_hessian_in_leaf':(0,100),
-            'subsample': (0.01, 1.0)
-    }
-    
-    lgb_bayes_opt = BayesianOptimization(lgb_eval, hyper_bounds)
+    lgb_bayes_opt = BayesianOptimization(lgb_eval, HYPER_BOUNDS)
     lgb_bayes_opt.maximize(init_points=init_round, n_iter=opt_round)
     
     model_auc=[]
@@ -56,6 +76,200 @@ def tune_lgb_hyperparams(X,y, init_round=15, opt_round=25, n_folds=3):
     return parse_parameters(params)
 
 
+def snap_max_bin(point):
+    point = dict(point)
+    low, high = HYPER_BOUNDS['max_bin']
+    point['max_bin'] = min(max(round(point['max_bin'] / MAX_BIN_STEP) * MAX_BIN_STEP, low), high)
+    return point
+
+
+def max_bin_values():
+    low, high = HYPER_BOUNDS['max_bin']
+    return sorted({snap_max_bin({'max_bin' : value})['max_bin'] for value in range(low, high + 1)})
+
+
+def median_pruning(reference, warmup_rounds, interval, state):
+    """lgb.cv callback stopping a trial whose best mean AUC so far is below the median of the
+       finished trials at the same round
+
+    Args:
+        reference (np.ndarray): Median best mean AUC of the finished trials at every round
+        warmup_rounds (int): Rounds before the first check
+        interval (int): Rounds between two checks
+        state (dict): Set to {'pruned' : True} when the trial is stopped
+    """
+    best = {'score' : -np.inf, 'iteration' : 0, 'result' : None}
+
+    def callback(env):
+        score = next(result[2] for result in env.evaluation_result_list if result[1] == 'auc')
+        if score > best['score']:
+            best.update(score=score, iteration=env.iteration, result=env.evaluation_result_list)
+
+        rounds = env.iteration + 1
+        if rounds >= warmup_rounds and rounds % interval == 0 and best['score'] < reference[min(rounds, len(reference)) - 1]:
+            state['pruned'] = True
+            raise lgb.callback.EarlyStopException(best['iteration'], best['result'])
+
+    callback.order = 40
+    return callback
+
+
+# settings of the search and Datasets loaded so far, set in every worker by init_worker
+search = {}
+
+
+def init_worker(settings):
+    search.update(settings, datasets={})
+
+
+def trial_dataset(max_bin):
+    """Dataset of the training set binned with max_bin, loaded once per worker from the
+       file saved by tune_lgb_hyperparams_parallel
+    """
+    if max_bin not in search['datasets']:
+        search['datasets'][max_bin] = load_lgb_binary(search['bin_paths'][max_bin], max_bin)
+    return search['datasets'][max_bin]
+
+
+def cv_trial(point, reference):
+    """Cross-validates one point of the search, in a pool worker
+
+    Returns:
+        dict: best mean AUC (target), its cumulative maximum at every round (curve) and whether it was pruned
+    """
+    params = lgb_params(**point)
+    params.update(search['params'])
+    state = {'pruned' : False}
+
+    callbacks = []
+    if reference is not None:
+        callbacks.append(median_pruning(reference, search['prune_warmup'], search['prune_interval'], state))
+
+    cv_result = lgb.cv(params, trial_dataset(params['max_bin']), num_boost_round=search['num_boost_round'],
+                       nfold=search['n_folds'], stratified=True, verbose_eval=False, metrics=['auc'],
+                       early_stopping_rounds=search['early_stopping_rounds'], callbacks=callbacks,
+                       seed=search['seed'])
+
+    curve = np.maximum.accumulate(cv_result['auc-mean'])
+    return {'target' : float(curve[-1]), 'curve' : curve, 'pruned' : state['pruned']}
+
+
+def median_curve(curves, num_boost_round):
+    """Median over the finished trials of their best mean AUC at every round, a trial
+       that stopped early keeping its last value
+    """
+    padded = [np.pad(curve, (0, num_boost_round - len(curve)), mode='edge') for curve in curves]
+    return np.median(padded, axis=0)
+
+
+def tune_lgb_hyperparams_parallel(X, y, init_round=15, opt_round=25, n_folds=3, workers=None, threads=None,
+                                  num_boost_round=500, early_stopping_rounds=30, prune_min_trials=5,
+                                  prune_warmup=30, prune_interval=10, random_state=None, history=None,
+                                  dataset_cache=None):
+    """Same search space and budget (init_round + opt_round trials) as tune_lgb_hyperparams,
+       with the trials evaluated in a pool of processes as soon as one is free. Every trial
+       stops at the round where the mean AUC of its folds stops improving (early_stopping_rounds),
+       and is pruned when its best mean AUC is below the median of the finished trials
+       at the same round, once prune_min_trials trials are finished. A trial that raises
+       is printed and skipped, the search continues with the others.
+
+    Args:
+        X: Features of the training set
+        y: Labels of the training set
+        init_round (int, optional): Random trials. Defaults to 15.
+        opt_round (int, optional): Trials suggested by the Gaussian process. Defaults to 25.
+        n_folds (int, optional): Folds of every trial. Defaults to 3.
+        workers (int, optional): Trials running at the same time. Defaults to the number of cores.
+        threads (int, optional): LightGBM threads of every trial. Defaults to cores / workers.
+        num_boost_round (int, optional): Maximum rounds of a trial. Defaults to 500.
+        early_stopping_rounds (int, optional): Defaults to 30.
+        prune_min_trials (int, optional): Finished trials before pruning. Defaults to 5.
+        prune_warmup (int, optional): Rounds of a trial before it can be pruned. Defaults to 30.
+        prune_interval (int, optional): Rounds between two pruning checks. Defaults to 10.
+        random_state (int, optional): Seed of the random trials and of the folds.
+        history (list, optional): Appended with the (point, result) of every finished trial.
+        dataset_cache (DatasetCache, optional): Keeps the binary files of the Datasets in the cache,
+                                                instead of a temporary directory.
+
+    Returns:
+        dict: Parameters of the best trial, as returned by tune_lgb_hyperparams
+    """
+    cores = len(os.sched_getaffinity(0))
+    workers = workers or cores
+    threads = threads or max(1, cores // workers)
+    budget = init_round + opt_round
+    rng = np.random.RandomState(random_state)
+
+    optimizer = BayesianOptimization(f=None, pbounds=HYPER_BOUNDS, random_state=random_state, verbose=0)
+    curves = []
+    results = []
+    done = queue.Queue()
+    pending = 0
+
+    def suggest(submitted):
+        if submitted < init_round or len(optimizer.space) == 0:
+            point = {key : rng.uniform(low, high) for key, (low, high) in HYPER_BOUNDS.items()}
+        else:
+            point = optimizer.suggest(UtilityFunction(kind='ucb', kappa=KAPPAS[pending % len(KAPPAS)], xi=0.0))
+        return snap_max_bin(point)
+
+    # the binning is shared by every trial with the same max_bin, and by the folds of a trial.
+    # Every Dataset is constructed once, saved with save_binary and loaded by the workers.
+    # They are spawned rather than forked: constructing a Dataset starts the OpenMP threads
+    # of LightGBM, and libgomp hangs in a child forked from a process that used them.
+    bin_dir = tempfile.TemporaryDirectory()
+    if dataset_cache is not None:
+        bin_paths = {max_bin : dataset_cache.lgb_binary(X, y, max_bin) for max_bin in max_bin_values()}
+    else:
+        bin_paths = {
+            max_bin : save_lgb_binary(X, y, max_bin, os.path.join(bin_dir.name, f'{max_bin}.bin'))
+            for max_bin in max_bin_values()
+        }
+    settings = dict(bin_paths=bin_paths, n_folds=n_folds, num_boost_round=num_boost_round,
+                    early_stopping_rounds=early_stopping_rounds, prune_warmup=prune_warmup,
+                    prune_interval=prune_interval, seed=0 if random_state is None else random_state,
+                    params={'num_threads' : threads, 'verbose' : -1})
+
+    context = multiprocessing.get_context('spawn')
+    with bin_dir, context.Pool(workers, initializer=init_worker, initargs=(settings,)) as pool:
+        submitted = 0
+        failed = 0
+        while submitted < budget or pending > 0:
+            while submitted < budget and pending < workers:
+                point = suggest(submitted)
+                reference = median_curve(curves, num_boost_round) if len(curves) >= prune_min_trials else None
+                pool.apply_async(cv_trial, (point, reference),
+                                 callback=lambda result, point=point: done.put((point, result)),
+                                 error_callback=lambda error, point=point: done.put((point, error)))
+                submitted += 1
+                pending += 1
+
+            point, result = done.get()
+            pending -= 1
+            if isinstance(result, Exception):
+                # a trial that fails is skipped, the finished ones are kept
+                print(f'trial failed with {result!r}: {point}')
+                failed += 1
+                continue
+
+            if not result['pruned']:
+                curves.append(result['curve'])
+            results.append((result['target'], point))
+            if history is not None:
+                history.append((point, result))
+
+            try:
+                optimizer.register(params=point, target=result['target'])
+            except KeyError:
+                # the same point suggested twice
+                pass
+
+    if not results:
+        raise RuntimeError(f'the {failed} trials of the search failed')
+    target, point = max(results, key=lambda result: result[0])
+    return parse_parameters((target, dict(point)))
+
+
 def parse_parameters(opt_params):
 
     opt_params[1]["num_leaves"] = int(round(opt_params[1]["num_leaves"]))
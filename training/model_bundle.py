@@ -0,0 +1,128 @@
+"""
+Startup-optimized artifact of a model/transformer pair: a single .npz of plain arrays,
+without any pickle, so that a worker loads it without importing sklearn or pandas.
+
+- model_string: bytes of the LightGBM model.txt
+- feature_names: column order of the booster
+- categorical_columns, categories_<i>: classes of the LabelEncoder of every categorical column
+- ordinal_columns, ordinal_scale, ordinal_num_range: bins of the OrdinalTransformer
+
+training/utils.save_model_transformer writes it next to model.txt and data_transformer.pkl,
+with the copy of this module in training/ (kept identical, like preprocess.py), so that the
+format has a single writer.
+It can also be built from existing artifacts (unpickling the transformer needs sklearn):
+
+Use: python model_bundle.py dependencies/model.txt dependencies/data_transformer.pkl dependencies/model_bundle.npz
+"""
+
+import argparse
+import hashlib
+
+import numpy as np
+
+from feature_encoder import FeatureEncoder
+
+
+FORMAT_VERSION = 1
+
+
+class ModelBundle:
+
+    def __init__(self, model_bytes : bytes, feature_names : list, categories : list, ranges : list):
+        """
+        Args:
+            model_bytes (bytes): Content of the LightGBM model.txt
+            feature_names (list): Column order of the booster
+            categories (list): (column, classes) of every label encoded feature
+            ranges (list): (column, scale, num_range) of every ordinal feature
+        """
+        self.model_bytes = model_bytes
+        self.feature_names = feature_names
+        self.categories = categories
+        self.ranges = ranges
+
+    @property
+    def model_string(self) -> str:
+        return self.model_bytes.decode('utf-8')
+
+    @property
+    def model_digest(self) -> str:
+        """sha1 of the model.txt, same as score_table.file_digest of the original file"""
+        return hashlib.sha1(self.model_bytes).hexdigest()
+
+    def encoder(self) -> FeatureEncoder:
+        return FeatureEncoder(self.categories, self.ranges, self.feature_names)
+
+    @classmethod
+    def from_transformer(cls, model_file : str, data_transformer):
+        """Bundles a model.txt and its fitted DataTransformer"""
+        with open(model_file, 'rb') as f:
+            model_bytes = f.read()
+
+        encoder = FeatureEncoder.from_transformer(data_transformer)
+        header = model_bytes[:model_bytes.index(b'\nTree=')].decode('utf-8')
+        feature_names = next(line.split('=', 1)[1].split(' ') for line in header.splitlines()
+                             if line.startswith('feature_names='))
+
+        return cls(model_bytes, feature_names, encoder.categories, encoder.ranges)
+
+    @classmethod
+    def from_artifacts(cls, model_file : str, transformer_file : str):
+        """Bundles an existing model.txt and data_transformer.pkl"""
+        from utils import load_pickle
+
+        return cls.from_transformer(model_file, load_pickle(transformer_file))
+
+    def save(self, path : str):
+        arrays = {
+            'format_version' : np.array(FORMAT_VERSION),
+            'model_string' : np.frombuffer(self.model_bytes, dtype=np.uint8),
+            'feature_names' : np.array(self.feature_names),
+            'categorical_columns' : np.array([col for col, _ in self.categories]),
+            'ordinal_columns' : np.array([col for col, _, _ in self.ranges]),
+            'ordinal_scale' : np.array([scale for _, scale, _ in self.ranges], dtype=np.float64),
+            'ordinal_num_range' : np.array([num_range for _, _, num_range in self.ranges], dtype=np.int64)
+        }
+        for idx, (_, classes) in enumerate(self.categories):
+            arrays[f'categories_{idx}'] = np.array(classes)
+
+        with open(path, 'wb') as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, path : str):
+        with np.load(path) as arrays:
+            if int(arrays['format_version']) != FORMAT_VERSION:
+                raise ValueError(f'{path} has format version {int(arrays["format_version"])}, '
+                                 f'expected {FORMAT_VERSION}')
+
+            categories = [(col, arrays[f'categories_{idx}'].tolist())
+                          for idx, col in enumerate(arrays['categorical_columns'].tolist())]
+            ranges = list(zip(arrays['ordinal_columns'].tolist(),
+                              arrays['ordinal_scale'].tolist(),
+                              arrays['ordinal_num_range'].tolist()))
+
+            return cls(arrays['model_string'].tobytes(), arrays['feature_names'].tolist(), categories, ranges)
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model', help='LightGBM model.txt')
+    parser.add_argument('transformer', help='Pickled DataTransformer')
+    parser.add_argument('dst', help='Destination .npz of the bundle')
+    args = parser.parse_args()
+
+    return args
+
+
+def main():
+    args = get_args()
+
+    bundle = ModelBundle.from_artifacts(args.model, args.transformer)
+    bundle.save(args.dst)
+
+    print(f'Bundle of {args.model} and {args.transformer} saved to {args.dst}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""
+Incremental retraining of a trained model on a batch of new labeled rows, without the
+hyperparameter search and without the rows it was trained on.
+
+The model.txt and data_transformer.pkl of the base model are loaded. The categorical values
+never seen by its LabelEncoders are appended to their classes (DataTransformer.extend), so
+every known value keeps its code. The new rows are then used to:
+
+- continue: add trees to the base model (init_model), with its trained parameters, until the
+            AUC of the validation split of the new rows stops improving
+- refit: keep the trees of the base model and refit their leaf values on the new rows
+         (Booster.refit), the old values weighted by decay_rate
+
+The new version is written to its own directory, like train.py, with a retrain.json naming
+its base, so it can be published to the model registry of the web service. The web service
+only accepts the categorical values of its reference json (REF_JSON), so a
+standard_payload.json with the new values added is written there as well.
+
+Use: python retrain.py new_rows.csv model/ model_v2/ --mode continue
+"""
+
+import argparse
+import json
+import os
+import pickle
+import time
+
+import lightgbm as lgb
+import pandas as pd
+
+from utils import split_ds, feats_label_cols, evaluate_model, save_model_transformer
+
+
+# parameters of train.py (hyper_opt.lgb_params and parse_parameters) kept by the new trees
+TRAINED_PARAMS = [
+    'objective', 'metric', 'learning_rate', 'num_leaves', 'max_depth', 'max_bin', 'min_data_in_leaf',
+    'min_sum_hessian_in_leaf', 'feature_fraction', 'bagging_fraction', 'is_unbalance', 'boost_from_average'
+]
+
+# saved as 0/1 in model.txt, but only read as true/false
+BOOL_PARAMS = ['is_unbalance', 'boost_from_average']
+
+REF_JSON = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'web', 'project', 'dependencies',
+                        'standard_payload.json')
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('src', help='CSV File of the new labeled rows of Adult Census Income dataset.')
+    parser.add_argument('base', help='Directory of the model.txt and data_transformer.pkl to start from')
+    parser.add_argument('dst', help='Destination directory of the new version')
+    parser.add_argument('--mode', choices=['continue', 'refit'], default='continue',
+                        help='Adds trees to the base model, or refits the leaf values of its trees')
+    parser.add_argument('--num-round', type=int, default=1000, help='Maximum trees added by --mode continue')
+    parser.add_argument('--early-stopping-rounds', type=int, default=50)
+    parser.add_argument('--decay-rate', type=float, default=0.9,
+                        help='Weight of the old leaf values with --mode refit')
+    parser.add_argument('--ref-json', default=REF_JSON,
+                        help='Reference json of the payloads accepted by the web service, written to dst with the new values')
+    args = parser.parse_args()
+
+    return args
+
+
+def trained_params(model_path):
+    """TRAINED_PARAMS of a model, read from the parameters section of its model.txt, since a
+       Booster loaded from a file does not have them
+    """
+    params = {}
+    with open(model_path) as f:
+        lines = iter(f)
+        for line in lines:
+            if line.strip() == 'parameters:':
+                break
+        for line in lines:
+            if line.strip() == 'end of parameters':
+                break
+            key, _, value = line.strip()[1:-1].partition(':')
+            if key in BOOL_PARAMS:
+                params[key] = 'true' if value.strip() == '1' else 'false'
+            elif key in TRAINED_PARAMS:
+                params[key] = value.strip()
+
+    return params
+
+
+def load_base(base_dir):
+    """
+    Returns:
+        tuple: (Booster, DataTransformer, trained parameters)
+    """
+    model_path = os.path.join(base_dir, 'model.txt')
+    with open(os.path.join(base_dir, 'data_transformer.pkl'), 'rb') as f:
+        data_transformer = pickle.load(f)
+
+    return lgb.Booster(model_file=model_path), data_transformer, trained_params(model_path)
+
+
+def extend_ref_json(ref_json, added):
+    """Reference json of the web service (standard_payload.json) also accepting the new
+       categorical values returned by DataTransformer.extend
+    """
+    with open(ref_json) as f:
+        ref = json.load(f)
+
+    for col, values in added.items():
+        # a missing value is not a category of the payload
+        values = {value for value in values if isinstance(value, str)}
+        ref['categorical_data'][col] = sorted(set(ref['categorical_data'][col]) | values)
+    return ref
+
+
+def read_new_rows(path):
+    df = pd.read_csv(path)
+    return df.applymap(lambda s:s.lower() if type(s) == str else s)
+
+
+def retrain(df, booster, data_transformer, params, mode='continue', num_round=1000, early_stopping_rounds=50,
+            decay_rate=0.9):
+    """Trains a new version of booster on the new rows df, see the module docstring
+
+    Returns:
+        tuple: (Booster, extended DataTransformer, (df_tr, df_val, df_ts) of the new rows, new categorical values)
+    """
+    added = data_transformer.extend(df)
+
+    df_transform = data_transformer.transform(df)
+    df_transform = df_transform.sample(frac=1.0).reset_index(drop=True)
+    df_tr, df_val, df_ts = split_ds(df_transform)
+
+    # the columns in the order of the base model
+    feats_col, label_col = booster.feature_name(), feats_label_cols(df_tr)[1]
+
+    if mode == 'refit':
+        clf = booster.refit(df_tr[feats_col], df_tr[label_col], decay_rate=decay_rate)
+        return clf, data_transformer, (df_tr, df_val, df_ts), added
+
+    tr_data = lgb.Dataset(df_tr[feats_col], label=df_tr[label_col])
+    val_data = lgb.Dataset(df_val[feats_col], label=df_val[label_col], reference=tr_data)
+
+    clf = lgb.train(dict(params, verbose=-1),
+                    tr_data,
+                    num_round,
+                    init_model=booster,
+                    valid_sets = [val_data],
+                    verbose_eval=False,
+                    early_stopping_rounds = early_stopping_rounds)
+
+    return clf, data_transformer, (df_tr, df_val, df_ts), added
+
+
+def main():
+    args = get_args()
+
+    start = time.perf_counter()
+    booster, data_transformer, params = load_base(args.base)
+    df = read_new_rows(args.src)
+
+    print(f'Retraining {args.base} ({booster.num_trees()} trees) on {len(df)} new rows, mode {args.mode}')
+    clf, data_transformer, (df_tr, df_val, df_ts), added = retrain(
+        df, booster, data_transformer, params, args.mode, args.num_round, args.early_stopping_rounds, args.decay_rate)
+    for col, values in added.items():
+        print(f'New values of {col}: {values}')
+
+    print('')
+    print('Evaluating Model on the new rows')
+    feats_col, label_col = clf.feature_name(), feats_label_cols(df_tr)[1]
+    evaluate_model(clf, df_val, df_ts, feats_col, label_col)
+
+    print('')
+    print(f'Saving Model and Transformer to Directory {args.dst}')
+    pickle_path, model_path, bundle_path = save_model_transformer(clf, data_transformer, args.dst)
+    with open(os.path.join(args.dst, 'retrain.json'), 'w') as f:
+        json.dump({'base' : os.path.abspath(args.base), 'mode' : args.mode, 'rows' : len(df),
+                   'trees' : clf.num_trees(), 'new_values' : added}, f, indent=2)
+    ref_path = os.path.join(args.dst, 'standard_payload.json')
+    with open(ref_path, 'w') as f:
+        json.dump(extend_ref_json(args.ref_json, added), f, indent=4)
+
+    print('Pickle Saved to ', pickle_path)
+    print('Model Saved to ', model_path)
+    print('Bundle Saved to ', bundle_path)
+    print('Reference json Saved to ', ref_path)
+    print(f'New version in {time.perf_counter() - start:.1f} seconds')
+
+
+if __name__ == '__main__':
+    main()
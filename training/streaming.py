@@ -0,0 +1,178 @@
+"""
+Out-of-core training of train.py (--stream), for a CSV larger than the memory of the machine.
+
+The CSV is read twice, chunk by chunk:
+
+1. the unique values of every categorical field are gathered to fit the DataTransformer
+2. every chunk is encoded and its rows appended to the float32 file of their split, chosen
+   from a hash of their values (80% train, 10% validation, 10% test) instead of a shuffle
+
+The lgb.Dataset of every split is then constructed from its memory-mapped file through
+lgb.Sequence, batch_size rows at a time, and the model is evaluated the same way. Only the
+labels, the binned Dataset and the tuning sample are held in memory.
+"""
+
+import os
+from collections import defaultdict
+
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+
+from preprocess import DataTransformer
+from utils import feats_label_cols, print_scores
+
+
+CHUNK_SIZE = 100000
+
+SPLITS = ['train', 'val', 'test']
+
+# upper bounds of the hash buckets (out of 100) of the train and validation splits, the
+# proportions of split_ds
+SPLIT_BOUNDS = [80, 90]
+
+
+def read_chunks(path, chunk_size):
+    """Chunks of the CSV, lowercased like load_transform_ds, with the index starting at 0
+       that DataTransformer.transform expects
+    """
+    for df in pd.read_csv(path, chunksize=chunk_size):
+        for col in df.columns[df.dtypes == object]:
+            df[col] = df[col].str.lower()
+        yield df.reset_index(drop=True)
+
+
+def row_hashes(df):
+    """Hash of the values of every row, the same on every run and in whatever chunk the row is read"""
+    # an integer column is parsed as float in a chunk where it has a missing value,
+    # so every numeric column is hashed as float (39.0, never 39)
+    numeric = df.select_dtypes('number').columns
+    df = df.astype({col : 'float64' for col in numeric})
+    return pd.util.hash_pandas_object(df.astype(str), index=False).to_numpy()
+
+
+def split_codes(hashes):
+    """Index in SPLITS of every row. Duplicated rows always fall in the same split."""
+    return np.searchsorted(SPLIT_BOUNDS, hashes % 100, side='right')
+
+
+def fit_streaming(path, chunk_size=CHUNK_SIZE):
+    """
+    Returns:
+        tuple: (DataTransformer fitted on every row of the CSV, number of rows)
+    """
+    data_transformer = DataTransformer()
+    uniques = defaultdict(set)
+    num_rows = 0
+
+    for df in read_chunks(path, chunk_size):
+        num_rows += len(df)
+        for col, _ in data_transformer.cat_transformer.transformers:
+            uniques[col].update(df[col].unique())
+
+    data_transformer.fit_uniques(uniques)
+    return data_transformer, num_rows
+
+
+class MemmapSequence(lgb.Sequence):
+    """Rows of a memory-mapped feature matrix, read by LightGBM batch_size rows at a time
+       and converted to the doubles it samples
+    """
+
+    def __init__(self, data, batch_size):
+        self.data = data
+        self.batch_size = batch_size
+
+    def __getitem__(self, idx):
+        return np.asarray(self.data[idx], dtype=np.float64)
+
+    def __len__(self):
+        return len(self.data)
+
+
+class EncodedSplit:
+    """Encoded features of one split, appended chunk by chunk to a float32 file, and its labels"""
+
+    def __init__(self, path, feats_col):
+        self.path = path
+        self.feats_col = feats_col
+        self.num_rows = 0
+        self.labels = []
+        self.file = open(path, 'wb')
+
+    def append(self, features, labels):
+        self.file.write(np.ascontiguousarray(features, dtype=np.float32).tobytes())
+        self.labels.append(np.asarray(labels, dtype=np.float32))
+        self.num_rows += len(labels)
+
+    def close(self):
+        self.file.close()
+        self.labels = np.concatenate(self.labels) if self.labels else np.zeros(0, dtype=np.float32)
+
+    def features(self):
+        return np.memmap(self.path, dtype=np.float32, mode='r', shape=(self.num_rows, len(self.feats_col)))
+
+    def lgb_dataset(self, batch_size, params=None, reference=None):
+        return lgb.Dataset(MemmapSequence(self.features(), batch_size), label=self.labels,
+                           feature_name=self.feats_col, params=params, reference=reference)
+
+    def predict(self, clf, batch_size):
+        features = self.features()
+        return np.concatenate([clf.predict(features[start:start + batch_size])
+                               for start in range(0, self.num_rows, batch_size)])
+
+
+def encode_streaming(path, data_transformer, num_rows, work_dir, chunk_size=CHUNK_SIZE, tuning_rows=50000):
+    """Encodes the CSV into one EncodedSplit per split under work_dir
+
+    Args:
+        tuning_rows (int, optional): Approximate size of the sample of the training split
+                                     kept in memory for the hyperparameter tuning
+
+    Returns:
+        tuple: (dict of EncodedSplit by split, tuning sample DataFrame)
+    """
+    splits = {}
+    sample = []
+    # the last digits of the hash select the split, the next ones the tuning sample
+    sample_fraction = tuning_rows / max(num_rows * SPLIT_BOUNDS[0] / 100, 1)
+
+    for df in read_chunks(path, chunk_size):
+        df_transform = data_transformer.transform(df)
+        feats_col, label_col = feats_label_cols(df_transform)
+        if not splits:
+            splits = {name : EncodedSplit(os.path.join(work_dir, f'{name}.f32'), feats_col) for name in SPLITS}
+
+        hashes = row_hashes(df)
+        codes = split_codes(hashes)
+        for code, name in enumerate(SPLITS):
+            rows = df_transform[codes == code]
+            splits[name].append(rows[feats_col].to_numpy(), rows[label_col].to_numpy())
+
+        sampled = (codes == 0) & ((hashes // 100) % 1000000 < sample_fraction * 1000000)
+        sample.append(df_transform[sampled])
+
+    for split in splits.values():
+        split.close()
+    return splits, pd.concat(sample, ignore_index=True)
+
+
+def train_lgbm_streaming(splits, opt_hparam, batch_size=CHUNK_SIZE, num_round=15000, early_stopping_rounds=250):
+    tr_data = splits['train'].lgb_dataset(batch_size, params={'max_bin' : opt_hparam['max_bin']})
+    val_data = splits['val'].lgb_dataset(batch_size, reference=tr_data)
+    ts_data = splits['test'].lgb_dataset(batch_size, reference=tr_data)
+
+    clf = lgb.train(opt_hparam,
+                    tr_data,
+                    num_round,
+                    valid_sets = [tr_data, val_data, ts_data],
+                    verbose_eval=True,
+                    early_stopping_rounds = early_stopping_rounds)
+
+    return clf
+
+
+def evaluate_model_streaming(clf, splits, batch_size=CHUNK_SIZE):
+    print_scores(splits['val'].labels, splits['val'].predict(clf, batch_size), msg='Validation Set')
+    print_scores(splits['test'].labels, splits['test'].predict(clf, batch_size), msg='Test Set')
+
@@ -1,8 +1,11 @@
 import argparse
-import pandas as pd
+import shutil
+import tempfile
 
 from preprocess import DataTransformer
-from hyper_opt import tune_lgb_hyperparams
+from hyper_opt import tune_lgb_hyperparams, tune_lgb_hyperparams_parallel
+from dataset_cache import DatasetCache, read_transform
+import streaming
 from utils import split_ds, feats_label_cols, evaluate_model, save_model_transformer
 
 import lightgbm as lgb
@@ -12,65 +15,136 @@ def get_args():
     parser = argparse.ArgumentParser()
     parser.add_argument('src', help='Source CSV File of Adult Census Income dataset.')
     parser.add_argument('dst', help='Destination directory for data_transformer pickle and LGBM Model File')
+    parser.add_argument('--tuning-workers', type=int, default=0, 
+                        help='Evaluates the tuning trials in this many processes, with early stopping and pruning. '
+                             '0 runs the trials one after another.')
+    parser.add_argument('--cache-dir', default='.dataset_cache',
+                        help='Directory of the preprocessed datasets, reused while adult.csv and its preprocessing do not change')
+    parser.add_argument('--no-cache', action='store_true', help='Preprocesses the CSV without reading or writing the cache')
+    parser.add_argument('--stream', action='store_true',
+                        help='Reads and encodes the CSV chunk by chunk and trains from disk, for a CSV larger than the memory')
+    parser.add_argument('--chunk-size', type=int, default=streaming.CHUNK_SIZE, help='Rows of every chunk read with --stream')
+    parser.add_argument('--tuning-rows', type=int, default=50000,
+                        help='Approximate rows of the training split used for the tuning with --stream')
+    parser.add_argument('--work-dir', default=None, help='Directory of the encoded splits of --stream. Defaults to the temporary directory.')
     args = parser.parse_args()
 
     return args
 
 
 def load_transform_ds(path, data_transformer):
-    df = pd.read_csv(path)
-    df = df.applymap(lambda s:s.lower() if type(s) == str else s)
+    return split_ds(read_transform(path, data_transformer))
 
-    df_transform = data_transformer.fit_transform(df)
-    df_transform = df_transform.sample(frac=1.0).reset_index(drop=True)
 
-    return split_ds(df_transform)
+def load_cached_ds(path, cache):
+    """Same as load_transform_ds, with the fitted transformer and the shuffled dataset read from
+       the cache if they were saved by a previous run, and saved to it otherwise
 
+    Returns:
+        tuple: (DataTransformer, (df_tr, df_val, df_ts))
+    """
+    if cache.exists():
+        data_transformer, df_transform = cache.load()
+    else:
+        data_transformer = DataTransformer()
+        df_transform = read_transform(path, data_transformer)
+        cache.save(data_transformer, df_transform)
+
+    return data_transformer, split_ds(df_transform)
 
-def train_lgbm(df_tr, df_val, df_ts, opt_hparam, feats_col, label_col):
-    
-    tr_data = lgb.Dataset(df_tr[feats_col], label=df_tr[label_col])
-    val_data = lgb.Dataset(df_val[feats_col], label=df_val[label_col])
-    ts_data = lgb.Dataset(df_ts[feats_col], label=df_ts[label_col])
 
-    num_round = 15000
+def train_lgbm(df_tr, df_val, df_ts, opt_hparam, feats_col, label_col, cache=None, num_round=15000,
+               early_stopping_rounds=250):
+    
+    if cache is not None:
+        tr_data = cache.lgb_dataset(df_tr[feats_col], df_tr[label_col], opt_hparam['max_bin'])
+    else:
+        tr_data = lgb.Dataset(df_tr[feats_col], label=df_tr[label_col])
+    val_data = lgb.Dataset(df_val[feats_col], label=df_val[label_col], reference=tr_data)
+    ts_data = lgb.Dataset(df_ts[feats_col], label=df_ts[label_col], reference=tr_data)
 
     clf = lgb.train(opt_hparam, 
                     tr_data, 
                     num_round, 
                     valid_sets = [tr_data, val_data, ts_data], 
                     verbose_eval=True, 
-                    early_stopping_rounds = 250)
+                    early_stopping_rounds = early_stopping_rounds)
 
     return clf
 
 
+def tune(X, y, tuning_workers, cache=None):
+    print('Tuning of LGBM HyperParameters using Bayesian Optimization')
+    if tuning_workers > 0:
+        return tune_lgb_hyperparams_parallel(X, y, workers=tuning_workers, dataset_cache=cache)
+    return tune_lgb_hyperparams(X, y)
+
+
+def save(clf, data_transformer, dst):
+    print('')
+    print(f'Saving Model and Transformer to Directory {dst}')
+
+    pickle_path, model_path, bundle_path = save_model_transformer(clf, data_transformer, dst)
+
+    print('Pickle Saved to ', pickle_path)
+    print('Model Saved to ', model_path)
+    print('Bundle Saved to ', bundle_path)
+
+
+def main_streaming(args):
+    work_dir = tempfile.mkdtemp(prefix='stream-', dir=args.work_dir)
+    try:
+        print(f'Fitting the transformer on {args.src}, {args.chunk_size} rows at a time')
+        data_transformer, num_rows = streaming.fit_streaming(args.src, args.chunk_size)
+
+        print(f'Encoding {num_rows} rows to {work_dir}')
+        splits, df_sample = streaming.encode_streaming(args.src, data_transformer, num_rows, work_dir,
+                                                       args.chunk_size, args.tuning_rows)
+        feats_col, label_col = feats_label_cols(df_sample)
+
+        opt_hparam = tune(df_sample[feats_col], df_sample[label_col], args.tuning_workers)
+
+        print('')
+        print('Training LGBM with Optimized Hyperparameters')
+        clf = streaming.train_lgbm_streaming(splits, opt_hparam, args.chunk_size)
+
+        print('')
+        print('Evaluating Model')
+        streaming.evaluate_model_streaming(clf, splits, args.chunk_size)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    save(clf, data_transformer, args.dst)
+
+
 def main():
     args = get_args()
-    data_transformer = DataTransformer()
 
-    df_tr, df_val, df_ts = load_transform_ds(args.src, data_transformer)
+    if args.stream:
+        return main_streaming(args)
+
+    if args.no_cache:
+        cache = None
+        data_transformer = DataTransformer()
+        df_tr, df_val, df_ts = load_transform_ds(args.src, data_transformer)
+    else:
+        cache = DatasetCache(args.cache_dir, args.src)
+        print(f'Dataset cache {cache.path} ({"warm" if cache.exists() else "cold"})')
+        data_transformer, (df_tr, df_val, df_ts) = load_cached_ds(args.src, cache)
     feats_col, label_col = feats_label_cols(df_tr)
 
-    print('Tuning of LGBM HyperParameters using Bayesian Optimization')
-    opt_hparam = tune_lgb_hyperparams(df_tr[feats_col], df_tr[label_col])
+    opt_hparam = tune(df_tr[feats_col], df_tr[label_col], args.tuning_workers, cache)
 
     print('')
     print('Training LGBM with Optimized Hyperparameters')
 
-    clf = train_lgbm(df_tr, df_val, df_ts, opt_hparam, feats_col, label_col)
+    clf = train_lgbm(df_tr, df_val, df_ts, opt_hparam, feats_col, label_col, cache)
 
     print('')
     print('Evaluating Model')
     evaluate_model(clf, df_val, df_ts, feats_col, label_col)
 
-    print('')
-    print(f'Saving Model and Transformer to Directory {args.dst}')
-
-    pickle_path, model_path = save_model_transformer(clf, data_transformer, args.dst)
-
-    print('Pickle Saved to ', pickle_path)
-    print('Model Saved to ', model_path)
+    save(clf, data_transformer, args.dst)
 
 
 
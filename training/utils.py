@@ -5,6 +5,16 @@ import numpy as np
 import os
 import cloudpickle
 
+from model_bundle import ModelBundle
+
+
+# seed of the shuffle of train.py, so that compact.py can find its validation split again
+SHUFFLE_SEED = 0
+
+
+def shuffle_ds(df):
+    return df.sample(frac=1.0, random_state=SHUFFLE_SEED).reset_index(drop=True)
+
 
 def split_ds(df):
 
@@ -25,14 +35,31 @@ def feats_label_cols(df):
 
 
 def evaluate_on_ds(clf, df, feats_col, label_col, msg):
+    print_scores(df[label_col], clf.predict(df[feats_col]), msg)
+
 
-    y_pred = clf.predict(df[feats_col])
+def scores(y_true, y_pred):
+    """
+    Returns:
+        dict: accuracy, precision, recall and f1 of the predictions over 0.5
+    """
     y_pred = np.where(y_pred > 0.5, 1.0, 0.0)
 
-    acc_score_ = accuracy_score(df[label_col], y_pred)
-    prec_score_ = precision_score(df[label_col], y_pred)
-    rec_score_ = recall_score(df[label_col], y_pred)
-    f1_score_ = f1_score(df[label_col], y_pred)
+    return {
+        'accuracy' : accuracy_score(y_true, y_pred),
+        'precision' : precision_score(y_true, y_pred),
+        'recall' : recall_score(y_true, y_pred),
+        'f1' : f1_score(y_true, y_pred)
+    }
+
+
+def print_scores(y_true, y_pred, msg):
+
+    scores_ = scores(y_true, y_pred)
+    acc_score_ = scores_['accuracy']
+    prec_score_ = scores_['precision']
+    rec_score_ = scores_['recall']
+    f1_score_ = scores_['f1']
 
     print('###########################################################')
     print(f'Accuracy Score for {msg} = {acc_score_}')
@@ -53,6 +80,11 @@ def make_dir(target_dir):
     os.mkdir(target_dir)
 
 
+def load_pickle(path):
+    with open(path, 'rb') as f:
+        return cloudpickle.load(f)
+
+
 def save_pickle(obj, path):
     with open(path, 'wb') as f:
         cloudpickle.dump(obj, f)
@@ -62,15 +94,24 @@ def save_model(model, path):
     model.save_model(path, num_iteration=model.best_iteration)
 
 
+def save_bundle(model_path, data_transformer, path):
+    """Saves the model and the encoder tables as plain arrays (model_bundle.py), which the
+       web service loads without sklearn or pandas
+    """
+    ModelBundle.from_transformer(model_path, data_transformer).save(path)
+
+
 def save_model_transformer(clf, data_transformer, dst_dir):
     make_dir(dst_dir)
 
     pickle_path = os.path.join(dst_dir, 'data_transformer.pkl')
     model_path = os.path.join(dst_dir, 'model.txt')
+    bundle_path = os.path.join(dst_dir, 'model_bundle.npz')
 
     save_pickle(data_transformer, pickle_path)
     save_model(clf, model_path)
+    save_bundle(model_path, data_transformer, bundle_path)
 
-    return pickle_path, model_path
+    return pickle_path, model_path, bundle_path
 
     
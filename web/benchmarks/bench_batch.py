@@ -0,0 +1,53 @@
+"""
+Throughput of /predict_income (one request per row) against /predict_income/batch
+(one request per batch) through the Flask test client.
+
+Use: python ../benchmarks/bench_batch.py
+"""
+
+import time
+
+import bench_utils
+from bench_utils import PAYLOAD_LIST, print_table
+
+bench_utils.set_app_env()
+
+from app import app
+from utils import load_json
+
+BATCH_SIZES = [1, 10, 100, 1000]
+
+
+def get_payloads(n):
+    payload_list = load_json(PAYLOAD_LIST)
+    return [dict(payload_list[i % len(payload_list)]) for i in range(n)]
+
+
+def rows_per_sec_single(client, payloads):
+    start = time.perf_counter()
+    for payload in payloads:
+        client.post('/predict_income', json=payload)
+    return len(payloads) / (time.perf_counter() - start)
+
+
+def rows_per_sec_batch(client, payloads):
+    start = time.perf_counter()
+    client.post('/predict_income/batch', json=payloads)
+    return len(payloads) / (time.perf_counter() - start)
+
+
+def main():
+    client = app.test_client()
+    rows = []
+
+    for batch_size in BATCH_SIZES:
+        repeat = max(1, 2000 // batch_size)
+        single = max(rows_per_sec_single(client, get_payloads(batch_size)) for _ in range(3))
+        batch = max(rows_per_sec_batch(client, get_payloads(batch_size)) for _ in range(repeat))
+        rows.append((batch_size, f'{single:.0f}', f'{batch:.0f}', f'{batch / single:.1f}x'))
+
+    print_table(('batch_size', 'single rows/s', 'batch rows/s', 'speedup'), rows)
+
+
+if __name__ == '__main__':
+    main()
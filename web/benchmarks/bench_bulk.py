@@ -0,0 +1,122 @@
+"""
+Throughput and peak memory of bulk_score.py on copies of training/adult.csv concatenated
+1, 10 and 30 times, against loading the whole file with pandas and scoring it with a single
+Model.predict_batch call, the way train.load_transform_ds loads its data.
+
+Every run is a separate process, its peak RSS is the ru_maxrss of that process.
+
+The scaling of --workers is measured on 10 copies, from 1 to 2x the cores of the machine,
+with the numpy engine and with LightGBM splitting the cores between the workers
+(--threads cores/workers) or using all of them in every worker (--threads 0).
+
+Use: python ../benchmarks/bench_bulk.py
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import bench_utils
+from bench_utils import ADULT_CSV, MODEL_FILE, TRANSFORMER_FILE, print_table
+
+COPIES = [1, 10, 30]
+CHUNK_SIZE = 2048
+SCALING_COPIES = 10
+CORES = len(os.sched_getaffinity(0))
+WORKERS = sorted({1, 2, 4, CORES, 2 * CORES})
+
+# the whole file in memory, scored with a single call
+PANDAS_SCRIPT = f"""
+import sys, time
+import pandas as pd
+from model_predict import Model
+
+start = time.perf_counter()
+model = Model(model_file={MODEL_FILE!r}, transformer_file={TRANSFORMER_FILE!r}, engine='numpy')
+df = pd.read_csv(sys.argv[1]).drop(columns=['income'])
+df = df.applymap(lambda s:s.lower() if type(s) == str else s)
+predictions = model.predict_batch(df.to_dict('records'))
+pd.DataFrame(predictions).to_json(sys.argv[2], orient='records', lines=True)
+print(len(predictions) / (time.perf_counter() - start), file=sys.stderr)
+"""
+
+
+def make_input(copies, path):
+    with open(ADULT_CSV) as f:
+        header = f.readline()
+        body = f.read()
+    with open(path, 'w') as f:
+        f.write(header)
+        for _ in range(copies):
+            f.write(body)
+
+
+def run(command):
+    """
+    Returns:
+        tuple: (last line of stderr, peak RSS in MB)
+    """
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    stderr = process.stderr.read()
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise RuntimeError(stderr)
+    return stderr.strip().splitlines()[-1], rusage.ru_maxrss / 1024
+
+
+def scaling(work_dir):
+    src = os.path.join(work_dir, 'adult.csv')
+    make_input(SCALING_COPIES, src)
+
+    rows = []
+    for engine in ['numpy', 'lightgbm']:
+        thread_splits = [None, '0'] if engine == 'lightgbm' else [None]
+        for workers in [0] + WORKERS:
+            for threads in thread_splits:
+                if threads is None:
+                    threads = str(max(1, CORES // workers)) if workers else '0'
+                elif workers == 0:
+                    continue
+                line, peak = run([sys.executable, 'bulk_score.py', src, os.path.join(work_dir, 'out.jsonl'),
+                                  '--chunk-size', str(CHUNK_SIZE), '--engine', engine,
+                                  '--workers', str(workers), '--threads', threads])
+                throughput = float(line.split('(')[1].split()[0])
+                rows.append((engine, workers, threads if engine == 'lightgbm' else '-', f'{throughput:.0f}'))
+
+    print(f'{CORES} cores, {SCALING_COPIES} copies of adult.csv')
+    print_table(('engine', 'workers', 'threads', 'rows/s'), rows)
+
+
+def main():
+    bench_utils.set_app_env()
+    os.environ['METRICS_ENABLED'] = '0'
+    work_dir = tempfile.mkdtemp()
+
+    rows = []
+    try:
+        for copies in COPIES:
+            src = os.path.join(work_dir, 'adult.csv')
+            make_input(copies, src)
+            size_mb = os.path.getsize(src) / 1024 ** 2
+
+            line, peak = run([sys.executable, 'bulk_score.py', src, os.path.join(work_dir, 'out.jsonl'),
+                              '--chunk-size', str(CHUNK_SIZE), '--engine', 'numpy'])
+            num_rows = int(line.split()[0])
+            throughput = float(line.split('(')[1].split()[0])
+            rows.append(('bulk_score.py', copies, num_rows, f'{size_mb:.1f}', f'{throughput:.0f}', f'{peak:.1f}'))
+
+            line, peak = run([sys.executable, '-c', PANDAS_SCRIPT, src, os.path.join(work_dir, 'out.jsonl')])
+            rows.append(('pandas, whole file', copies, num_rows, f'{size_mb:.1f}', f'{float(line):.0f}', f'{peak:.1f}'))
+
+        print_table(('scorer', 'copies', 'rows', 'input MB', 'rows/s', 'peak RSS MB'), rows)
+        print()
+        scaling(work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
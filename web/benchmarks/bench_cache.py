@@ -0,0 +1,111 @@
+"""
+Round trips to the remote cache and latency of PredictionCache.get_or_compute
+with and without the in-process LRU, on a Zipf-skewed replay of payload_list.json.
+The remote is simulated with a fixed round-trip time, so no redis server is needed.
+Also counts the model calls of concurrent bursts on the same cold key.
+
+Use: python ../benchmarks/bench_cache.py
+"""
+
+import threading
+import time
+
+import numpy as np
+
+from bench_utils import REF_JSON, MODEL_FILE, TRANSFORMER_FILE, PAYLOAD_LIST, print_table, summarize
+
+from model_predict import Model
+from prediction_cache import PredictionCache
+from standard_payload import StandardPayload
+from utils import load_json
+
+NUM_REQUESTS = 5000
+ZIPF_A = 1.2
+REMOTE_RTT = 300e-6
+BURST_SIZES = [1, 8, 32]
+
+
+class SimulatedRemote:
+    """Dict-backed remote cache that sleeps for one round trip per call"""
+
+    def __init__(self, rtt):
+        self.rtt = rtt
+        self.entries = {}
+        self.calls = 0
+
+    def get(self, key):
+        self.calls += 1
+        time.sleep(self.rtt)
+        return self.entries.get(key)
+
+    def set(self, key, value, timeout=None):
+        self.calls += 1
+        time.sleep(self.rtt)
+        self.entries[key] = value
+
+
+def get_features(model):
+    std_payload = StandardPayload(ref_json=REF_JSON)
+    payload_list = load_json(PAYLOAD_LIST)
+    validated = [std_payload.validate_data(dict(payload))['data'] for payload in payload_list]
+    return [model.encode(payload) for payload in validated]
+
+
+def replay(model, features, local_size):
+    remote = SimulatedRemote(REMOTE_RTT)
+    prediction_cache = PredictionCache(model.version, local_size=local_size, remote=remote)
+
+    rng = np.random.default_rng(0)
+    order = (rng.zipf(ZIPF_A, NUM_REQUESTS) - 1) % len(features)
+
+    latencies = np.empty(NUM_REQUESTS)
+    for i, idx in enumerate(order):
+        row = features[idx]
+        start = time.perf_counter()
+        key = prediction_cache.key(row)
+        prediction_cache.get_or_compute(key, lambda: model.predict_features(row)[0])
+        latencies[i] = time.perf_counter() - start
+
+    return remote.calls, summarize(latencies)
+
+
+def burst(model, row, size):
+    prediction_cache = PredictionCache(model.version, remote=SimulatedRemote(REMOTE_RTT))
+    key = prediction_cache.key(row)
+    computed = []
+
+    def compute():
+        computed.append(1)
+        return model.predict_features(row)[0]
+
+    threads = [threading.Thread(target=prediction_cache.get_or_compute, args=(key, compute))
+               for _ in range(size)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return len(computed), prediction_cache.coalesced
+
+
+def main():
+    model = Model(model_file=MODEL_FILE, transformer_file=TRANSFORMER_FILE)
+    features = get_features(model)
+
+    rows = []
+    for name, local_size in [('remote only', 0), ('LRU + remote', 10000)]:
+        calls, stats = replay(model, features, local_size)
+        rows.append((name, calls, f'{calls / NUM_REQUESTS:.3f}',
+                     f'{stats["p50_us"]:.1f}', f'{stats["p99_us"]:.1f}', f'{stats["mean_us"]:.1f}'))
+
+    print(f'{NUM_REQUESTS} requests, zipf a={ZIPF_A} over {len(features)} payloads, '
+          f'remote rtt {REMOTE_RTT * 1e6:.0f} us')
+    print_table(('tiers', 'remote calls', 'per request', 'p50 us', 'p99 us', 'mean us'), rows)
+    print()
+
+    rows = [(size, *burst(model, features[0], size)) for size in BURST_SIZES]
+    print_table(('concurrent requests', 'model calls', 'coalesced'), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+"""
+Per-request latency of encoding payload_valid.json with DataTransformer.transform_features
+(LabelEncoder + pandas) against the compiled FeatureEncoder, alone and followed by the
+booster call.
+
+Use: python ../benchmarks/bench_encoder.py
+"""
+
+import os
+
+import pandas as pd
+
+import bench_utils
+from bench_utils import REF_JSON, TRANSFORMER_FILE, MODEL_FILE, TEST_DATA_DIR, time_calls, summarize, print_table
+
+from model_predict import Model
+from standard_payload import StandardPayload
+from utils import load_json
+
+
+def main():
+    model = Model(model_file=MODEL_FILE, transformer_file=TRANSFORMER_FILE)
+    std_payload = StandardPayload(ref_json=REF_JSON)
+    payload = std_payload.validate_data(load_json(os.path.join(TEST_DATA_DIR, 'payload_valid.json')))['data']
+
+    cases = [
+        ('transform_features', lambda: model.transformer.transform_features(pd.DataFrame([payload]))),
+        ('FeatureEncoder.encode', lambda: model.encoder.encode(payload)),
+        ('transform_features + booster', 
+            lambda: model.model.predict(model.transformer.transform_features(pd.DataFrame([payload])))),
+        ('FeatureEncoder.encode + booster', lambda: model.model.predict(model.encoder.encode(payload))),
+    ]
+
+    rows = []
+    for name, fn in cases:
+        stats = summarize(time_calls(fn, repeat=2000, warmup=50))
+        rows.append((name, f"{stats['p50_us']:.1f}", f"{stats['p99_us']:.1f}"))
+
+    print_table(('path', 'p50 us', 'p99 us'), rows)
+
+
+if __name__ == '__main__':
+    main()
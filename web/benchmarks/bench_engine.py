@@ -0,0 +1,48 @@
+"""
+Latency of lgb.Booster.predict against the pure NumPy TreeEnsemble.predict and the
+precomputed ScoreTable.predict on encoded rows, across batch sizes.
+
+Use: python ../benchmarks/bench_engine.py
+"""
+
+import lightgbm as lgb
+import numpy as np
+
+import bench_utils
+from bench_utils import MODEL_FILE, time_calls, summarize, print_table
+
+from tree_ensemble import TreeEnsemble
+from score_table import ScoreTable
+
+BATCH_SIZES = [1, 10, 100, 1000]
+
+
+def main():
+    booster = lgb.Booster(model_file=MODEL_FILE)
+    ensemble = TreeEnsemble(MODEL_FILE)
+    table = ScoreTable.from_ensemble(ensemble)
+
+    rng = np.random.default_rng(0)
+    low = np.array([0] * 8 + [1] * 5)
+    high = np.array([15, 8, 6, 14, 5, 4, 1, 41, 9, 9, 9, 9, 9])
+    X = rng.integers(low, high + 1, size=(max(BATCH_SIZES), 13)).astype(np.float64)
+
+    for name, engine in [('TreeEnsemble', ensemble), ('ScoreTable', table)]:
+        max_diff = np.abs(engine.predict(X) - booster.predict(X)).max()
+        print(f'max |{name} - Booster| = {max_diff:.3g}')
+
+    rows = []
+    for batch_size in BATCH_SIZES:
+        X_batch = X[:batch_size]
+        repeat = max(20, 2000 // batch_size)
+        lgb_stats = summarize(time_calls(lambda: booster.predict(X_batch), repeat))
+        np_stats = summarize(time_calls(lambda: ensemble.predict(X_batch), repeat))
+        table_stats = summarize(time_calls(lambda: table.predict(X_batch), repeat))
+        rows.append((batch_size, f"{lgb_stats['p50_us']:.1f}", f"{np_stats['p50_us']:.1f}",
+                     f"{table_stats['p50_us']:.1f}"))
+
+    print_table(('batch_size', 'booster p50 us', 'numpy p50 us', 'table p50 us'), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Overhead of the Prometheus instrumentation on /predict_income (Flask test client,
+prediction cache cleared before every request so that every stage runs).
+
+The request latency is measured in separate processes with METRICS_ENABLED=0, with the
+in-process registry, and with the multiprocess files of PROMETHEUS_MULTIPROC_DIR,
+alternating between them over a few rounds. The direct cost of the recording calls
+made by one request is measured as well.
+
+Use: python ../benchmarks/bench_metrics.py
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import bench_utils
+from bench_utils import TEST_DATA_DIR, print_table
+
+ROUNDS = 5
+REQUESTS = 2000
+
+CONFIGS = [
+    ('disabled', {'METRICS_ENABLED' : '0'}),
+    ('in-process registry', {'METRICS_ENABLED' : '1'}),
+    ('multiprocess files', {'METRICS_ENABLED' : '1', 'PROMETHEUS_MULTIPROC_DIR' : None}),
+]
+
+
+def median_request_us() -> float:
+    """Median latency of /predict_income in this process"""
+    bench_utils.set_app_env()
+    import app as app_module
+    from utils import load_json
+
+    client = app_module.app.test_client()
+    payload = load_json(os.path.join(TEST_DATA_DIR, 'payload_valid.json'))
+
+    latencies = []
+    for i in range(REQUESTS + 100):
+        app_module.prediction_cache.local.entries.clear()
+        start = time.perf_counter()
+        client.post('/predict_income', json=payload)
+        latencies.append(time.perf_counter() - start)
+
+    return float(np.median(latencies[100:]) * 1e6)
+
+
+def recording_cost_us() -> float:
+    """Cost of the recording calls made by one uncached /predict_income"""
+    import metrics
+
+    def one_request():
+        start = time.perf_counter()
+        for stage in ['parse', 'validate', 'transform', 'predict', 'serialize', 'total']:
+            metrics.observe_stage(stage, start)
+        metrics.observe_stage_seconds('cache', 1e-6)
+        metrics.count_cache_lookup(False)
+        metrics.observe_batch_rows(1)
+
+    for _ in range(1000):
+        one_request()
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        one_request()
+    return (time.perf_counter() - start) / REQUESTS * 1e6
+
+
+def run_worker(env : dict) -> dict:
+    output = subprocess.check_output([sys.executable, __file__, '--worker'],
+                                     env=dict(os.environ, **env), stderr=subprocess.DEVNULL)
+    return json.loads(output)
+
+
+def main():
+    multiproc_dir = tempfile.mkdtemp()
+    results = {name : [] for name, _ in CONFIGS}
+
+    for _ in range(ROUNDS):
+        for name, env in CONFIGS:
+            env = {k : multiproc_dir if v is None else v for k, v in env.items()}
+            results[name].append(run_worker(env))
+
+    base = np.median([r['request_us'] for r in results['disabled']])
+    rows = []
+    for name, _ in CONFIGS:
+        request_us = np.median([r['request_us'] for r in results[name]])
+        recording_us = np.median([r['recording_us'] for r in results[name]])
+        rows.append((name, f'{request_us:.1f}', f'{(request_us - base) / base:+.1%}',
+                     f'{recording_us:.2f}', f'{recording_us / base:.2%}'))
+
+    print_table(('metrics', 'request p50 us', 'vs disabled', 'recording us', 'recording / request'), rows)
+
+
+if __name__ == '__main__':
+    if '--worker' in sys.argv:
+        print(json.dumps({'request_us' : median_request_us(), 'recording_us' : recording_cost_us()}))
+    else:
+        main()
@@ -0,0 +1,37 @@
+"""
+OrdinalTransformer.transform against the former per-row df[col].apply(get_*_range),
+on adult.csv and on a single row.
+
+Use: python ../benchmarks/bench_ordinal.py
+"""
+
+import pandas as pd
+
+import bench_utils
+from bench_utils import ADULT_CSV, TRANSFORMER_FILE, time_calls, print_table
+
+from utils import load_pickle
+
+
+def transform_apply(ord_transformer, df):
+    df_transform = pd.DataFrame()
+    for col, get_col_range in ord_transformer.transformers:
+        df_transform[col] = df[col].apply(get_col_range)
+    return df_transform
+
+
+def main():
+    ord_transformer = load_pickle(TRANSFORMER_FILE).ord_transformer
+    df_full = pd.read_csv(ADULT_CSV)
+    rows = []
+
+    for name, df, repeat in [('1 row', df_full[:1], 500), (f'{len(df_full)} rows', df_full, 5)]:
+        apply_ms = time_calls(lambda: transform_apply(ord_transformer, df), repeat, 1).mean() * 1e3
+        vector_ms = time_calls(lambda: ord_transformer.transform(df), repeat, 1).mean() * 1e3
+        rows.append((name, f'{apply_ms:.3f}', f'{vector_ms:.3f}', f'{apply_ms / vector_ms:.1f}x'))
+
+    print_table(('input', 'apply ms', 'vectorized ms', 'speedup'), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+"""
+Latency of Model.predict / Model.predict_batch on the NumPy fast path against the
+pandas DataTransformer path.
+
+Use: python ../benchmarks/bench_predict.py
+"""
+
+import bench_utils
+from bench_utils import REF_JSON, TRANSFORMER_FILE, MODEL_FILE, PAYLOAD_LIST, time_calls, summarize, print_table
+
+from model_predict import Model
+from standard_payload import StandardPayload
+from utils import load_json
+
+
+def main():
+    std_payload = StandardPayload(ref_json=REF_JSON)
+    payload_list = [std_payload.validate_data(payload)['data'] for payload in load_json(PAYLOAD_LIST)]
+
+    rows = []
+    for fast_path in [False, True]:
+        model = Model(model_file=MODEL_FILE, transformer_file=TRANSFORMER_FILE, fast_path=fast_path)
+        name = 'numpy' if fast_path else 'pandas'
+
+        payloads = iter(payload_list * 100)
+        single = summarize(time_calls(lambda: model.predict(next(payloads)), repeat=2000, warmup=50))
+        batch = summarize(time_calls(lambda: model.predict_batch(payload_list), repeat=200, warmup=5))
+
+        rows.append((name, 'predict', f"{single['p50_us']:.1f}", f"{single['p99_us']:.1f}"))
+        rows.append((name, 'predict_batch(100)', f"{batch['p50_us']:.1f}", f"{batch['p99_us']:.1f}"))
+
+    print_table(('path', 'call', 'p50 us', 'p99 us'), rows)
+
+
+if __name__ == '__main__':
+    main()
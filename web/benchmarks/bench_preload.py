@@ -0,0 +1,119 @@
+"""
+Memory and start time of gunicorn with 1, 4 and 16 workers, with every worker loading
+its own app (the default) and with the app preloaded in the master (GUNICORN_PRELOAD=1,
+see gunicorn.conf.py). The model.txt/pickle + lightgbm setup is only measured without
+preload, which gunicorn.conf.py refuses for the lightgbm engine, and the bundle + numpy
+setup both ways.
+
+The start time runs from the launch of gunicorn until every worker has loaded the app.
+The memory of every process is read from /proc/<pid>/smaps_rollup once every worker has
+served requests: RSS counts the shared pages in every process, USS only the pages of the
+process itself and PSS splits the shared pages between the processes that map them, so
+the sum of the PSS of the master and the workers is the memory actually used.
+
+Use: python ../benchmarks/bench_preload.py
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import bench_utils
+from bench_utils import print_table
+
+LOAD_TEST = '../../sample_payload/load_test.py'
+PORT = 5078
+WORKERS = [1, 4, 16]
+REQUESTS_PER_WORKER = 200
+
+SETUPS = [
+    ('model.txt + lightgbm', {'MODEL_BUNDLE' : '', 'MODEL_ENGINE' : 'lightgbm'}),
+    ('bundle + numpy', {'MODEL_BUNDLE' : 'dependencies/model_bundle.npz', 'MODEL_ENGINE' : 'numpy'}),
+]
+
+# gunicorn.conf.py, plus a hook telling when every worker has loaded the app
+CONFIG = """
+exec(open({config!r}).read())
+
+def post_worker_init(worker):
+    open(os.path.join({ready_dir!r}, str(worker.pid)), 'w').close()
+"""
+
+
+def memory_kb(pid):
+    """
+    Returns:
+        tuple: (RSS, PSS, USS) of a process, in kB
+    """
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return fields['Rss'], fields['Pss'], fields['Private_Clean'] + fields['Private_Dirty']
+
+
+def run(workers, env, work_dir):
+    ready_dir = os.path.join(work_dir, 'ready')
+    shutil.rmtree(ready_dir, ignore_errors=True)
+    os.makedirs(ready_dir)
+    config_file = os.path.join(work_dir, 'gunicorn_bench.conf.py')
+    with open(config_file, 'w') as f:
+        f.write(CONFIG.format(config=os.path.abspath('gunicorn.conf.py'), ready_dir=ready_dir))
+
+    # without preload, 16 workers importing lightgbm on one core take longer than the
+    # default 30 s timeout, after which the master kills and restarts them forever
+    command = ['gunicorn', '-c', config_file, '--bind', f'127.0.0.1:{PORT}', '--workers', str(workers),
+               '--timeout', '300', 'wsgi:app']
+    start = time.perf_counter()
+    server = subprocess.Popen(command, env=dict(os.environ, **env), stderr=subprocess.DEVNULL)
+
+    try:
+        while len(os.listdir(ready_dir)) < workers:
+            if server.poll() is not None:
+                raise RuntimeError('gunicorn exited')
+            time.sleep(0.01)
+        startup = time.perf_counter() - start
+
+        subprocess.run([sys.executable, LOAD_TEST, '--json', '--host', f'127.0.0.1:{PORT}',
+                        '--concurrency', str(2 * workers), '--requests', str(REQUESTS_PER_WORKER * workers)],
+                       check=True, stdout=subprocess.DEVNULL)
+
+        worker_memory = [memory_kb(int(pid)) for pid in os.listdir(ready_dir)]
+        master_memory = memory_kb(server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+
+    rss = sum(m[0] for m in worker_memory) / workers / 1024
+    uss = sum(m[2] for m in worker_memory) / workers / 1024
+    total_pss = (master_memory[1] + sum(m[1] for m in worker_memory)) / 1024
+    return startup, rss, uss, total_pss
+
+
+def main():
+    bench_utils.set_app_env()
+    os.environ['PREDICTION_CACHE_SIZE'] = '0'
+    work_dir = tempfile.mkdtemp()
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = os.path.join(work_dir, 'prometheus')
+
+    rows = []
+    try:
+        for setup, env in SETUPS:
+            for preload in ['0', '1'] if env['MODEL_ENGINE'] != 'lightgbm' else ['0']:
+                for workers in WORKERS:
+                    startup, rss, uss, total_pss = run(workers, dict(env, GUNICORN_PRELOAD=preload), work_dir)
+                    rows.append((setup, 'yes' if preload == '1' else 'no', workers, f'{startup:.2f}',
+                                 f'{rss:.1f}', f'{uss:.1f}', f'{total_pss:.1f}'))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_table(('setup', 'preload', 'workers', 'start s', 'RSS/worker MB', 'USS/worker MB', 'total PSS MB'), rows)
+
+
+if __name__ == '__main__':
+    main()
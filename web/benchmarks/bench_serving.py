@@ -0,0 +1,83 @@
+"""
+Throughput and tail latency of the synchronous gunicorn setup of docker-compose.yml
+against the asynchronous micro-batching entry point (uvicorn asgi:app), with
+sample_payload/load_test.py as the client, sending rows of training/adult.csv.
+Both servers run locally with one worker, and the prediction cache disabled so
+that every request reaches the model.
+
+Use: python ../benchmarks/bench_serving.py
+"""
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+import requests
+
+import bench_utils
+from bench_utils import print_table
+
+LOAD_TEST = '../../sample_payload/load_test.py'
+PORT = 5077
+CONCURRENCY = [1, 16, 64]
+NUM_REQUESTS = 2000
+
+GUNICORN = ['gunicorn', '--bind', f'127.0.0.1:{PORT}', '--workers', '1', 'wsgi:app']
+UVICORN = ['uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', str(PORT), '--workers', '1', '--log-level', 'warning']
+
+# (name, command, environment overrides)
+SERVERS = [
+    ('gunicorn sync', GUNICORN, {}),
+    ('uvicorn wait=2ms', UVICORN, {'MICROBATCH_MAX_WAIT_MS' : '2'}),
+    ('uvicorn wait=0ms', UVICORN, {'MICROBATCH_MAX_WAIT_MS' : '0'}),
+]
+
+
+def wait_ready(timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f'http://127.0.0.1:{PORT}/cache_stats', timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError('server did not start')
+
+
+def load_test(concurrency):
+    output = subprocess.check_output([sys.executable, LOAD_TEST, '--json',
+                                      '--host', f'127.0.0.1:{PORT}',
+                                      '--concurrency', str(concurrency),
+                                      '--requests', str(NUM_REQUESTS)])
+    return json.loads(output)
+
+
+def main():
+    bench_utils.set_app_env()
+    os.environ['PREDICTION_CACHE_SIZE'] = '0'
+
+    rows = []
+    for name, command, env in SERVERS:
+        server = subprocess.Popen(command, env=dict(os.environ, **env), stderr=subprocess.DEVNULL)
+        try:
+            wait_ready()
+            for concurrency in CONCURRENCY:
+                report = load_test(concurrency)
+                latency = report['latency_ms']
+                rows.append((name, concurrency, f"{report['throughput_rps']:.0f}",
+                             f"{latency['p50']:.1f}", f"{latency['p99']:.1f}", f"{latency['p999']:.1f}",
+                             report['transport_errors'] + report['unexpected_responses']))
+            if name.startswith('uvicorn'):
+                stats = requests.get(f'http://127.0.0.1:{PORT}/microbatch_stats').json()
+                print(f"{name} mean batch size: {stats['mean_batch_size']:.1f}")
+        finally:
+            server.terminate()
+            server.wait()
+
+    print_table(('server', 'concurrency', 'req/s', 'p50 ms', 'p99 ms', 'p999 ms', 'errors'), rows)
+
+
+if __name__ == '__main__':
+    main()
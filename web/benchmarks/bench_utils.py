@@ -0,0 +1,74 @@
+"""
+Shared helpers for the benchmark scripts. Every script is meant to be run from
+web/project, the same way the unit tests are.
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'project')
+sys.path.insert(0, PROJECT_DIR)
+
+REF_JSON = 'dependencies/standard_payload.json'
+TRANSFORMER_FILE = 'dependencies/data_transformer.pkl'
+MODEL_FILE = 'dependencies/model.txt'
+
+TEST_DATA_DIR = '../tests/test_files'
+PAYLOAD_LIST = '../../sample_payload/payload_list.json'
+ADULT_CSV = '../../training/adult.csv'
+
+
+def set_app_env():
+    """Sets the environment app.py expects, without requiring a redis server"""
+    os.environ.setdefault('REF_JSON', REF_JSON)
+    os.environ.setdefault('TRANSFORMER_FILE', TRANSFORMER_FILE)
+    os.environ.setdefault('MODEL_FILE', MODEL_FILE)
+    os.environ.setdefault('CACHE_TYPE', 'NullCache')
+    os.environ.setdefault('CACHE_REDIS_HOST', '')
+    os.environ.setdefault('CACHE_REDIS_PORT', '')
+    os.environ.setdefault('CACHE_REDIS_DB', '')
+    os.environ.setdefault('CACHE_REDIS_URL', '')
+    os.environ.setdefault('CACHE_DEFAULT_TIMEOUT', '0')
+
+
+def time_calls(fn, repeat=200, warmup=10):
+    """Times repeated calls of fn
+
+    Args:
+        fn (callable): Function without arguments to be timed
+        repeat (int): Number of timed calls
+        warmup (int): Number of untimed calls made first
+
+    Returns:
+        np.ndarray: Latency of every timed call in seconds
+    """
+    for _ in range(warmup):
+        fn()
+
+    latencies = np.empty(repeat)
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn()
+        latencies[i] = time.perf_counter() - start
+
+    return latencies
+
+
+def summarize(latencies) -> dict:
+    """Latency percentiles in microseconds"""
+    return {
+        'p50_us' : float(np.percentile(latencies, 50) * 1e6),
+        'p99_us' : float(np.percentile(latencies, 99) * 1e6),
+        'mean_us' : float(np.mean(latencies) * 1e6)
+    }
+
+
+def print_table(header, rows):
+    widths = [max(len(str(x)) for x in col) for col in zip(header, *rows)]
+    line = '  '.join('{:>%d}' % w for w in widths)
+    print(line.format(*header))
+    for row in rows:
+        print(line.format(*row))
@@ -0,0 +1,46 @@
+"""
+Per-payload latency of the staged StandardPayload checks (validate_data_staged)
+against the compiled single-pass validate_data, for the valid payload and every
+class of invalid payload of web/tests/test_files.
+
+Use: python ../benchmarks/bench_validate.py
+"""
+
+import os
+
+from bench_utils import REF_JSON, TEST_DATA_DIR, time_calls, summarize, print_table
+
+from standard_payload import StandardPayload
+from utils import load_json
+
+CASES = [
+    ('valid', 'payload_valid.json'),
+    ('excess', 'payload_excess.json'),
+    ('missing', 'payload_missing.json'),
+    ('invalid_dtype', 'payload_invalid_dtype.json'),
+    ('invalid_category', 'payload_invalid_category.json'),
+    ('negative', 'payload_negative.json'),
+]
+
+
+def main():
+    std_payload = StandardPayload(ref_json=REF_JSON)
+    rows = []
+
+    for name, file_name in CASES:
+        payload = load_json(os.path.join(TEST_DATA_DIR, file_name))
+
+        # the staged checks modify the payload in place, both sides get a fresh copy
+        staged = summarize(time_calls(lambda: std_payload.validate_data_staged(dict(payload)),
+                                      repeat=20000, warmup=500))
+        compiled = summarize(time_calls(lambda: std_payload.validate_data(dict(payload)),
+                                        repeat=20000, warmup=500))
+
+        rows.append((name, f"{staged['p50_us']:.2f}", f"{compiled['p50_us']:.2f}",
+                     f"{staged['p50_us'] / compiled['p50_us']:.1f}x"))
+
+    print_table(('payload', 'staged p50 us', 'compiled p50 us', 'speedup'), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,34 +1,188 @@
 import os
 from standard_payload import StandardPayload
 from model_predict import Model
-from redis_config import get_config
+from model_registry import ModelRegistry, load_version_dir, read_active
+from prediction_cache import PredictionCache, RedisTier
+from redis_config import get_config, get_redis_client
+import metrics
 
-from flask import Flask, request
-from flask_caching import Cache
+from flask import Flask, Response, jsonify, request
+import time
 
 
 ref_json = os.environ['REF_JSON']
 transformer_file = os.environ['TRANSFORMER_FILE']
 model_file = os.environ['MODEL_FILE'] 
+model_fast_path = os.environ.get('MODEL_FAST_PATH', '1') == '1'
+model_engine = os.environ.get('MODEL_ENGINE', 'lightgbm')
+score_table_dir = os.environ.get('SCORE_TABLE_DIR')
+model_bundle = os.environ.get('MODEL_BUNDLE') or None
+model_registry_dir = os.environ.get('MODEL_REGISTRY_DIR') or None
+shadow_model_dir = os.environ.get('SHADOW_MODEL_DIR') or None
+
+# tells load generators whether a prediction was served from the cache
+CACHE_HEADER = 'X-Prediction-Cache'
 
 std_payload = StandardPayload(ref_json=ref_json)
-model = Model(model_file=model_file, transformer_file=transformer_file)
+model_kwargs = {'fast_path' : model_fast_path, 'engine' : model_engine}
+registry = ModelRegistry(model_kwargs, registry_dir=model_registry_dir,
+                         max_versions=int(os.environ.get('MODEL_REGISTRY_VERSIONS', '2')),
+                         poll_interval=float(os.environ.get('MODEL_REGISTRY_POLL', '5')))
+
+if model_registry_dir is None:
+    registry.add(os.environ.get('MODEL_NAME', 'default'),
+                 Model(model_file=model_file, transformer_file=transformer_file, score_table_dir=score_table_dir,
+                       bundle_file=model_bundle, **model_kwargs))
+else:
+    registry.load(read_active(model_registry_dir))
 
 app = Flask(__name__)
-cache = Cache(app, config=get_config())
+redis_client = get_redis_client()
+# the keys are scoped by the version of the model that computed them (Model.version). The
+# active version is read without registry.get, which would start the watcher thread in a
+# gunicorn master preloading the app.
+prediction_cache = PredictionCache(registry.current[1].version,
+                                   local_size=int(os.environ.get('PREDICTION_CACHE_SIZE', '10000')),
+                                   local_ttl=float(os.environ.get('PREDICTION_CACHE_TTL', '300')),
+                                   remote=None if redis_client is None else RedisTier(redis_client),
+                                   timeout=int(get_config()['CACHE_DEFAULT_TIMEOUT']) or None)
+
+# candidate compared with the active version off the request path, see shadow.py
+shadow = None
+if shadow_model_dir is not None:
+    from shadow import ShadowScorer
+
+    shadow = ShadowScorer(load_version_dir(shadow_model_dir, **model_kwargs),
+                          name=os.path.basename(os.path.normpath(shadow_model_dir)),
+                          fraction=float(os.environ.get('SHADOW_FRACTION', '0.1')),
+                          max_queue=int(os.environ.get('SHADOW_QUEUE_SIZE', '1024')),
+                          batch_size=int(os.environ.get('SHADOW_BATCH_SIZE', '256')),
+                          interval=float(os.environ.get('SHADOW_INTERVAL', '1')))
+
+
+def unknown_model(name : str):
+    error = {
+        'status' : 'error',
+        'error_type' : 'unknown_model',
+        'unknown_model' : [f'{name} is not a loaded model version']
+    }
+    return error, 404
 
 
 @app.route('/predict_income', methods=['POST'])
-@cache.cached(timeout=30, query_string=True)
 def predict_income():
+    start = time.perf_counter()
     payload = request.get_json()
+    metrics.observe_stage('parse', start)
+
+    try:
+        model_name, model = registry.get(request.args.get('model'))
+    except KeyError:
+        return unknown_model(request.args.get('model'))
+
     payload = std_payload.validate_data(payload)
 
     if payload['has_error']:
+        metrics.observe_stage('total', start)
         return payload['error_msg']
 
-    prediction = model.predict(payload['data'])
-    return prediction
+    features = model.encode(payload['data'])
+    key = prediction_cache.key(features, model.version)
+    computed = []
+
+    def compute():
+        compute_start = time.perf_counter()
+        prediction = model.predict_features(features)[0]
+        computed.append(time.perf_counter() - compute_start)
+        registry.record(features)
+        return prediction
+
+    cache_start = time.perf_counter()
+    prediction = prediction_cache.get_or_compute(key, compute)
+    metrics.observe_stage_seconds('cache', time.perf_counter() - cache_start - sum(computed))
+    metrics.count_cache_lookup(len(computed) == 0)
+
+    serialize_start = time.perf_counter()
+    response = jsonify(prediction)
+    response.headers[CACHE_HEADER] = 'miss' if computed else 'hit'
+    metrics.observe_stage('serialize', serialize_start)
+
+    metrics.observe_stage('total', start)
+    metrics.observe_model_latency(model_name, start)
+
+    # only the requests of the active version are compared with the candidate
+    if shadow is not None and request.args.get('model') is None:
+        shadow.offer(payload['data'], prediction['prediction_raw'])
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    data, content_type = metrics.generate_metrics()
+    return Response(data, content_type=content_type)
+
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    stats = prediction_cache.stats()
+    stats['pid'] = os.getpid()
+    stats['model_version'] = registry.get()[1].version
+    return stats
+
+
+@app.route('/models', methods=['GET'])
+def models():
+    return registry.stats()
+
+
+@app.route('/shadow_stats', methods=['GET'])
+def shadow_stats():
+    if shadow is None:
+        return {'status' : 'error', 'error_type' : 'not_found'}, 404
+    return shadow.stats()
+
+
+@app.route('/predict_income/batch', methods=['POST'])
+def predict_income_batch():
+    payload_list = request.get_json()
+
+    if type(payload_list) is not list:
+        return {
+            'status' : 'error',
+            'error_type' : 'invalid_json',
+            'invalid_json' : ['payload is not a json list']
+        }
+
+    try:
+        _, model = registry.get(request.args.get('model'))
+    except KeyError:
+        return unknown_model(request.args.get('model'))
+
+    validated = [std_payload.validate_data(payload) for payload in payload_list]
+    predictions = iter(model.predict_batch(
+        [payload['data'] for payload in validated if not payload['has_error']]))
+
+    results = [payload['error_msg'] if payload['has_error'] else next(predictions)
+               for payload in validated]
+
+    return {
+        'status' : 'success',
+        'predictions' : results
+    }
+
+
+# admin endpoints of the profiler, not even registered unless enabled
+if os.environ.get('PROFILING_ENABLED', '0') == '1':
+    from profiler import profiling_blueprint
+
+    app.register_blueprint(profiling_blueprint(
+        targets={
+            'validate' : (std_payload, 'validate_data'),
+            'encode' : (lambda: registry.get()[1], 'encode'),
+            'predict' : (lambda: registry.get()[1], 'predict_features')
+        },
+        profile_dir=os.environ.get('PROFILE_DIR', '/tmp/profiles'),
+        token=os.environ.get('PROFILING_TOKEN')))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,182 @@
+"""
+Asynchronous entry point, serving the /predict_income contract of app.py. Concurrent
+requests are scored together by a MicroBatcher instead of one booster call per request.
+
+The local LRU of the prediction cache is read on the event loop, but the calls of its
+remote (redis) tier block up to their socket timeout, so they run in a thread pool:
+a slow redis must not stall the other requests, nor the batches being collected.
+
+Use: uvicorn asgi:app --host 0.0.0.0 --port 5000
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import time
+import urllib.parse
+
+from app import std_payload, registry, prediction_cache, shadow, unknown_model, CACHE_HEADER
+from microbatch import MicroBatcher
+import metrics
+
+
+# every row is submitted along with the model of its version
+batcher = MicroBatcher(max_size=int(os.environ.get('MICROBATCH_MAX_SIZE', '32')),
+                       max_wait=float(os.environ.get('MICROBATCH_MAX_WAIT_MS', '2')) / 1e3)
+
+# blocking calls of the remote tier of prediction_cache
+cache_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='prediction-cache')
+
+
+async def cache_lookup(key : str):
+    """Looks up the local LRU on the event loop, then the remote tier in cache_executor"""
+    prediction = prediction_cache.get_local(key)
+    if prediction is not None:
+        return prediction
+    if prediction_cache.remote is None:
+        # only counts the miss
+        return prediction_cache.get_remote(key)
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(cache_executor, prediction_cache.get_remote, key)
+
+
+def cache_store(key : str, prediction : dict):
+    """Stores the prediction in the local LRU, and in the remote tier without waiting for it"""
+    prediction_cache.set_local(key, prediction)
+    if prediction_cache.remote is not None:
+        cache_executor.submit(prediction_cache.set_remote, key, prediction)
+
+
+async def read_json(receive):
+    """Reads the request body, returns None if it is not valid json"""
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+
+    try:
+        return json.loads(body)
+    except ValueError:
+        return None
+
+
+def get_query(scope) -> dict:
+    return dict(urllib.parse.parse_qsl(scope.get('query_string', b'').decode()))
+
+
+async def send_body(send, body : bytes, content_type : str, status : int = 200, headers : dict = None):
+    extra_headers = [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]
+    await send({
+        'type' : 'http.response.start',
+        'status' : status,
+        'headers' : [(b'content-type', content_type.encode()),
+                     (b'content-length', str(len(body)).encode())] + extra_headers
+    })
+    await send({'type' : 'http.response.body', 'body' : body})
+
+
+async def send_json(send, data : dict, status : int = 200, headers : dict = None):
+    body = json.dumps(data, sort_keys=True, separators=(',', ':')).encode()
+    await send_body(send, body, 'application/json', status, headers)
+
+
+async def predict_income(payload, model, shadowed : bool = False):
+    """Same steps as app.predict_income
+
+    Args:
+        payload: Parsed request body
+        model (Model): Version scoring the request
+        shadowed (bool, optional): Offers the payload to the shadow candidate. Defaults to False.
+
+    Returns:
+        tuple: (response dict, headers dict)
+    """
+    payload = std_payload.validate_data(payload)
+
+    if payload['has_error']:
+        return payload['error_msg'], {}
+
+    features = model.encode(payload['data'])
+    key = prediction_cache.key(features, model.version)
+
+    cache_start = time.perf_counter()
+    prediction = await cache_lookup(key)
+    metrics.observe_stage('cache', cache_start)
+    metrics.count_cache_lookup(prediction is not None)
+
+    if prediction is not None:
+        headers = {CACHE_HEADER : 'hit'}
+    else:
+        prediction = await batcher.submit(features, model.predict_features)
+        registry.record(features)
+        cache_store(key, prediction)
+        headers = {CACHE_HEADER : 'miss'}
+
+    if shadowed:
+        shadow.offer(payload['data'], prediction['prediction_raw'])
+    return prediction, headers
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type' : 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            batcher.executor.shutdown(wait=False)
+            cache_executor.shutdown(wait=False)
+            await send({'type' : 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+
+    route = (scope['method'], scope['path'])
+
+    if route == ('POST', '/predict_income'):
+        start = time.perf_counter()
+        payload = await read_json(receive)
+        metrics.observe_stage('parse', start)
+
+        try:
+            model_name, model = registry.get(get_query(scope).get('model'))
+        except KeyError:
+            response, status = unknown_model(get_query(scope).get('model'))
+            return await send_json(send, response, status=status)
+
+        shadowed = shadow is not None and get_query(scope).get('model') is None
+        response, headers = await predict_income(payload, model, shadowed)
+
+        serialize_start = time.perf_counter()
+        await send_json(send, response, headers=headers)
+        metrics.observe_stage('serialize', serialize_start)
+        metrics.observe_stage('total', start)
+        metrics.observe_model_latency(model_name, start)
+
+    elif route == ('GET', '/metrics'):
+        data, content_type = metrics.generate_metrics()
+        await send_body(send, data, content_type)
+
+    elif route == ('GET', '/cache_stats'):
+        stats = prediction_cache.stats()
+        stats['pid'] = os.getpid()
+        stats['model_version'] = registry.get()[1].version
+        await send_json(send, stats)
+
+    elif route == ('GET', '/models'):
+        await send_json(send, registry.stats())
+
+    elif route == ('GET', '/shadow_stats') and shadow is not None:
+        await send_json(send, shadow.stats())
+
+    elif route == ('GET', '/microbatch_stats'):
+        await send_json(send, batcher.stats())
+
+    else:
+        await send_json(send, {'status' : 'error', 'error_type' : 'not_found'}, status=404)
@@ -0,0 +1,55 @@
+"""
+Binning of the real valued features of Adult Census dataset into ordinal ranks.
+
+Used by OrdinalTransformer (preprocess.py) and by the FeatureEncoder of the web service, which
+imports it without preprocess.py so that the bundle path does not import sklearn or pandas.
+"""
+
+import numpy as np
+
+
+def get_range(y, scale, num_range):
+    """General implementation of converting number ranges in terms of range. This will be 
+       reused consistently throughout OrdinalTransformer class.
+
+    Args:
+        y (int/float): Actual value of the number to be transformed (argument in df[col].apply(y))
+        scale (float): Scaling factor
+        num_range (int): Maximum number range (i.e. num_range=10, then range is from 1-10) 
+
+    Returns:
+        int: range/rank result
+    """
+
+    for i in range(1,num_range):
+        dif = y - scale * i
+        if dif < 0:
+            continue
+
+        if dif < scale:
+            return i  
+    return i
+
+
+def get_range_vectorized(y, scale, num_range):
+    """Vectorized version of get_range over a whole column. It performs the exact same 
+       float comparisons as get_range, one bin at a time, so the results are identical.
+
+    Args:
+        y (np.ndarray): Actual values of the numbers to be transformed
+        scale (float): Scaling factor
+        num_range (int): Maximum number range (i.e. num_range=10, then range is from 1-10) 
+
+    Returns:
+        np.ndarray: range/rank results
+    """
+
+    y = np.asarray(y, dtype=np.float64)
+    ranks = np.full(y.shape, num_range - 1, dtype=np.int64)
+
+    # get_range returns the first matching bin, so the lower bins are written last
+    for i in range(num_range - 1, 0, -1):
+        dif = y - scale * i
+        ranks[(dif >= 0) & (dif < scale)] = i
+
+    return ranks
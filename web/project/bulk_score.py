@@ -0,0 +1,360 @@
+"""
+Offline scoring of a large CSV or JSONL file, with the validation and the model of the
+service, in fixed-size chunks so that the memory does not grow with the input.
+
+Every chunk is validated row by row (StandardPayload), then encoded and scored with a single
+call of the booster. One output line per input row is written as soon as its chunk is
+scored, in the input order: the prediction of the /predict_income endpoint, or its error.
+
+- CSV: a header row, the fields of the reference json as columns (i.e. training/adult.csv).
+  The numerical columns are parsed into the types of the reference json, an empty cell is a
+  missing field, and the other columns are ignored.
+- JSONL: one payload per line, a line that is not valid json is an invalid_json error.
+
+With --workers N, the chunks are validated, encoded and scored by a pool of N processes,
+which use more than one core for the validation (bound to a single one by the GIL). The
+workers are spawned and load the files of the model themselves, since LightGBM uses OpenMP,
+which hangs in a process forked after a Booster was loaded. Every chunk in flight has a slot
+in shared memory, into which its worker encodes the feature matrix and writes the
+predictions: only the raw rows of the chunk and the errors of its invalid rows are pickled.
+The main process reads the chunks, and writes the results of the slots in the order of the
+input. --threads sets the OpenMP threads of every LightGBM call, so that workers x threads
+does not exceed the cores of the machine.
+
+Use: python bulk_score.py ../../training/adult.csv predictions.jsonl
+     python bulk_score.py payloads.jsonl predictions.csv --chunk-size 4096 --engine numpy
+     python bulk_score.py ../../training/adult.csv predictions.jsonl --workers 4 --threads 1
+"""
+
+import argparse
+from collections import deque
+import csv
+import itertools
+import json
+import multiprocessing
+from multiprocessing import shared_memory
+import os
+import sys
+import time
+
+import numpy as np
+
+from standard_payload import StandardPayload
+from model_predict import Model, format_predictions
+
+
+CSV_FIELDS = ['row', 'status', 'prediction_raw', 'predicted_income_class', 'error_type', 'errors']
+
+
+def file_format(path : str, fmt : str = None) -> str:
+    fmt = fmt or path.rsplit('.', 1)[-1].lower()
+    if fmt not in ('csv', 'jsonl'):
+        raise ValueError(f'Cannot tell the format of {path}, expected .csv or .jsonl')
+    return fmt
+
+
+class CsvPayload:
+    """Converts the cells of a CSV row into a payload, with the types of the reference json"""
+
+    def __init__(self, header : list, proper_types : dict):
+        """
+        Args:
+            header (list): Columns of the CSV
+            proper_types (dict): Field -> type, i.e. StandardPayload.proper_types
+        """
+        self.header = header
+        self.casts = [proper_types.get(col) if proper_types.get(col) in (int, float) else None for col in header]
+
+    def __call__(self, values : list) -> dict:
+        payload = {}
+        for col, cast, value in zip(self.header, self.casts, values):
+            if value == '':
+                continue
+            if cast is not None:
+                try:
+                    value = cast(value)
+                except ValueError:
+                    # left as a string, reported as an invalid_data_type
+                    pass
+            payload[col] = value
+        return payload
+
+
+def json_payload(line : str):
+    """Payload of a JSONL line, None if it is not valid json"""
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+
+def read_rows(f, fmt : str, proper_types : dict) -> tuple:
+    """
+    Returns:
+        tuple: (iterator of the raw rows of the file, function converting a raw row into a payload)
+    """
+    if fmt == 'csv':
+        reader = csv.reader(f)
+        return reader, CsvPayload(next(reader, []), proper_types)
+    return (line for line in f if line.strip()), json_payload
+
+
+def unseen_label_error(e : ValueError) -> dict:
+    return {
+        'status' : 'error',
+        'error_type' : 'unseen_label',
+        'unseen_label' : [str(e)]
+    }
+
+
+def score_rows(std_payload : StandardPayload, model : Model, payloads : list, features : np.ndarray,
+               predictions : np.ndarray, predict_kwargs : dict = None) -> tuple:
+    """Validates a chunk, encodes its valid rows into features and scores them into predictions
+
+    Args:
+        std_payload (StandardPayload): Validation of the payloads
+        model (Model): Model scoring the valid payloads
+        payloads (list): Raw payloads
+        features (np.ndarray): Buffer of at least len(payloads) rows
+        predictions (np.ndarray): Buffer of at least len(payloads) values
+        predict_kwargs (dict, optional): Other arguments of the booster's predict (i.e. num_threads)
+
+    Returns:
+        tuple: (number of valid rows, at the start of predictions, {offset in the chunk : error dict})
+    """
+    errors = {}
+    valid = []
+    for offset, payload in enumerate(payloads):
+        validated = std_payload.check_payload(payload)
+        if validated['has_error']:
+            errors[offset] = validated['error_msg']
+        else:
+            valid.append((offset, validated['data']))
+
+    try:
+        model.encode_batch([data for _, data in valid], out=features[:len(valid)])
+    except ValueError:
+        # a label unknown to the transformer, only the rows having one are errors
+        encoded = []
+        for offset, data in valid:
+            try:
+                features[len(encoded)] = model.encode(data)[0]
+                encoded.append((offset, data))
+            except ValueError as e:
+                errors[offset] = unseen_label_error(e)
+        valid = encoded
+
+    if valid:
+        predictions[:len(valid)] = model.model.predict(features[:len(valid)], **(predict_kwargs or {}))
+    return len(valid), errors
+
+
+def merge_results(pred_raw : np.ndarray, errors : dict, num_rows : int) -> list:
+    """One prediction or error dict per row of a chunk, in the order of the chunk"""
+    predictions = iter(format_predictions(pred_raw))
+    return [errors[offset] if offset in errors else next(predictions) for offset in range(num_rows)]
+
+
+def score_chunk(std_payload : StandardPayload, model : Model, payloads : list, predict_kwargs : dict = None) -> list:
+    """Same results as /predict_income for every payload
+
+    Returns:
+        list: One prediction or error dict per payload, in the same order
+    """
+    features = np.empty((len(payloads), len(model.feature_names)), dtype=np.float64)
+    predictions = np.empty(len(payloads), dtype=np.float64)
+    num_valid, errors = score_rows(std_payload, model, payloads, features, predictions, predict_kwargs)
+    return merge_results(predictions[:num_valid], errors, len(payloads))
+
+
+# state of a pool worker, set by init_worker
+worker = {}
+
+
+def init_worker(std_payload, load_kwargs, to_payload, shm_name, slots, chunk_size, predict_kwargs):
+    model = Model(**load_kwargs)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    features, predictions = slot_buffers(shm, slots, chunk_size, len(model.feature_names))
+    worker.update(std_payload=std_payload, model=model, to_payload=to_payload, shm=shm, features=features,
+                  predictions=predictions, predict_kwargs=predict_kwargs)
+
+
+def slot_buffers(shm, slots : int, chunk_size : int, num_features : int) -> tuple:
+    """
+    Returns:
+        tuple: (features of every slot, predictions of every slot), over the shared memory shm
+    """
+    features = np.ndarray((slots, chunk_size, num_features), dtype=np.float64, buffer=shm.buf)
+    predictions = np.ndarray((slots, chunk_size), dtype=np.float64, buffer=shm.buf, offset=features.nbytes)
+    return features, predictions
+
+
+def score_slot(slot : int, rows : list) -> tuple:
+    """Scores a chunk of raw rows in a pool worker, into its slot of shared memory"""
+    payloads = [worker['to_payload'](row) for row in rows]
+    return score_rows(worker['std_payload'], worker['model'], payloads, worker['features'][slot],
+                      worker['predictions'][slot], worker['predict_kwargs'])
+
+
+def score_parallel(std_payload : StandardPayload, model : Model, to_payload, chunks, chunk_size : int,
+                   workers : int, predict_kwargs : dict = None):
+    """Scores the chunks in a pool of processes, two chunks in flight per worker
+
+    Yields:
+        list: Results of every chunk, in the order of the chunks
+    """
+    slots = 2 * workers
+    num_features = len(model.feature_names)
+    shm = shared_memory.SharedMemory(create=True, size=slots * chunk_size * (num_features + 1) * 8)
+    features, predictions = slot_buffers(shm, slots, chunk_size, num_features)
+
+    context = multiprocessing.get_context('spawn')
+    pool = context.Pool(workers, initializer=init_worker,
+                        initargs=(std_payload, model.load_kwargs, to_payload, shm.name, slots, chunk_size,
+                                  predict_kwargs))
+    try:
+        pending = deque()
+        for idx, chunk in enumerate(chunks):
+            if len(pending) == slots:
+                yield collect(pending.popleft(), predictions)
+            # the slot of the chunk before last of this worker was collected above
+            slot = idx % slots
+            pending.append((slot, len(chunk), pool.apply_async(score_slot, (slot, chunk))))
+
+        while pending:
+            yield collect(pending.popleft(), predictions)
+    finally:
+        pool.terminate()
+        pool.join()
+        del features, predictions
+        shm.close()
+        shm.unlink()
+
+
+def collect(task : tuple, predictions : np.ndarray) -> list:
+    slot, num_rows, result = task
+    num_valid, errors = result.get()
+    return merge_results(predictions[slot, :num_valid], errors, num_rows)
+
+
+class JsonlWriter:
+
+    def __init__(self, f):
+        self.f = f
+
+    def write(self, row : int, result : dict):
+        self.f.write(json.dumps(dict(row=row, **result)) + '\n')
+
+
+class CsvWriter:
+
+    def __init__(self, f):
+        self.writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+        self.writer.writeheader()
+
+    def write(self, row : int, result : dict):
+        line = {'row' : row, 'status' : result['status']}
+        if result['status'] == 'success':
+            line['prediction_raw'] = result['prediction_raw']
+            line['predicted_income_class'] = result['predicted_income_class']
+        else:
+            line['error_type'] = result['error_type']
+            line['errors'] = ';'.join(map(str, result[result['error_type']]))
+        self.writer.writerow(line)
+
+
+def score_file(std_payload : StandardPayload, model : Model, src : str, dst : str, chunk_size : int = 2048,
+               src_format : str = None, dst_format : str = None, workers : int = 0, threads : int = 0) -> dict:
+    """Scores every row of src into dst, one chunk at a time
+
+    Args:
+        std_payload (StandardPayload): Validation of the payloads
+        model (Model): Model scoring the valid payloads
+        src (str): CSV or JSONL input
+        dst (str): CSV or JSONL output
+        chunk_size (int, optional): Rows validated and scored together. Defaults to 2048.
+        src_format (str, optional): 'csv' or 'jsonl'. Defaults to the extension of src.
+        dst_format (str, optional): 'csv' or 'jsonl'. Defaults to the extension of dst.
+        workers (int, optional): Processes scoring the chunks, 0 scores them in this one. Defaults to 0.
+        threads (int, optional): OpenMP threads of every LightGBM call, 0 for the default of
+                                 LightGBM (all the cores). Defaults to 0.
+
+    Returns:
+        dict: Number of rows, of errors, and the throughput
+    """
+    src_format = file_format(src, src_format)
+    dst_format = file_format(dst, dst_format)
+    predict_kwargs = {'num_threads' : threads} if threads > 0 and model.engine == 'lightgbm' else {}
+    start = time.perf_counter()
+    rows = errors = 0
+
+    with open(src, 'r', newline='') as f_in, open(dst, 'w', newline='') as f_out:
+        raw_rows, to_payload = read_rows(f_in, src_format, std_payload.proper_types)
+        writer = CsvWriter(f_out) if dst_format == 'csv' else JsonlWriter(f_out)
+        chunks = iter(lambda: list(itertools.islice(raw_rows, chunk_size)), [])
+
+        if workers > 0:
+            results = score_parallel(std_payload, model, to_payload, chunks, chunk_size, workers, predict_kwargs)
+        else:
+            results = (score_chunk(std_payload, model, [to_payload(row) for row in chunk], predict_kwargs)
+                       for chunk in chunks)
+
+        for chunk_results in results:
+            for result in chunk_results:
+                errors += result['status'] != 'success'
+                writer.write(rows, result)
+                rows += 1
+
+    seconds = time.perf_counter() - start
+    return {
+        'rows' : rows,
+        'errors' : errors,
+        'seconds' : seconds,
+        'rows_per_second' : rows / seconds if seconds > 0 else None
+    }
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('src', help='CSV or JSONL file of payloads')
+    parser.add_argument('dst', help='CSV or JSONL file of the predictions')
+    parser.add_argument('--chunk-size', type=int, default=2048, help='Rows validated and scored together')
+    parser.add_argument('--src-format', choices=['csv', 'jsonl'], help='Defaults to the extension of src')
+    parser.add_argument('--dst-format', choices=['csv', 'jsonl'], help='Defaults to the extension of dst')
+    parser.add_argument('--ref-json', default='dependencies/standard_payload.json', help='Reference json of the payloads')
+    parser.add_argument('--model', default='dependencies/model.txt', help='LightGBM model.txt')
+    parser.add_argument('--transformer', default='dependencies/data_transformer.pkl', help='Pickled DataTransformer')
+    parser.add_argument('--bundle', help='Model bundle, used instead of --model (see model_bundle.py)')
+    parser.add_argument('--engine', choices=['lightgbm', 'numpy', 'table'], default=os.environ.get('MODEL_ENGINE', 'lightgbm'),
+                        help='Scoring engine. Defaults to MODEL_ENGINE, lightgbm if unset, like the service.')
+    parser.add_argument('--pandas', action='store_true', help='Encodes with the pandas DataTransformer')
+    parser.add_argument('--workers', type=int, default=0, help='Processes scoring the chunks, 0 scores them in this one')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='OpenMP threads of every LightGBM call. Defaults to the cores per worker with '
+                             '--workers, to the LightGBM default (all the cores) otherwise.')
+    args = parser.parse_args()
+
+    return args
+
+
+def main():
+    args = get_args()
+
+    threads = args.threads
+    if threads is None:
+        threads = max(1, os.cpu_count() // args.workers) if args.workers > 0 else 0
+
+    std_payload = StandardPayload(ref_json=args.ref_json)
+    model = Model(model_file=None if args.bundle else args.model, transformer_file=args.transformer,
+                  bundle_file=args.bundle, engine=args.engine, fast_path=not args.pandas)
+
+    summary = score_file(std_payload, model, args.src, args.dst, chunk_size=args.chunk_size,
+                         src_format=args.src_format, dst_format=args.dst_format,
+                         workers=args.workers, threads=threads)
+
+    print(f'{summary["rows"]} rows scored into {args.dst} in {summary["seconds"]:.2f} s '
+          f'({summary["rows_per_second"]:.0f} rows/s), {summary["errors"]} errors', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+gunicorn settings, loaded automatically from the working directory by `gunicorn wsgi:app`.
+
+With GUNICORN_PRELOAD=1, the app (model, encoder tables and compiled validation plan) is
+loaded once in the master and the workers are forked from it, so that they share its
+memory copy-on-write instead of loading their own copy. The large model arrays are NumPy
+buffers, which are never written after the load. The garbage collector is disabled in the
+master while it loads the app, and its objects are frozen (gc.freeze) before every fork,
+so that the collections of the workers do not write to the pages of the shared objects.
+
+Preloading needs the numpy or table engine (MODEL_ENGINE): loading a LightGBM Booster
+starts its OpenMP threads, and libgomp hangs in a process forked after that, on the first
+prediction of every worker. gunicorn refuses to start with both.
+
+With PROMETHEUS_MULTIPROC_DIR set, every worker writes its metrics to that directory
+(see metrics.py). It is emptied when gunicorn starts, so that the samples of a previous
+run are not aggregated, and the files of dead workers are marked as such.
+"""
+
+import gc
+import os
+import shutil
+
+
+preload_app = os.environ.get('GUNICORN_PRELOAD', '0') == '1'
+
+if preload_app:
+    # avoids freed holes between the objects of the app, which the workers would share
+    gc.disable()
+
+
+def on_starting(server):
+    if server.cfg.preload_app and os.environ.get('MODEL_ENGINE', 'lightgbm') == 'lightgbm':
+        raise RuntimeError('GUNICORN_PRELOAD=1 (or --preload) needs MODEL_ENGINE=numpy or table, '
+                           'the workers forked after loading a LightGBM Booster hang')
+
+    multiproc_dir = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if multiproc_dir:
+        shutil.rmtree(multiproc_dir, ignore_errors=True)
+        os.makedirs(multiproc_dir)
+
+
+def pre_fork(server, worker):
+    if server.cfg.preload_app:
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    if server.cfg.preload_app:
+        gc.enable()
+
+
+def child_exit(server, worker):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
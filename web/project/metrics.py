@@ -0,0 +1,220 @@
+"""
+Prometheus metrics of the service, served at /metrics.
+
+Under gunicorn every worker is a separate process. Set PROMETHEUS_MULTIPROC_DIR (see
+app.env and gunicorn.conf.py) so that each worker writes its samples to memory-mapped
+files in that directory, which /metrics aggregates over all workers. Without it, the
+metrics of the current process are served.
+
+Recording a sample only updates plain Python counters. They are flushed into the
+prometheus_client metrics at most every METRICS_FLUSH_INTERVAL seconds (and before
+serving /metrics), since every prometheus_client update takes a lock and, in
+multiprocess mode, writes to the memory-mapped files.
+
+METRICS_ENABLED=0 turns every recording function into a no-op.
+"""
+
+from bisect import bisect_left
+import atexit
+import os
+import threading
+import time
+
+from prometheus_client import CollectorRegistry, Counter, Histogram, REGISTRY, CONTENT_TYPE_LATEST
+from prometheus_client import generate_latest, multiprocess
+
+
+# a gunicorn master preloading the app imports this module before on_starting creates the
+# directory (the workers reopen their own files after the fork)
+if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+STAGES = ['parse', 'validate', 'transform', 'cache', 'predict', 'serialize', 'total']
+LATENCY_BUCKETS = (25e-6, 50e-6, 100e-6, 250e-6, 500e-6, 1e-3, 2.5e-3, 5e-3, 10e-3, 25e-3, 50e-3, 0.1, 0.25, 1.0)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+DELTA_BUCKETS = (1e-6, 1e-4, 1e-3, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+STAGE_LATENCY = Histogram('predict_income_stage_seconds', 'Latency of every stage of a prediction request',
+                          ['stage'], buckets=LATENCY_BUCKETS)
+VALIDATION_ERRORS = Counter('payload_validation_errors', 'Rejected payloads by error type', ['error_type'])
+CACHE_LOOKUPS = Counter('prediction_cache_lookups', 'Prediction cache lookups by result', ['result'])
+BATCH_ROWS = Histogram('prediction_batch_rows', 'Rows scored by every model call', buckets=BATCH_BUCKETS)
+SHADOW_ROWS = Counter('shadow_rows', 'Rows offered to the shadow model by outcome', ['result'])
+SHADOW_DELTA = Histogram('shadow_score_delta', 'Absolute difference of the shadow and live probabilities',
+                         buckets=DELTA_BUCKETS)
+MODEL_LATENCY = Histogram('predict_income_model_seconds', 'Latency of the predictions by model version',
+                          ['model'], buckets=LATENCY_BUCKETS)
+
+enabled = os.environ.get('METRICS_ENABLED', '1') == '1'
+flush_interval = float(os.environ.get('METRICS_FLUSH_INTERVAL', '1.0'))
+
+
+class BufferedHistogram:
+    """Bucket counts of a histogram (or of one of its label values) not flushed yet"""
+
+    def __init__(self, histogram, buckets):
+        self.histogram = histogram
+        self.bounds = list(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0.0
+
+    def observe(self, value : float):
+        # same bucket as Histogram.observe: the first upper bound >= value
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+
+    def flush(self):
+        if self.total == 0 and not any(self.counts):
+            return
+        # prometheus_client only exposes observe(), which would take one update per sample
+        for bucket, count in zip(self.histogram._buckets, self.counts):
+            if count > 0:
+                bucket.inc(count)
+        self.histogram._sum.inc(self.total)
+
+        self.counts = [0] * len(self.counts)
+        self.total = 0.0
+
+
+class BufferedCounter:
+    """Increments of a counter (or of one of its label values) not flushed yet"""
+
+    def __init__(self, counter):
+        self.counter = counter
+        self.value = 0
+
+    def inc(self, amount : int = 1):
+        self.value += amount
+
+    def flush(self):
+        if self.value > 0:
+            self.counter.inc(self.value)
+            self.value = 0
+
+
+lock = threading.Lock()
+next_flush = time.monotonic() + flush_interval
+
+stage_latency = {stage : BufferedHistogram(STAGE_LATENCY.labels(stage), LATENCY_BUCKETS) for stage in STAGES}
+batch_rows = BufferedHistogram(BATCH_ROWS, BATCH_BUCKETS)
+cache_lookups = {True : BufferedCounter(CACHE_LOOKUPS.labels('hit')),
+                 False : BufferedCounter(CACHE_LOOKUPS.labels('miss'))}
+validation_errors = {}
+model_latency = {}
+shadow_rows = {result : BufferedCounter(SHADOW_ROWS.labels(result)) for result in ['agree', 'disagree', 'dropped', 'error']}
+shadow_delta = BufferedHistogram(SHADOW_DELTA, DELTA_BUCKETS)
+buffers = (list(stage_latency.values()) + [batch_rows] + list(cache_lookups.values())
+           + list(shadow_rows.values()) + [shadow_delta])
+
+
+def flush():
+    """Writes every buffered sample to the prometheus_client metrics"""
+    global next_flush
+    with lock:
+        next_flush = time.monotonic() + flush_interval
+        for buffer in buffers:
+            buffer.flush()
+
+
+def flush_if_due():
+    if time.monotonic() >= next_flush:
+        flush()
+
+
+def observe_stage(stage : str, start : float):
+    """Records the latency of a stage
+
+    Args:
+        stage (str): One of STAGES
+        start (float): time.perf_counter() at the start of the stage
+    """
+    if enabled:
+        observe_stage_seconds(stage, time.perf_counter() - start)
+
+
+def observe_stage_seconds(stage : str, seconds : float):
+    if enabled:
+        with lock:
+            stage_latency[stage].observe(seconds)
+        flush_if_due()
+
+
+def count_validation_error(error_type : str):
+    if enabled:
+        with lock:
+            if error_type not in validation_errors:
+                validation_errors[error_type] = BufferedCounter(VALIDATION_ERRORS.labels(error_type))
+                buffers.append(validation_errors[error_type])
+            validation_errors[error_type].inc()
+        flush_if_due()
+
+
+def count_cache_lookup(hit : bool):
+    if enabled:
+        with lock:
+            cache_lookups[hit].inc()
+        flush_if_due()
+
+
+def observe_model_latency(model : str, start : float):
+    """Records the latency of a request predicted by a version of the ModelRegistry
+
+    Args:
+        model (str): Name of the version
+        start (float): time.perf_counter() at the start of the request
+    """
+    if enabled:
+        seconds = time.perf_counter() - start
+        with lock:
+            if model not in model_latency:
+                model_latency[model] = BufferedHistogram(MODEL_LATENCY.labels(model), LATENCY_BUCKETS)
+                buffers.append(model_latency[model])
+            model_latency[model].observe(seconds)
+        flush_if_due()
+
+
+def observe_batch_rows(rows : int):
+    if enabled:
+        with lock:
+            batch_rows.observe(rows)
+        flush_if_due()
+
+
+def count_shadow_rows(result : str, rows : int = 1):
+    """
+    Args:
+        result (str): 'agree', 'disagree', 'dropped' (queue full) or 'error'
+        rows (int, optional): Number of rows. Defaults to 1.
+    """
+    if enabled:
+        with lock:
+            shadow_rows[result].inc(rows)
+        flush_if_due()
+
+
+def observe_shadow_deltas(deltas):
+    if enabled:
+        with lock:
+            for delta in deltas:
+                shadow_delta.observe(delta)
+        flush_if_due()
+
+
+def generate_metrics():
+    """
+    Returns:
+        tuple: (metrics in the Prometheus text format, content type)
+    """
+    flush()
+
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+# samples recorded since the last flush are not lost when a worker exits normally
+atexit.register(flush)
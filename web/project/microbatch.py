@@ -0,0 +1,128 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+import numpy as np
+
+
+class MicroBatcher:
+    """Collects the single-row requests of an asyncio event loop into batches.
+
+       A batch is flushed to the model when it holds max_size rows, or when its oldest
+       row has waited max_wait seconds. The model is called on a dedicated thread (the
+       LightGBM and NumPy calls release the GIL), so the event loop keeps accepting
+       requests, which form the next batch, while a batch is being scored.
+    """
+
+    def __init__(self, predict_batch=None, max_size : int = 32, max_wait : float = 0.002):
+        """
+        Args:
+            predict_batch (callable, optional): Scores a (n, num_features) matrix into a list of n
+                                                results (i.e. Model.predict_features). Can instead
+                                                be given with every row to submit.
+            max_size (int, optional): Maximum rows of a batch. Defaults to 32.
+            max_wait (float, optional): Maximum seconds a row waits for its batch to fill. Defaults to 2 ms.
+        """
+        self.predict_batch = predict_batch
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+        # created on the first submit, within the running event loop
+        self.pending = None
+        self.has_pending = None
+        self.is_full = None
+        self.task = None
+
+        self.batches = 0
+        self.rows = 0
+
+    def start(self):
+        self.pending = []
+        self.has_pending = asyncio.Event()
+        self.is_full = asyncio.Event()
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def submit(self, features : np.ndarray, predict_batch=None):
+        """Queues an encoded row and waits for its result
+
+        Args:
+            features (np.ndarray): Encoded row of shape (1, num_features) (Model.encode)
+            predict_batch (callable, optional): Scorer of the row (i.e. the model of a given version),
+                                                instead of the one of the batcher. The rows of a batch
+                                                are scored with one call per scorer.
+
+        Returns:
+            Result of predict_batch for the row
+        """
+        if self.task is None:
+            self.start()
+
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((time.monotonic(), features, future, predict_batch or self.predict_batch))
+
+        self.has_pending.set()
+        if len(self.pending) >= self.max_size:
+            self.is_full.set()
+
+        return await future
+
+    async def next_batch(self) -> list:
+        """Waits until a batch is due and takes it from the pending rows"""
+        await self.has_pending.wait()
+
+        timeout = self.pending[0][0] + self.max_wait - time.monotonic()
+        if len(self.pending) < self.max_size and timeout > 0:
+            try:
+                await asyncio.wait_for(self.is_full.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        batch = self.pending[:self.max_size]
+        self.pending = self.pending[self.max_size:]
+
+        if len(self.pending) < self.max_size:
+            self.is_full.clear()
+        if len(self.pending) == 0:
+            self.has_pending.clear()
+
+        return batch
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = await self.next_batch()
+            groups = {}
+            for item in batch:
+                groups.setdefault(item[3], []).append(item)
+
+            for predict_batch, group in groups.items():
+                await self.score(loop, predict_batch, group)
+
+    async def score(self, loop, predict_batch, group : list):
+        features = np.vstack([row for _, row, _, _ in group])
+
+        try:
+            results = await loop.run_in_executor(self.executor, predict_batch, features)
+        except Exception as e:
+            for _, _, future, _ in group:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.rows += len(group)
+        for (_, _, future, _), result in zip(group, results):
+            # the request may have been cancelled (client disconnected) in the meantime
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            'max_size' : self.max_size,
+            'max_wait_ms' : self.max_wait * 1e3,
+            'batches' : self.batches,
+            'rows' : self.rows,
+            'mean_batch_size' : self.rows / self.batches if self.batches > 0 else 0.0
+        }
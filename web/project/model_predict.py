@@ -1,29 +1,212 @@
-import lightgbm as lgb
 from utils import load_pickle
-import pandas as pd
+import metrics
+from feature_encoder import FeatureEncoder
+from model_bundle import ModelBundle
+from tree_ensemble import TreeEnsemble
+from score_table import ScoreTable, file_digest
 import numpy as np
+import hashlib
+import time
 
-class Model:
+# lightgbm (which imports pandas, scikit-learn and scipy) and pandas are only imported by
+# the code paths that need them, since importing them makes up most of the start time
+# of a worker
 
-    def __init__(self, model_file, transformer_file):
 
-        self.model = lgb.Booster(model_file=model_file)
-        self.transformer = load_pickle(transformer_file)
+def model_version(*paths) -> str:
+    """Content hash of the model artifacts, changes whenever one of the files changes"""
+    digest = hashlib.sha1()
+    for path in paths:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:12]
 
-    def predict(self, payload: dict):
-        df_payload = pd.DataFrame([payload])
-        df_transform = self.transformer.transform_features(df_payload)
-        pred_raw = self.model.predict(df_transform)
-        pred_readable = np.where(pred_raw > 0.5, '>50k', '<=50k')
 
-        pred_raw = pred_raw.tolist()[0]
-        pred_readable = pred_readable.tolist()[0]
-        
-        return {
+def format_predictions(pred_raw) -> list:
+    """Converts raw booster outputs to the response format of the endpoint
+
+    Args:
+        pred_raw (np.ndarray): Raw probabilities returned by the booster
+
+    Returns:
+        list: One response dict per predicted row
+    """
+    pred_readable = np.where(pred_raw > 0.5, '>50k', '<=50k')
+
+    return [
+        {
             'status' : 'success',
-            'prediction_raw' : pred_raw,
-            'predicted_income_class' : pred_readable 
+            'prediction_raw' : raw,
+            'predicted_income_class' : readable
         }
+        for raw, readable in zip(pred_raw.tolist(), pred_readable.tolist())
+    ]
+
+
+class Model:
+
+    def __init__(self, model_file=None, transformer_file=None, fast_path=True, engine='lightgbm',
+                 score_table_dir=None, bundle_file=None):
+        """
+        Args:
+            model_file (str, optional): Path of the LightGBM model.txt
+            transformer_file (str, optional): Path of the pickled DataTransformer. With a bundle_file,
+                                              it is only loaded by the pandas path (fast_path=False).
+            fast_path (bool, optional): Encodes payloads straight into NumPy rows with the compiled
+                                        FeatureEncoder. If False, goes through the pandas
+                                        DataTransformer instead. Defaults to True.
+            engine (str, optional): 'lightgbm' scores with lgb.Booster, 'numpy' with the pure
+                                    NumPy TreeEnsemble and 'table' with the precomputed
+                                    ScoreTable. Defaults to 'lightgbm'.
+            score_table_dir (str, optional): Score table built by score_table.py for the 'table'
+                                             engine. If None, the table is built at load time.
+            bundle_file (str, optional): ModelBundle (.npz) of the model and of the encoder tables,
+                                         used instead of model_file and transformer_file. A model_file
+                                         given along with it is only checked against the bundle. With
+                                         the 'numpy' or 'table' engine, neither sklearn, pandas nor
+                                         lightgbm is imported.
+
+        Raises:
+            ValueError: If both bundle_file and model_file are given and the bundle holds another
+                        model than model_file, i.e. a retrained model.txt deployed without its bundle
+        """
+
+        self.transformer_file = transformer_file
+        self._transformer = None
+        self.engine = engine
+        # arguments of a Model loading the same files in another process
+        self.load_kwargs = dict(model_file=model_file, transformer_file=transformer_file, fast_path=fast_path,
+                                engine=engine, score_table_dir=score_table_dir, bundle_file=bundle_file)
+
+        if bundle_file is not None:
+            bundle = ModelBundle.load(bundle_file)
+            model_str, model_digest = bundle.model_string, bundle.model_digest
+            if model_file and file_digest(model_file) != model_digest:
+                raise ValueError(f'{bundle_file} was not built from {model_file}, rebuild it with model_bundle.py '
+                                 'or unset MODEL_BUNDLE')
+            self.version = model_version(bundle_file)
+        else:
+            with open(model_file, 'rb') as f:
+                model_bytes = f.read()
+            model_str, model_digest = model_bytes.decode('utf-8'), hashlib.sha1(model_bytes).hexdigest()
+            self.version = model_version(model_file, transformer_file)
+
+        if engine == 'lightgbm':
+            import lightgbm as lgb
+            self.model = lgb.Booster(model_str=model_str)
+        elif engine == 'numpy':
+            self.model = TreeEnsemble.from_string(model_str)
+        elif engine == 'table' and score_table_dir is not None:
+            self.model = ScoreTable.load(score_table_dir, model_digest=model_digest)
+        elif engine == 'table':
+            self.model = ScoreTable.from_ensemble(TreeEnsemble.from_string(model_str), model_digest)
+        else:
+            raise ValueError(f'Unknown engine: {engine}')
+
+        self.feature_names = self.model.feature_name()
+        if bundle_file is not None:
+            self.encoder = FeatureEncoder(bundle.categories, bundle.ranges, self.feature_names)
+        else:
+            self.encoder = FeatureEncoder.from_transformer(self.transformer, self.feature_names)
+        self.fast_path = fast_path
+
+    @property
+    def transformer(self):
+        """Pickled DataTransformer, loaded on first use"""
+        if self._transformer is None:
+            if self.transformer_file is None:
+                raise ValueError('The pandas path (fast_path=False) needs the transformer_file')
+            self._transformer = load_pickle(self.transformer_file)
+        return self._transformer
+
+    def format_predictions(self, pred_raw) -> list:
+        return format_predictions(pred_raw)
+
+    def transform_pandas(self, payloads: list):
+        """Transforms validated payloads with the pandas DataTransformer, in the
+           feature order of the booster
+
+        Args:
+            payloads (list): Validated payloads
+
+        Returns:
+            pd.DataFrame: Transformed features
+        """
+        import pandas as pd
+
+        df_payload = pd.DataFrame(payloads)
+        df_transform = self.transformer.transform_features(df_payload)
+        return df_transform[self.feature_names]
+
+    def encode(self, payload: dict) -> np.ndarray:
+        """Encodes a validated payload into a float64 row, in the feature order of the booster
+
+        Args:
+            payload (dict): Validated payload
+
+        Returns:
+            np.ndarray: Matrix of shape (1, number of features)
+        """
+        start = time.perf_counter()
+        if self.fast_path:
+            features = self.encoder.encode(payload)
+        else:
+            features = self.transform_pandas([payload]).to_numpy(dtype=np.float64)
+
+        metrics.observe_stage('transform', start)
+        return features
+
+    def encode_batch(self, payloads: list, out: np.ndarray = None) -> np.ndarray:
+        """Encodes validated payloads into a float64 matrix, in the feature order of the booster
+
+        Args:
+            payloads (list): Validated payloads
+            out (np.ndarray, optional): Matrix of the output shape to be written into. Allocated if None.
+
+        Returns:
+            np.ndarray: Matrix of shape (len(payloads), number of features)
+        """
+        start = time.perf_counter()
+        if self.fast_path:
+            features = self.encoder.encode_batch(payloads, out)
+        elif out is not None:
+            out[:] = self.transform_pandas(payloads).to_numpy(dtype=np.float64)
+            features = out
+        else:
+            features = self.transform_pandas(payloads).to_numpy(dtype=np.float64)
+
+        metrics.observe_stage('transform', start)
+        return features
+
+    def predict_features(self, features: np.ndarray) -> list:
+        """Scores already encoded rows
+
+        Args:
+            features (np.ndarray): Output of encode or encode_batch
+
+        Returns:
+            list: One response dict per row
+        """
+        start = time.perf_counter()
+        pred_raw = self.model.predict(features)
+
+        metrics.observe_stage('predict', start)
+        metrics.observe_batch_rows(len(features))
+        return self.format_predictions(pred_raw)
+
+    def predict(self, payload: dict):
+        return self.predict_features(self.encode(payload))[0]
+
+    def predict_batch(self, payloads: list) -> list:
+        """Scores multiple validated payloads with a single transform and booster call
 
+        Args:
+            payloads (list): List of validated payloads (the 'data' of StandardPayload.validate_data)
 
+        Returns:
+            list: One response dict per payload, in the same order
+        """
+        if len(payloads) == 0:
+            return []
 
+        return self.predict_features(self.encode_batch(payloads))
@@ -0,0 +1,277 @@
+"""
+Versions of the model resident in a worker, and the hot reload of new ones.
+
+A registry directory holds one directory per version, as written by training/train.py
+(model_bundle.npz, or model.txt and data_transformer.pkl), and an ACTIVE file naming the
+version that serves the requests without ?model=<version>:
+
+    models/
+        ACTIVE      v2
+        v1/         model.txt  data_transformer.pkl  model_bundle.npz
+        v2/         ...
+
+Every worker polls ACTIVE. When it names a version that is not resident, the worker loads
+it in a background thread and warms it up with the last rows it scored, then swaps it in.
+Until then, requests keep being served by the previous version. The last `max_versions`
+activated versions stay resident, so that they can still be requested with ?model= and a
+rollback (activating one of them again) is immediate.
+
+Use: python model_registry.py publish models v3 ../../training/model   (copies the artifacts and activates v3)
+     python model_registry.py activate models v2
+"""
+
+import argparse
+from collections import OrderedDict, deque
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+from model_predict import Model
+from process_thread import ProcessThread
+
+
+ACTIVE_FILE = 'ACTIVE'
+BUNDLE_FILE = 'model_bundle.npz'
+MODEL_FILE = 'model.txt'
+TRANSFORMER_FILE = 'data_transformer.pkl'
+
+
+def load_version_dir(path : str, **model_kwargs) -> Model:
+    """Loads the artifacts of a version, the bundle if there is one
+
+    Args:
+        path (str): Directory written by training/train.py
+        model_kwargs: Other arguments of Model (i.e. engine, fast_path)
+
+    Returns:
+        Model: Loaded model
+    """
+    transformer_file = os.path.join(path, TRANSFORMER_FILE)
+    if not os.path.exists(transformer_file):
+        transformer_file = None
+
+    if os.path.exists(os.path.join(path, BUNDLE_FILE)):
+        # a model.txt next to the bundle is checked against it
+        model_file = os.path.join(path, MODEL_FILE)
+        return Model(bundle_file=os.path.join(path, BUNDLE_FILE), transformer_file=transformer_file,
+                     model_file=model_file if os.path.exists(model_file) else None, **model_kwargs)
+    return Model(model_file=os.path.join(path, MODEL_FILE), transformer_file=transformer_file, **model_kwargs)
+
+
+def read_active(registry_dir : str) -> str:
+    with open(os.path.join(registry_dir, ACTIVE_FILE), 'r') as f:
+        return f.read().strip()
+
+
+def write_active(registry_dir : str, name : str):
+    """Points ACTIVE to a version, atomically for the workers reading it"""
+    if not os.path.isdir(os.path.join(registry_dir, name)):
+        raise ValueError(f'{name} is not a version of {registry_dir}')
+
+    tmp_file = os.path.join(registry_dir, f'.{ACTIVE_FILE}.{os.getpid()}')
+    with open(tmp_file, 'w') as f:
+        f.write(name + '\n')
+    os.replace(tmp_file, os.path.join(registry_dir, ACTIVE_FILE))
+
+
+def publish(registry_dir : str, name : str, src_dir : str, activate : bool = True):
+    """Copies the artifacts of training/train.py into a new version of the registry
+
+    Args:
+        registry_dir (str): Registry directory
+        name (str): Name of the new version
+        src_dir (str): Directory written by training/train.py
+        activate (bool, optional): Points ACTIVE to the new version. Defaults to True.
+    """
+    dst_dir = os.path.join(registry_dir, name)
+    if os.path.exists(dst_dir):
+        raise ValueError(f'{dst_dir} already exists, versions are immutable')
+
+    # the workers never see a partially copied version
+    tmp_dir = os.path.join(registry_dir, f'.{name}.{os.getpid()}')
+    shutil.copytree(src_dir, tmp_dir)
+    os.rename(tmp_dir, dst_dir)
+
+    if activate:
+        write_active(registry_dir, name)
+
+
+class ModelRegistry:
+
+    def __init__(self, model_kwargs : dict = None, registry_dir : str = None, max_versions : int = 2,
+                 poll_interval : float = 5.0, warmup_rows : int = 64):
+        """
+        Args:
+            model_kwargs (dict, optional): Arguments of Model for every loaded version (i.e. engine)
+            registry_dir (str, optional): Registry directory. If None, the versions are only
+                                          added with add, and nothing is polled.
+            max_versions (int, optional): Versions kept resident, the active one included. Defaults to 2.
+            poll_interval (float, optional): Seconds between two reads of ACTIVE. Defaults to 5.
+            warmup_rows (int, optional): Last scored rows kept to warm up a new version. Defaults to 64.
+        """
+        self.model_kwargs = model_kwargs or {}
+        self.registry_dir = registry_dir
+        self.max_versions = max_versions
+        self.poll_interval = poll_interval
+
+        # name -> Model, the least recently activated first
+        self.models = OrderedDict()
+        # (name, Model) of the active version, swapped with a single assignment so that a
+        # request sees either the previous or the new version
+        self.current = (None, None)
+        self.lock = threading.Lock()
+        self.loading = None
+        self.failed = {}
+        self.load_seconds = {}
+        self.recent_rows = deque(maxlen=warmup_rows)
+        # polls ACTIVE in every worker, from its first request
+        self.watcher = ProcessThread(self.watch, 'model-registry')
+
+    def add(self, name : str, model : Model, activate : bool = True):
+        """Makes a loaded model resident, evicting the least recently activated versions"""
+        with self.lock:
+            self.models[name] = model
+            if activate or self.active is None:
+                self.models.move_to_end(name)
+                self.current = (name, model)
+
+            while len(self.models) > self.max_versions:
+                evicted = next(resident for resident in self.models if resident != self.active)
+                del self.models[evicted]
+
+    @property
+    def active(self) -> str:
+        return self.current[0]
+
+    def get(self, name : str = None) -> tuple:
+        """
+        Args:
+            name (str, optional): Version requested with ?model=. Defaults to the active one.
+
+        Raises:
+            KeyError: If the version is not resident
+
+        Returns:
+            tuple: (name, Model) of the version
+        """
+        if self.registry_dir is not None:
+            self.watcher.ensure_started()
+
+        if name is None:
+            return self.current
+        return name, self.models[name]
+
+    def activate(self, name : str) -> bool:
+        """Activates a resident version
+
+        Returns:
+            bool: False if the version is not resident
+        """
+        with self.lock:
+            if name not in self.models:
+                return False
+            self.models.move_to_end(name)
+            self.current = (name, self.models[name])
+            return True
+
+    def record(self, features : np.ndarray):
+        """Keeps an encoded row scored by the active version, to warm up the next one"""
+        self.recent_rows.append(features)
+
+    def warmup(self, model : Model):
+        """Scores the last rows with a new model before it serves requests. It goes through
+           the engine directly, so that the metrics of the requests are not affected.
+        """
+        num_features = len(model.feature_names)
+        rows = [row for row in list(self.recent_rows) if row.shape[1] == num_features]
+        rows = rows or [np.zeros((1, num_features))]
+        pred = model.model.predict(np.vstack(rows))
+        if not np.isfinite(pred).all():
+            raise ValueError('the model returns non finite predictions')
+
+    def load(self, name : str, activate : bool = True):
+        """Loads a version of the registry directory, warms it up and adds it"""
+        start = time.perf_counter()
+        model = load_version_dir(os.path.join(self.registry_dir, name), **self.model_kwargs)
+        self.warmup(model)
+        self.load_seconds[name] = time.perf_counter() - start
+        self.add(name, model, activate)
+
+    def poll(self):
+        """Follows ACTIVE: activates the version it names, loading it if needed. A version
+           that fails to load is not retried, the current one keeps serving.
+        """
+        name = read_active(self.registry_dir)
+        if name == self.active or name in self.failed or self.activate(name):
+            return
+
+        self.loading = name
+        try:
+            self.load(name)
+        except Exception as e:
+            self.failed[name] = f'{type(e).__name__}: {e}'
+        finally:
+            self.loading = None
+
+    def watch(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.poll()
+            except OSError:
+                # ACTIVE being replaced or the registry being unreachable, retried at the next poll
+                pass
+
+    def stats(self) -> dict:
+        return {
+            'pid' : os.getpid(),
+            'active' : self.active,
+            'loading' : self.loading,
+            'failed' : dict(self.failed),
+            'versions' : {
+                name : {
+                    'version' : model.version,
+                    'load_seconds' : self.load_seconds.get(name)
+                }
+                for name, model in list(self.models.items())
+            }
+        }
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_publish = subparsers.add_parser('publish', help='Copies the artifacts of training/train.py into a new version')
+    parser_publish.add_argument('registry_dir', help='Registry directory')
+    parser_publish.add_argument('name', help='Name of the new version')
+    parser_publish.add_argument('src', help='Directory written by training/train.py')
+    parser_publish.add_argument('--no-activate', action='store_true', help='Does not point ACTIVE to the new version')
+
+    parser_activate = subparsers.add_parser('activate', help='Points ACTIVE to a version')
+    parser_activate.add_argument('registry_dir', help='Registry directory')
+    parser_activate.add_argument('name', help='Name of the version')
+
+    args = parser.parse_args()
+
+    return args
+
+
+def main():
+    args = get_args()
+
+    if args.command == 'publish':
+        publish(args.registry_dir, args.name, args.src, activate=not args.no_activate)
+        print(f'{args.src} published to {args.registry_dir} as {args.name}')
+    else:
+        write_active(args.registry_dir, args.name)
+
+    if args.command == 'activate' or not args.no_activate:
+        print(f'{args.name} is now active, the workers switch to it within their poll interval')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+from collections import OrderedDict
+import hashlib
+import json
+import threading
+import time
+
+import numpy as np
+
+
+class LRUCache:
+    """In-process least recently used cache with a bounded number of entries,
+       each of them expiring ttl seconds after it was set. Not thread-safe by itself.
+    """
+
+    def __init__(self, maxsize : int, ttl : float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    def get(self, key : str):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if expires_at is not None and expires_at < time.monotonic():
+            del self.entries[key]
+            return None
+
+        self.entries.move_to_end(key)
+        return value
+
+    def set(self, key : str, value):
+        if self.maxsize <= 0:
+            return
+
+        expires_at = None if self.ttl is None else time.monotonic() + self.ttl
+        self.entries[key] = (expires_at, value)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class RedisTier:
+    """Remote cache tier on a redis client. Values are stored as JSON."""
+
+    def __init__(self, client, timeout : int = None):
+        """
+        Args:
+            client (redis.Redis): Redis client (redis_config.get_redis_client)
+            timeout (int, optional): Expiration of the entries in seconds. Defaults to no expiration.
+        """
+        self.client = client
+        self.timeout = timeout
+
+    def get(self, key : str):
+        value = self.client.get(key)
+        return None if value is None else json.loads(value)
+
+    def set(self, key : str, value, timeout : int = None):
+        self.client.set(key, json.dumps(value), ex=timeout or self.timeout)
+
+
+class Flight:
+    """A computation in progress that concurrent requests of the same key wait for"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+
+
+class PredictionCache:
+    """Caches predictions by the content of the encoded feature row, so that payloads
+       that only differ in casing, excess fields or raw values within the same ordinal
+       bin share one entry. Lookups go to a bounded local LRU first, then to a remote
+       cache (redis) if one is given.
+
+       Concurrent lookups of the same missing key within a worker are coalesced into a
+       single computation. Errors of the remote cache never fail a lookup: the remote is
+       skipped for remote_backoff seconds and the worker keeps serving from its LRU.
+    """
+
+    def __init__(self, model_version : str, local_size : int = 10000, remote=None, timeout=None,
+                       local_ttl : float = None, remote_backoff : float = 5.0):
+        """
+        Args:
+            model_version (str): Version of the model, part of every key (Model.version)
+            local_size (int, optional): Maximum entries of the local LRU. Defaults to 10000.
+            remote (optional): Object with get(key) and set(key, value, timeout=...) (i.e. RedisTier)
+            timeout (int, optional): Timeout of the remote entries. Defaults to the remote's default.
+            local_ttl (float, optional): Seconds before a local entry expires. Defaults to never.
+            remote_backoff (float, optional): Seconds the remote is skipped after an error. Defaults to 5.
+        """
+        self.model_version = model_version
+        self.local = LRUCache(local_size, local_ttl)
+        self.remote = remote
+        self.timeout = timeout
+        self.remote_backoff = remote_backoff
+        self.remote_skip_until = 0.0
+
+        self.lock = threading.Lock()
+        self.flights = {}
+
+        self.hits_local = 0
+        self.hits_remote = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.remote_calls = 0
+        self.remote_errors = 0
+
+    def key(self, features : np.ndarray, model_version : str = None) -> str:
+        """Cache key of an encoded row
+
+        Args:
+            features (np.ndarray): Encoded row (Model.encode)
+            model_version (str, optional): Version of the model scoring the row. Defaults to the
+                                           version of the cache.
+
+        Returns:
+            str: Key made of the model version and a hash of the feature values
+        """
+        row = np.ascontiguousarray(features, dtype=np.float64)
+        digest = hashlib.blake2b(row.tobytes(), digest_size=16).hexdigest()
+        return f'prediction:{model_version or self.model_version}:{digest}'
+
+    def remote_call(self, method : str, *args, **kwargs):
+        """Calls the remote cache, unless it is absent or backing off after an error"""
+        if self.remote is None or time.monotonic() < self.remote_skip_until:
+            return None
+
+        self.remote_calls += 1
+        try:
+            return getattr(self.remote, method)(*args, **kwargs)
+        except Exception:
+            # a slow or unreachable remote must never fail the request
+            self.remote_errors += 1
+            self.remote_skip_until = time.monotonic() + self.remote_backoff
+            return None
+
+    def get_local(self, key : str):
+        """Looks up a prediction in the local LRU only, returns None if it is not there"""
+        with self.lock:
+            value = self.local.get(key)
+            if value is not None:
+                self.hits_local += 1
+            return value
+
+    def get_remote(self, key : str):
+        """Looks up a prediction missing from the local LRU in the remote cache, returns None
+           if it is not cached. Blocks on the remote, up to its socket timeout.
+        """
+        value = self.remote_call('get', key)
+
+        with self.lock:
+            if value is not None:
+                self.hits_remote += 1
+                self.local.set(key, value)
+            else:
+                self.misses += 1
+
+        return value
+
+    def get(self, key : str):
+        """Looks up a prediction, returns None if it is not cached"""
+        value = self.get_local(key)
+        return value if value is not None else self.get_remote(key)
+
+    def set_local(self, key : str, value):
+        with self.lock:
+            self.local.set(key, value)
+
+    def set_remote(self, key : str, value):
+        """Blocks on the remote, up to its socket timeout"""
+        self.remote_call('set', key, value, timeout=self.timeout)
+
+    def set(self, key : str, value):
+        self.set_local(key, value)
+        self.set_remote(key, value)
+
+    def get_or_compute(self, key : str, compute):
+        """Looks up a prediction and computes it on a miss. Concurrent calls with the same
+           key share a single remote lookup and computation.
+
+        Args:
+            key (str): Cache key (PredictionCache.key)
+            compute (callable): Computes the value without arguments
+
+        Returns:
+            Cached or computed value
+        """
+        with self.lock:
+            value = self.local.get(key)
+            if value is not None:
+                self.hits_local += 1
+                return value
+
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.event.wait()
+            # the leading call failed, compute without the cache
+            return flight.value if flight.value is not None else compute()
+
+        try:
+            flight.value = self.get(key)
+            if flight.value is None:
+                flight.value = compute()
+                self.set(key, flight.value)
+            return flight.value
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.event.set()
+
+    def stats(self) -> dict:
+        return {
+            'model_version' : self.model_version,
+            'hits_local' : self.hits_local,
+            'hits_remote' : self.hits_remote,
+            'misses' : self.misses,
+            'coalesced' : self.coalesced,
+            'remote_calls' : self.remote_calls,
+            'remote_errors' : self.remote_errors,
+            'local_size' : len(self.local)
+        }
@@ -2,6 +2,9 @@ from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.preprocessing import LabelEncoder
 
 import pandas as pd
+import numpy as np
+
+from binning import get_range, get_range_vectorized
 
 
 class CategoricalTransformer(BaseEstimator, TransformerMixin):
@@ -35,6 +38,42 @@ class CategoricalTransformer(BaseEstimator, TransformerMixin):
         for col_transform in self.transformers:
             col_transform[1].fit(df[col_transform[0]])
 
+    def fit_uniques(self, uniques : dict):
+        """Fits the LabelEncoders from the unique values of every field, gathered chunk by chunk
+           from a dataset too large to be loaded at once. Encodes like fit on the whole dataset.
+
+        Args:
+            uniques (dict): Set of the unique values of every field
+        """
+        for col_transform in self.transformers:
+            # not sorted here: LabelEncoder sorts them and puts a missing value (NaN) last, like fit
+            col_transform[1].fit(np.array(list(uniques[col_transform[0]]), dtype=object))
+
+    def extend(self, df : pd.DataFrame) -> dict:
+        """Appends the feature values never seen during fit to the classes of their LabelEncoder,
+           so that they get the next codes. The codes of the known values do not change, so a model
+           trained on them can keep boosting or be refitted on rows with the new values.
+
+        Args:
+            df (pd.DataFrame): New rows of the Adult Census dataset
+
+        Returns:
+            dict: New values of every field that had some
+        """
+        added = {}
+        for col_transform in self.transformers[0:-1]:
+            classes = col_transform[1].classes_
+            values = pd.Series(df[col_transform[0]].unique(), dtype=object)
+            values = values[~values.isin(classes)]
+            # a missing value (NaN) goes last, as in the classes of fit
+            new_values = sorted(values.dropna()) + ([np.nan] if values.isna().any() else [])
+            if new_values:
+                # object classes are encoded with a dict lookup, which does not need them sorted
+                col_transform[1].classes_ = np.concatenate([classes.astype(object), np.array(new_values, dtype=object)])
+                added[col_transform[0]] = new_values
+
+        return added
+
  
     def transform(self, df : pd.DataFrame) -> pd.DataFrame:
         """Performs multiple Label Encoding to multiple fields 
@@ -80,6 +119,16 @@ class OrdinalTransformer(BaseEstimator, TransformerMixin):
         TransformerMixin ([type]): Scikit-Learn TransfromerMixin class
     """
     
+    # (scale, num_range) of every real valued feature. Kept at class level so that
+    # transformers unpickled from older data_transformer.pkl files also see them.
+    ranges = {
+        'age' : (100 / 10, 10),
+        'capital.gain' : (100e3 / 10, 10),
+        'capital.loss' : (5000 / 10, 10),
+        'fnlwgt' : (1484705 / 10, 10),
+        'hours.per.week' : (100 / 10, 10),
+    }
+
     def __init__(self):
         self.transformers = [
             ('age', self.get_age_range),
@@ -100,34 +149,22 @@ class OrdinalTransformer(BaseEstimator, TransformerMixin):
             pd.DataFrame: Dataframe of transformed dataset
         """
 
-        df_transform = pd.DataFrame() 
+        df_transform = pd.DataFrame(index=df.index)
         for col_transform in self.transformers:
-            df_transform[col_transform[0]] = df[col_transform[0]].apply(col_transform[1])
+            scale, num_range = self.ranges[col_transform[0]]
+            df_transform[col_transform[0]] = self.get_range_vectorized(
+                                                  df[col_transform[0]].to_numpy(), scale, num_range)
             
         return df_transform
             
         
-    def get_range(self, y, scale, num_range):
-        """General implementation of converting number ranges in terms of range. This will be 
-           reused consistently throughout OrdinalTransformer class.
-
-        Args:
-            y (int/float): Actual value of the number to be transformed (argument in df[col].apply(y))
-            scale (float): Scaling factor
-            num_range (int): Maximum number range (i.e. num_range=10, then range is from 1-10) 
+    def get_range_vectorized(self, y, scale, num_range):
+        """binning.get_range_vectorized, kept as a method for the callers of OrdinalTransformer"""
+        return get_range_vectorized(y, scale, num_range)
 
-        Returns:
-            int: range/rank result
-        """
-
-        for i in range(1,num_range):
-            dif = y - scale * i
-            if dif < 0:
-                continue
-
-            if dif < scale:
-                return i  
-        return i
+    def get_range(self, y, scale, num_range):
+        """binning.get_range, kept as a method for the callers of OrdinalTransformer"""
+        return get_range(y, scale, num_range)
 
     def get_age_range(self, y):
         """Calibrated application of get_range for age feature
@@ -138,9 +175,7 @@ class OrdinalTransformer(BaseEstimator, TransformerMixin):
         Returns:
             int: range/rank result
         """
-
-        num_range = 10
-        scale = 100 / num_range
+        scale, num_range = self.ranges['age']
         return self.get_range(y, scale, num_range)
 
     def get_capital_gain_range(self, y):
@@ -152,8 +187,7 @@ class OrdinalTransformer(BaseEstimator, TransformerMixin):
         Returns:
             int: range/rank result
         """
-        num_range = 10
-        scale = 100e3 / num_range
+        scale, num_range = self.ranges['capital.gain']
         return self.get_range(y, scale, num_range)
 
     def get_capital_loss_range(self, y):
@@ -165,8 +199,7 @@ class OrdinalTransformer(BaseEstimator, TransformerMixin):
         Returns:
             int: range/rank result
         """
-        num_range = 10
-        scale = 5000 / num_range
+        scale, num_range = self.ranges['capital.loss']
         return self.get_range(y, scale, num_range)
 
     def get_fnlwgt_range(self, y):
@@ -178,8 +211,7 @@ class OrdinalTransformer(BaseEstimator, TransformerMixin):
         Returns:
             int: range/rank result
         """
-        num_range = 10
-        scale = 1484705 / num_range
+        scale, num_range = self.ranges['fnlwgt']
         return self.get_range(y, scale, num_range)
 
     def get_hours_per_week_range(self, y):
@@ -191,8 +223,7 @@ class OrdinalTransformer(BaseEstimator, TransformerMixin):
         Returns:
             int: range/rank result
         """
-        num_range = 10
-        scale = 100 / num_range
+        scale, num_range = self.ranges['hours.per.week']
         return self.get_range(y, scale, num_range)
     
     def fit(self, df : pd.DataFrame):
@@ -219,6 +250,25 @@ class DataTransformer(BaseEstimator, TransformerMixin):
         """
         self.cat_transformer.fit(df)
         self.ord_transformer.fit(df)
+
+    def fit_uniques(self, uniques : dict):
+        """Fits cat_transformer from the unique values of every categorical field
+
+        Args:
+            uniques (dict): Set of the unique values of every field
+        """
+        self.cat_transformer.fit_uniques(uniques)
+
+    def extend(self, df : pd.DataFrame) -> dict:
+        """Appends the categorical values never seen during fit, see CategoricalTransformer.extend
+
+        Args:
+            df (pd.DataFrame): New rows of the Adult Census dataset
+
+        Returns:
+            dict: New values of every categorical field that had some
+        """
+        return self.cat_transformer.extend(df)
  
     def transform(self, df : pd.DataFrame) -> pd.DataFrame:
         """Transforms the whole dataframe
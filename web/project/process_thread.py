@@ -0,0 +1,34 @@
+"""
+Background threads of the workers, started by the workers themselves: a gunicorn master
+that preloads the app would start them before forking, and its threads do not survive
+the fork.
+"""
+
+import os
+import threading
+
+
+class ProcessThread:
+    """A daemon thread running target, started once per process by the first call of
+       ensure_started in that process.
+    """
+
+    def __init__(self, target, name : str):
+        self.target = target
+        self.name = name
+        self.lock = threading.Lock()
+        self.pid = None
+
+    def ensure_started(self):
+        """Starts the thread unless it already runs in the current process. Cheap enough
+           to be called on every request.
+        """
+        if self.pid == os.getpid():
+            return
+
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+
+        threading.Thread(target=self.target, name=self.name, daemon=True).start()
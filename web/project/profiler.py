@@ -0,0 +1,213 @@
+"""
+Opt-in profiling of a live worker, registered by app.py only when PROFILING_ENABLED=1.
+
+Every worker profiles itself: the admin request starts a session in the worker that
+receives it, and the result is written to PROFILE_DIR under a name tagged with the PID
+of that worker, so that any worker can list and serve it afterwards.
+
+- POST /admin/profile/sample?seconds=10&requests=0&interval_ms=5
+    Samples the stacks of every thread of the worker, and writes them in the collapsed
+    stack format of flamegraph.pl / speedscope (profile-<pid>-<time>.collapsed).
+- POST /admin/profile/cprofile?target=predict&seconds=10&requests=100
+    Runs cProfile around the calls of a single function (i.e. Model.predict_features or
+    StandardPayload.validate_data) and writes pstats (cprofile-<target>-<pid>-<time>.prof).
+- GET /admin/profile            Lists the profiles and the active session of the worker
+- GET /admin/profile/<name>     Downloads a profile
+
+A session stops after `seconds`, or after `requests` requests (sample) or calls of the
+target (cprofile), whichever comes first. If PROFILING_TOKEN is set, the admin requests
+need it in the X-Profiling-Token header.
+"""
+
+import cProfile
+from collections import Counter
+import functools
+import os
+import sys
+import threading
+import time
+
+from flask import Blueprint, abort, jsonify, request, send_from_directory
+
+
+def collapse_stack(frame) -> str:
+    """Stack of a frame in the collapsed format, root first, frames separated by ';'"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler:
+    """Statistical profiler: samples the stacks of every other thread at a fixed interval"""
+
+    def __init__(self, path : str, seconds : float, max_requests : int = 0, interval : float = 0.005):
+        self.path = path
+        self.seconds = seconds
+        self.max_requests = max_requests
+        self.interval = interval
+        self.requests = 0
+        self.samples = 0
+        self.stacks = Counter()
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def count_request(self):
+        self.requests += 1
+
+    def run(self):
+        own_id = threading.get_ident()
+        deadline = time.monotonic() + self.seconds
+
+        while time.monotonic() < deadline and not (self.max_requests and self.requests >= self.max_requests):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    self.stacks[collapse_stack(frame)] += 1
+            self.samples += 1
+            time.sleep(self.interval)
+
+        with open(self.path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+        self.done.set()
+
+    def join(self, timeout : float = None) -> bool:
+        return self.done.wait(timeout)
+
+
+class FunctionProfiler:
+    """Runs cProfile around the calls of one method of one object, by shadowing the
+       method with an instance attribute until the session ends
+    """
+
+    def __init__(self, path : str, obj, method : str, seconds : float, max_calls : int = 0):
+        self.path = path
+        self.obj = obj
+        self.method = method
+        self.seconds = seconds
+        self.max_calls = max_calls
+        self.calls = 0
+        self.profile = cProfile.Profile()
+        # cProfile hooks a single thread at a time, the profiled calls are serialized
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.timer = threading.Timer(seconds, self.stop)
+        self.timer.daemon = True
+
+    def start(self):
+        original = getattr(self.obj, self.method)
+
+        @functools.wraps(original)
+        def profiled(*args, **kwargs):
+            with self.lock:
+                # the session may still be stopping, past max_calls
+                if self.done.is_set() or (self.max_calls and self.calls >= self.max_calls):
+                    return original(*args, **kwargs)
+                self.calls += 1
+                try:
+                    return self.profile.runcall(original, *args, **kwargs)
+                finally:
+                    if self.max_calls and self.calls >= self.max_calls:
+                        self.timer.cancel()
+                        threading.Thread(target=self.stop, daemon=True).start()
+
+        setattr(self.obj, self.method, profiled)
+        self.timer.start()
+
+    def count_request(self):
+        pass
+
+    def stop(self):
+        with self.lock:
+            if self.done.is_set():
+                return
+            # removing the instance attribute restores the method of the class
+            delattr(self.obj, self.method)
+            self.profile.dump_stats(self.path)
+            self.done.set()
+
+    def join(self, timeout : float = None) -> bool:
+        return self.done.wait(timeout)
+
+
+def profiling_blueprint(targets : dict, profile_dir : str, token : str = None) -> Blueprint:
+    """Admin endpoints of the profiler
+
+    Args:
+        targets (dict): cprofile target name -> (object, method name), i.e. {'predict' : (model, 'predict_features')}.
+                        The object can be given as a function returning it (i.e. the active model).
+        profile_dir (str): Directory of the profiles, shared by the workers
+        token (str, optional): Value expected in the X-Profiling-Token header
+
+    Returns:
+        Blueprint: Blueprint to be registered on the app
+    """
+    blueprint = Blueprint('profiling', __name__, url_prefix='/admin/profile')
+    os.makedirs(profile_dir, exist_ok=True)
+    # session of this worker, a single one at a time
+    state = {'session' : None, 'file' : None}
+
+    def busy() -> bool:
+        return state['session'] is not None and not state['session'].done.is_set()
+
+    def start_session(session, file_name):
+        session.start()
+        state['session'] = session
+        state['file'] = file_name
+        return jsonify({'status' : 'started', 'pid' : os.getpid(), 'file' : file_name})
+
+    @blueprint.before_request
+    def check_token():
+        if token and request.headers.get('X-Profiling-Token') != token:
+            abort(403)
+        if request.method == 'POST' and busy():
+            abort(409, 'a profiling session is already running on this worker')
+
+    @blueprint.after_app_request
+    def count_request(response):
+        if busy():
+            state['session'].count_request()
+        return response
+
+    @blueprint.route('/sample', methods=['POST'])
+    def sample():
+        file_name = f'profile-{os.getpid()}-{int(time.time())}.collapsed'
+        session = StackSampler(os.path.join(profile_dir, file_name),
+                               seconds=request.args.get('seconds', 10, type=float),
+                               max_requests=request.args.get('requests', 0, type=int),
+                               interval=request.args.get('interval_ms', 5, type=float) / 1e3)
+        return start_session(session, file_name)
+
+    @blueprint.route('/cprofile', methods=['POST'])
+    def cprofile():
+        target = request.args.get('target', 'predict')
+        if target not in targets:
+            abort(400, f'target must be one of {sorted(targets)}')
+
+        obj, method = targets[target]
+        if callable(obj):
+            obj = obj()
+        file_name = f'cprofile-{target}-{os.getpid()}-{int(time.time())}.prof'
+        session = FunctionProfiler(os.path.join(profile_dir, file_name), obj, method,
+                                   seconds=request.args.get('seconds', 10, type=float),
+                                   max_calls=request.args.get('requests', 0, type=int))
+        return start_session(session, file_name)
+
+    @blueprint.route('', methods=['GET'])
+    def list_profiles():
+        return jsonify({
+            'pid' : os.getpid(),
+            'active' : state['file'] if busy() else None,
+            'profiles' : sorted(os.listdir(profile_dir))
+        })
+
+    @blueprint.route('/<name>', methods=['GET'])
+    def download(name):
+        return send_from_directory(profile_dir, name, as_attachment=True)
+
+    return blueprint
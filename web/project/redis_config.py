@@ -1,5 +1,6 @@
 import os
 
+
 def get_config():
     return {
         'CACHE_TYPE' : os.environ['CACHE_TYPE'],
@@ -7,5 +8,25 @@ def get_config():
         'CACHE_REDIS_PORT' : os.environ['CACHE_REDIS_PORT'],
         'CACHE_REDIS_DB' : os.environ['CACHE_REDIS_DB'],
         'CACHE_REDIS_URL' : os.environ['CACHE_REDIS_URL'],
-        'CACHE_DEFAULT_TIMEOUT' : os.environ['CACHE_DEFAULT_TIMEOUT']
+        'CACHE_DEFAULT_TIMEOUT' : os.environ['CACHE_DEFAULT_TIMEOUT'],
+        'CACHE_REDIS_SOCKET_TIMEOUT' : os.environ.get('CACHE_REDIS_SOCKET_TIMEOUT', '0.05')
     }
+
+
+def get_redis_client():
+    """Redis client of the prediction cache, with short socket timeouts so that a slow
+       redis degrades to a cache miss instead of stalling the worker
+
+    Returns:
+        redis.Redis: Client, or None if CACHE_TYPE is not redis
+    """
+    config = get_config()
+    if config['CACHE_TYPE'].lower() not in ['redis', 'rediscache']:
+        return None
+
+    import redis
+
+    socket_timeout = float(config['CACHE_REDIS_SOCKET_TIMEOUT'])
+    return redis.Redis.from_url(config['CACHE_REDIS_URL'],
+                                socket_timeout=socket_timeout,
+                                socket_connect_timeout=socket_timeout)
@@ -0,0 +1,212 @@
+"""
+Precomputes the leaf reached by every tree for every combination of its input intervals.
+
+Use: python score_table.py dependencies/model.txt dependencies/score_table
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+from tree_ensemble import TreeEnsemble
+
+
+TABLE_FILE = 'leaf_index.npy'
+ARRAYS_FILE = 'arrays.npz'
+META_FILE = 'meta.json'
+
+ARRAY_ATTRIBUTES = ['leaf_values', 'leaf_base', 'interval_offset', 'value_low', 'value_high',
+                    'value_offset', 'value_intervals', 'contrib', 'table_offset']
+
+
+def file_digest(path : str) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+class ScoreTable(TreeEnsemble):
+    """Lookup-table version of TreeEnsemble.
+
+       Within a tree, all the values of a feature that fall between two consecutive
+       thresholds of that tree reach the same leaf. Each tree therefore only sees a small
+       number of effective intervals per feature, and the leaf of every combination of
+       them is precomputed into a flat uint8 leaf index table. Scoring a row is then a gather of
+       per-interval table offsets, a table lookup and a gather of leaf values.
+
+       A single table over all 13 features would need the product of the interval counts
+       of every feature (2.8e11 cells for the shipped model), so there is one table per tree.
+    """
+
+    @classmethod
+    def from_ensemble(cls, ensemble : TreeEnsemble, model_digest : str = None):
+        """Builds the tables of a parsed model
+
+        Args:
+            ensemble (TreeEnsemble): Parsed model
+            model_digest (str, optional): sha1 of the model.txt, checked when loading
+
+        Returns:
+            ScoreTable: Score table of the model
+        """
+        table = cls.__new__(cls)
+        table.__dict__.update(ensemble.__dict__)
+        table.model_digest = model_digest
+        table.build_lookup()
+        return table
+
+    def build_lookup(self):
+        num_intervals, num_trees, num_words = self.interval_masks.shape
+        bounds = list(self.interval_offset) + [num_intervals]
+
+        # table offset contributed by every global interval to every tree
+        self.contrib = np.zeros((num_intervals, num_trees), dtype=np.int64)
+        self.table_offset = np.zeros(num_trees, dtype=np.int64)
+        leaf_dtype = np.uint8 if self.leaf_values.shape[1] <= 256 else np.uint16
+        tables = []
+
+        for t in range(num_trees):
+            size = 1
+            features = []
+
+            for f in range(self.num_features - 1, -1, -1):
+                masks = self.interval_masks[bounds[f]:bounds[f + 1], t]
+                # consecutive global intervals with the same mask are one interval for this tree
+                changed = (masks[1:] != masks[:-1]).any(axis=1)
+                local = np.concatenate([[0], np.cumsum(changed)])
+                num_local = local[-1] + 1
+                if num_local == 1:
+                    continue
+
+                self.contrib[bounds[f]:bounds[f + 1], t] = local * size
+                first = bounds[f] + np.searchsorted(local, np.arange(num_local))
+                features.append((first, size, num_local))
+                size *= num_local
+
+            cells = np.arange(size)
+            masks = np.full((size, num_words), np.iinfo(np.uint64).max, dtype=np.uint64)
+            for first, stride, num_local in features:
+                masks &= self.interval_masks[first[(cells // stride) % num_local], t]
+
+            self.table_offset[t] = sum(len(table) for table in tables)
+            tables.append(self.leaf_position(masks).astype(leaf_dtype))
+
+        self.table = np.concatenate(tables)
+
+    def leaf_position(self, masks : np.ndarray) -> np.ndarray:
+        """Position of the lowest set bit of each (num_words) bitmask"""
+        word_idx = np.argmax(masks != 0, axis=-1)
+        word = np.take_along_axis(masks, word_idx[..., None], axis=-1)[..., 0]
+        lowest_bit = (word & np.negative(word)).astype(np.float64)
+        return (lowest_bit.view(np.int64) >> 52) - 1023 + 64 * word_idx
+
+    def save(self, dst_dir : str):
+        """Writes the table as a memory-mappable .npy plus the small lookup arrays
+
+        Args:
+            dst_dir (str): Destination directory
+        """
+        os.makedirs(dst_dir, exist_ok=True)
+
+        np.save(os.path.join(dst_dir, TABLE_FILE), self.table)
+        np.savez(os.path.join(dst_dir, ARRAYS_FILE),
+                 thresholds=np.concatenate(self.thresholds),
+                 **{name : getattr(self, name) for name in ARRAY_ATTRIBUTES})
+
+        meta = {
+            'model_digest' : self.model_digest,
+            'sigmoid' : self.sigmoid,
+            'feature_names' : self.feature_names,
+            'num_words' : self.num_words
+        }
+        with open(os.path.join(dst_dir, META_FILE), 'w') as f:
+            json.dump(meta, f, indent=4)
+
+    @classmethod
+    def load(cls, src_dir : str, model_file : str = None, model_digest : str = None):
+        """Loads a saved table. The large table is memory-mapped.
+
+        Args:
+            src_dir (str): Directory written by save
+            model_file (str, optional): If given, the table must have been built from this model.txt
+            model_digest (str, optional): If given, the table must have been built from a model.txt
+                                          with this sha1
+
+        Returns:
+            ScoreTable: Loaded score table
+        """
+        with open(os.path.join(src_dir, META_FILE), 'r') as f:
+            meta = json.load(f)
+
+        if model_file is not None and meta['model_digest'] != file_digest(model_file):
+            raise ValueError(f'{src_dir} was not built from {model_file}')
+        if model_digest is not None and meta['model_digest'] != model_digest:
+            raise ValueError(f'{src_dir} was not built from the model with sha1 {model_digest}')
+
+        table = cls.__new__(cls)
+        table.model_digest = meta['model_digest']
+        table.sigmoid = meta['sigmoid']
+        table.feature_names = meta['feature_names']
+        table.num_features = len(meta['feature_names'])
+        table.num_words = meta['num_words']
+
+        with np.load(os.path.join(src_dir, ARRAYS_FILE)) as arrays:
+            for name in ARRAY_ATTRIBUTES:
+                setattr(table, name, arrays[name])
+            thresholds = arrays['thresholds']
+
+        bounds = list(table.interval_offset - np.arange(table.num_features)) + [len(thresholds)]
+        table.thresholds = [thresholds[bounds[f]:bounds[f + 1]] for f in range(table.num_features)]
+        table.table = np.load(os.path.join(src_dir, TABLE_FILE), mmap_mode='r')
+
+        return table
+
+    def predict_raw(self, X : np.ndarray) -> np.ndarray:
+        intervals = self.get_intervals(X)
+
+        if X.shape[0] <= 64:
+            cells = self.contrib[intervals].sum(axis=1)
+        else:
+            cells = self.contrib.take(intervals[:, 0], axis=0)
+            for f in range(1, self.num_features):
+                cells += self.contrib.take(intervals[:, f], axis=0)
+
+        leaf_idx = self.table.take(cells + self.table_offset) + (self.leaf_base + 1023)
+        values = self.leaf_values.take(leaf_idx)
+
+        # sequential sum over the trees, like LightGBM
+        return np.cumsum(values, axis=1)[:, -1]
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model', help='LightGBM model.txt')
+    parser.add_argument('dst', help='Destination directory of the score table')
+    args = parser.parse_args()
+
+    return args
+
+
+def main():
+    args = get_args()
+
+    start = time.perf_counter()
+    ensemble = TreeEnsemble(args.model)
+    table = ScoreTable.from_ensemble(ensemble, file_digest(args.model))
+    build_time = time.perf_counter() - start
+
+    table.save(args.dst)
+
+    full_cells = np.prod([len(thr) + 1.0 for thr in table.thresholds])
+    print(f'Trees: {ensemble.num_trees()}')
+    print(f'Cells of a single table over all features: {full_cells:.3g}')
+    print(f'Cells of the per-tree tables: {len(table.table)} ({table.table.nbytes / 1e6:.2f} MB)')
+    print(f'Build time: {build_time:.2f} s')
+    print(f'Score table saved to {args.dst}')
+
+
+if __name__ == '__main__':
+    main()
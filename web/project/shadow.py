@@ -0,0 +1,170 @@
+"""
+Shadow scoring of a candidate model on live traffic, registered by app.py only when
+SHADOW_MODEL_DIR is set.
+
+A fraction of the validated payloads scored by the active version is queued along with the
+probability returned to the client. A background thread of every worker wakes up every
+`interval` seconds, drains the queue, and scores the rows in batches with the candidate,
+encoding them with its own encoder (a retrained transformer may have other categories).
+The request only pays for a random draw and a non-blocking put: when the queue is full,
+the row is dropped and counted instead of waiting for the thread.
+
+The agreement rate (same income class) and the absolute differences of the probabilities
+are served by GET /shadow_stats for the worker, and exported as the shadow_rows and
+shadow_score_delta metrics for all of them.
+"""
+
+import os
+import queue
+import random
+import threading
+import time
+
+import numpy as np
+
+from model_predict import Model
+from process_thread import ProcessThread
+import metrics
+
+
+class ShadowScorer:
+
+    def __init__(self, candidate : Model, name : str = 'candidate', fraction : float = 0.1, max_queue : int = 1024,
+                 batch_size : int = 256, interval : float = 1.0):
+        """
+        Args:
+            candidate (Model): Model compared with the live one
+            name (str, optional): Name of the candidate in the stats. Defaults to 'candidate'.
+            fraction (float, optional): Fraction of the requests queued. Defaults to 0.1.
+            max_queue (int, optional): Rows waiting to be scored, beyond which they are dropped. Defaults to 1024.
+            batch_size (int, optional): Rows scored by a single call of the candidate. Defaults to 256.
+            interval (float, optional): Seconds between two drains of the queue. Defaults to 1.
+        """
+        self.candidate = candidate
+        self.name = name
+        self.fraction = fraction
+        self.batch_size = batch_size
+        self.interval = interval
+        self.queue = queue.Queue(maxsize=max_queue)
+
+        # counters of the worker, only written by the scoring thread except for dropped
+        self.dropped = 0
+        self.scored = 0
+        self.agreements = 0
+        self.errors = 0
+        self.delta_sum = 0.0
+        self.delta_max = 0.0
+        self.lock = threading.Lock()
+        # scores in every worker, from its first offer
+        self.thread = ProcessThread(self.run, 'shadow-scorer')
+
+    def offer(self, payload : dict, live_raw : float):
+        """Queues a validated payload and the probability of the live model, for a fraction
+           of the calls. Never blocks.
+        """
+        if self.fraction < 1.0 and random.random() >= self.fraction:
+            return
+
+        self.thread.ensure_started()
+
+        try:
+            self.queue.put_nowait((payload, live_raw))
+        except queue.Full:
+            self.dropped += 1
+            metrics.count_shadow_rows('dropped')
+
+    def drain(self) -> int:
+        """Scores the rows queued so far
+
+        Returns:
+            int: Number of rows taken from the queue
+        """
+        rows = []
+        while True:
+            try:
+                rows.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+
+        for idx in range(0, len(rows), self.batch_size):
+            batch = rows[idx:idx + self.batch_size]
+            try:
+                self.score(batch)
+            except Exception:
+                # anything score does not handle itself, i.e. a failing metric
+                self.count_errors(len(batch))
+        return len(rows)
+
+    def score(self, rows : list):
+        """Scores a batch of (payload, live probability) with the candidate. It goes through
+           the encoder and the engine directly, so that the metrics of the requests are not affected.
+        """
+        encoder = self.candidate.encoder
+        try:
+            features = encoder.encode_batch([payload for payload, _ in rows])
+        except ValueError:
+            # a category unknown to the candidate, only the rows having one are skipped
+            encoded = []
+            for payload, raw in rows:
+                try:
+                    encoded.append((encoder.encode(payload), raw))
+                except ValueError:
+                    pass
+            self.count_errors(len(rows) - len(encoded))
+            if not encoded:
+                return
+            rows = encoded
+            features = np.vstack([row for row, _ in encoded])
+
+        try:
+            candidate_raw = self.candidate.model.predict(features)
+        except Exception:
+            self.count_errors(len(rows))
+            return
+
+        live_raw = np.array([raw for _, raw in rows], dtype=np.float64)
+        deltas = np.abs(candidate_raw - live_raw)
+        agreements = int(((candidate_raw > 0.5) == (live_raw > 0.5)).sum())
+
+        with self.lock:
+            self.scored += len(rows)
+            self.agreements += agreements
+            self.delta_sum += float(deltas.sum())
+            self.delta_max = max(self.delta_max, float(deltas.max()))
+
+        metrics.count_shadow_rows('agree', agreements)
+        metrics.count_shadow_rows('disagree', len(rows) - agreements)
+        metrics.observe_shadow_deltas(deltas.tolist())
+
+    def count_errors(self, rows : int):
+        if rows:
+            with self.lock:
+                self.errors += rows
+            metrics.count_shadow_rows('error', rows)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.drain()
+            except Exception:
+                # the thread keeps running whatever happens, or every later offer would be
+                # dropped once the queue is full
+                pass
+
+    def stats(self) -> dict:
+        with self.lock:
+            scored = self.scored
+            return {
+                'pid' : os.getpid(),
+                'candidate' : self.name,
+                'candidate_version' : self.candidate.version,
+                'fraction' : self.fraction,
+                'queued' : self.queue.qsize(),
+                'dropped' : self.dropped,
+                'scored' : scored,
+                'errors' : self.errors,
+                'agreement_rate' : self.agreements / scored if scored else None,
+                'mean_abs_delta' : self.delta_sum / scored if scored else None,
+                'max_abs_delta' : self.delta_max if scored else None
+            }
@@ -1,14 +1,57 @@
 from utils import load_json
+import metrics
+
+import time
+
+
+# type names of the reference json (str(type(value))) and the types they stand for
+TYPE_NAMES = {str(t) : t for t in [int, float, str, bool, list, dict, type(None)]}
 
 
 class StandardPayload:
     """Class object for validating if the payload is a standard json payload. 
        It checks for various error such as Missing Fields, Invalid Data types, 
        Proper Categorical Data, and Negative Values.
+
+       The reference json is compiled at construction into a validation plan, so that
+       validate_data checks a payload in a single pass. The staged checks below
+       (validate_data_staged) define the expected behavior.
     """
 
     def __init__(self, ref_json : str):
         self.standard_payload = load_json(ref_json)
+        self.compile_plan()
+
+    def compile_plan(self):
+        """Compiles the reference json into real type objects, frozensets of categories
+           and one (field, type, categories, numerical) entry per mandatory field
+        """
+        ref = self.standard_payload
+        mandatory = ref['mandatory_fields']
+
+        unknown = [v for v in ref['proper_types'].values() if v not in TYPE_NAMES]
+        if len(unknown) > 0:
+            raise ValueError(f'Unknown types in proper_types: {unknown}')
+
+        unchecked = [field for field in list(ref['categorical_data']) + ref['numerical_data']
+                     if field not in ref['proper_types']]
+        if len(unchecked) > 0:
+            raise ValueError(f'Categorical and numerical fields need a proper type: {unchecked}')
+
+        self.optional_fields = list(ref['optional_fields'])
+        self.proper_types = {field : TYPE_NAMES[v] for field, v in ref['proper_types'].items()}
+        self.categories = {field : frozenset(v) for field, v in ref['categorical_data'].items()}
+        self.numerical_fields = list(ref['numerical_data'])
+
+        self.required_fields = frozenset(field for field in mandatory if field not in self.optional_fields)
+
+        self.plan = [
+            (field, 
+             self.proper_types.get(field), 
+             self.categories.get(field), 
+             field in self.numerical_fields)
+            for field in mandatory
+        ]
 
 
     def wrap_data(self, data) -> dict:
@@ -206,8 +249,9 @@ class StandardPayload:
         return data
 
 
-    def validate_data(self, data) -> dict:
-        """Runs the payload validation end to end
+    def validate_data_staged(self, data) -> dict:
+        """Runs the payload validation end to end, one check at a time.
+           Modifies the raw payload in place.
 
         Args:
             data: Raw json payload
@@ -235,3 +279,76 @@ class StandardPayload:
 
         data = self.check_negative_data(data)
         return data
+
+
+    def wrap_error(self, data, error_list : list, error_type : str) -> dict:
+        return self.update_if_error_exist(self.wrap_data(data), error_list, error_type)
+
+    def validate_data(self, data) -> dict:
+        """Runs the payload validation end to end, with the same results and error
+           ordering as validate_data_staged, in a single pass over the compiled plan.
+           The raw payload is not modified.
+
+        Args:
+            data: Raw json payload
+
+        Returns:
+            dict: Wrapped json payload. Contains error information if there are any
+        """
+        start = time.perf_counter()
+        validated = self.check_payload(data)
+
+        if validated['has_error']:
+            metrics.count_validation_error(validated['error_msg']['error_type'])
+        metrics.observe_stage('validate', start)
+
+        return validated
+
+    def check_payload(self, data) -> dict:
+        """Single pass of validate_data, without metrics"""
+
+        if type(data) is not dict:
+            return self.wrap_error(data, ['payload is not a json'], 'invalid_json')
+        if len(data) == 0:
+            return self.wrap_error(data, ['empty json'], 'invalid_json')
+
+        if not self.required_fields <= data.keys():
+            filled = {k : v.lower() if type(v) is str else v for k, v in data.items()}
+            for field in self.optional_fields:
+                filled.setdefault(field, '?')
+            missing = [field for field, _, _, _ in self.plan if field not in filled]
+            return self.wrap_error(filled, missing, 'missing_fields')
+
+        validated = {}
+        has_invalid_type = has_invalid_category = has_negative = False
+
+        for field, proper_type, categories, numerical in self.plan:
+            # only optional fields can be absent at this point
+            value = data.get(field, '?')
+            if type(value) is str:
+                value = value.lower()
+            validated[field] = value
+
+            if proper_type is not None and type(value) is not proper_type:
+                has_invalid_type = True
+            elif categories is not None and value not in categories:
+                has_invalid_category = True
+            elif numerical and value < 0:
+                has_negative = True
+
+        # the error lists follow the field order of the failing check in the reference json
+        if has_invalid_type:
+            invalid_types = [field for field, proper_type in self.proper_types.items()
+                             if type(validated[field]) is not proper_type]
+            return self.wrap_error(validated, invalid_types, 'invalid_data_type')
+
+        if has_invalid_category:
+            invalid_categories = [field for field, categories in self.categories.items()
+                                  if validated[field] not in categories]
+            return self.wrap_error(validated, invalid_categories, 'invalid_categorical_data')
+
+        if has_negative:
+            with_negative_values = [field for field in self.numerical_fields if validated[field] < 0]
+            return self.wrap_error(validated, with_negative_values, 'fields_with_negative')
+
+        return self.wrap_data(validated)
@@ -0,0 +1,262 @@
+import numpy as np
+
+
+# decision_type bits of LightGBM's text model format
+CATEGORICAL_MASK = 1
+MISSING_TYPE_SHIFT = 2
+MISSING_TYPE_MASK = 3
+
+
+def parse_array(value : str, dtype) -> np.ndarray:
+    return np.array(value.split(' '), dtype=dtype) if value else np.empty(0, dtype=dtype)
+
+
+def parse_model_string(model_str : str):
+    """Parses a LightGBM text model into its header and its list of trees
+
+    Args:
+        model_str (str): Content of a LightGBM model.txt
+
+    Returns:
+        tuple: (header dict, list of tree dicts), every value as the raw string of the file
+    """
+    header = {}
+    trees = []
+    current = header
+
+    for line in model_str.splitlines():
+        if line == 'end of trees':
+            break
+
+        if line.startswith('Tree='):
+            current = {}
+            trees.append(current)
+            continue
+
+        key, sep, value = line.partition('=')
+        if sep:
+            current[key] = value
+
+    return header, trees
+
+
+class TreeEnsemble:
+    """Pure NumPy evaluator of a LightGBM binary model, that can stand in for lgb.Booster
+       at prediction time.
+
+       The trees are evaluated with bitmasks (QuickScorer): every split that a value
+       sends to the right removes the leaves of its left subtree, and the exit leaf of a
+       tree is the leftmost leaf that survives all the splits. The masks only depend on
+       which thresholds a value exceeds, so they are precomputed per feature interval.
+       Since every feature of this model is a small bounded integer (feature_infos), the
+       interval of each possible value is precomputed as well, and a whole batch is scored
+       with a fixed number of array operations, whatever the depth of the trees.
+    """
+
+    def __init__(self, model_file : str):
+        """
+        Args:
+            model_file (str): Path of the LightGBM model.txt
+        """
+        with open(model_file, 'r') as f:
+            self.load_model_string(f.read())
+
+    @classmethod
+    def from_string(cls, model_str : str):
+        ensemble = cls.__new__(cls)
+        ensemble.load_model_string(model_str)
+        return ensemble
+
+    def load_model_string(self, model_str : str):
+        header, trees = parse_model_string(model_str)
+
+        objective = header['objective'].split(' ')
+        if objective[0] != 'binary':
+            raise ValueError(f'Unsupported objective: {header["objective"]}')
+        self.sigmoid = float(dict(param.split(':') for param in objective[1:]).get('sigmoid', 1.0))
+
+        if 'average_output' in header:
+            raise ValueError('Averaged (random forest) models are not supported')
+
+        self.feature_names = header['feature_names'].split(' ')
+        self.num_features = int(header['max_feature_idx']) + 1
+
+        self.build_tables(trees, header['feature_infos'].split(' '))
+
+    def build_tables(self, trees : list, feature_infos : list):
+        num_trees = len(trees)
+        max_leaves = max(int(tree['num_leaves']) for tree in trees)
+        self.num_words = (max_leaves + 63) // 64
+        all_leaves = np.full((num_trees, self.num_words), np.iinfo(np.uint64).max, dtype=np.uint64)
+
+        # value of every leaf, ordered left to right within its tree
+        self.leaf_values = np.zeros((num_trees, self.num_words * 64), dtype=np.float64)
+        # (feature, threshold, tree, mask of the leaves that survive when the value goes right)
+        splits = []
+
+        for t, tree in enumerate(trees):
+            leaf_value = parse_array(tree['leaf_value'], np.float64)
+            if int(tree['num_leaves']) == 1:
+                self.leaf_values[t, 0] = leaf_value[0]
+                continue
+
+            decision_type = parse_array(tree['decision_type'], np.int64)
+            if (decision_type & CATEGORICAL_MASK).any():
+                raise ValueError('Categorical splits are not supported')
+            if ((decision_type >> MISSING_TYPE_SHIFT) & MISSING_TYPE_MASK).any():
+                raise ValueError('Splits with missing value handling are not supported')
+
+            split_feature = parse_array(tree['split_feature'], np.int64)
+            threshold = parse_array(tree['threshold'], np.float64)
+            left_child = parse_array(tree['left_child'], np.int64)
+            right_child = parse_array(tree['right_child'], np.int64)
+
+            # left to right order of the leaves and the leaf span of every node
+            leaf_order = []
+            node_span = {}
+
+            def visit(node):
+                if node < 0:
+                    leaf_order.append(~node)
+                    return len(leaf_order) - 1, len(leaf_order)
+                first, _ = visit(left_child[node])
+                left_end = len(leaf_order)
+                visit(right_child[node])
+                node_span[node] = (first, left_end)
+                return first, len(leaf_order)
+
+            visit(0)
+            self.leaf_values[t, :len(leaf_order)] = leaf_value[leaf_order]
+
+            for node, (first, left_end) in node_span.items():
+                mask = all_leaves[t].copy()
+                for pos in range(first, left_end):
+                    mask[pos // 64] &= ~np.uint64(1 << (pos % 64))
+                splits.append((split_feature[node], threshold[node], t, mask))
+
+        # masks of every feature interval: interval k holds the values above the k lowest
+        # distinct thresholds of the feature
+        self.thresholds = []
+        self.interval_offset = np.zeros(self.num_features, dtype=np.int64)
+        interval_masks = []
+
+        for f in range(self.num_features):
+            feature_splits = [split for split in splits if split[0] == f]
+            thresholds = np.unique([split[1] for split in feature_splits])
+            self.thresholds.append(thresholds)
+            self.interval_offset[f] = len(interval_masks)
+
+            masks = all_leaves.copy()
+            interval_masks.append(masks.copy())
+            for thr in thresholds:
+                for _, split_thr, t, mask in feature_splits:
+                    if split_thr == thr:
+                        masks[t] &= mask
+                interval_masks.append(masks.copy())
+
+        self.interval_masks = np.stack(interval_masks)
+        # flat index of the first leaf of every tree, minus the float64 exponent bias
+        self.leaf_base = np.arange(num_trees) * self.leaf_values.shape[1] - 1023
+
+        # interval of every integer value within feature_infos ([min:max])
+        self.value_low = np.zeros(self.num_features, dtype=np.float64)
+        self.value_high = np.full(self.num_features, -1, dtype=np.float64)
+        self.value_offset = np.zeros(self.num_features, dtype=np.int64)
+        value_intervals = []
+
+        for f, info in enumerate(feature_infos):
+            if not (info.startswith('[') and ':' in info):
+                continue
+            low, high = (int(float(x)) for x in info[1:-1].split(':'))
+            self.value_low[f] = low
+            self.value_high[f] = high
+            self.value_offset[f] = len(value_intervals) - low
+
+            values = np.arange(low, high + 1, dtype=np.float64)
+            value_intervals.extend(self.interval_offset[f] + np.searchsorted(self.thresholds[f], values))
+
+        self.value_intervals = np.array(value_intervals, dtype=np.int64)
+
+    def feature_name(self) -> list:
+        return list(self.feature_names)
+
+    def num_trees(self) -> int:
+        return self.leaf_values.shape[0]
+
+    def get_intervals(self, X : np.ndarray) -> np.ndarray:
+        """Global interval index of every feature value
+
+        Args:
+            X (np.ndarray): float64 matrix of shape (n, num_features)
+
+        Returns:
+            np.ndarray: int64 matrix of shape (n, num_features)
+        """
+        # fmax/fmin also map NaN and inf into the domain, so the cast below is always valid
+        X_int = np.fmin(np.fmax(X, self.value_low), self.value_high).astype(np.int64)
+        if (X_int == X).all():
+            return self.value_intervals[X_int + self.value_offset]
+
+        # LightGBM replaces NaN by 0 for splits without missing value handling
+        X = np.nan_to_num(X, nan=0.0)
+        intervals = np.empty(X.shape, dtype=np.int64)
+        for f in range(self.num_features):
+            intervals[:, f] = self.interval_offset[f] + np.searchsorted(self.thresholds[f], X[:, f])
+        return intervals
+
+    def predict_raw(self, X : np.ndarray) -> np.ndarray:
+        """Sum of the leaf values of all trees, in tree order
+
+        Args:
+            X (np.ndarray): float64 matrix of shape (n, num_features)
+
+        Returns:
+            np.ndarray: Raw scores of shape (n,)
+        """
+        intervals = self.get_intervals(X)
+
+        if X.shape[0] <= 64:
+            masks = np.bitwise_and.reduce(self.interval_masks[intervals], axis=1)
+        else:
+            # one feature at a time, to avoid materializing (n, num_features, num_trees) masks
+            masks = self.interval_masks.take(intervals[:, 0], axis=0)
+            for f in range(1, self.num_features):
+                np.bitwise_and(masks, self.interval_masks.take(intervals[:, f], axis=0), out=masks)
+
+        if self.num_words == 1:
+            word_idx = 0
+            word = masks[:, :, 0]
+        else:
+            word_idx = np.argmax(masks != 0, axis=2)
+            word = np.take_along_axis(masks, word_idx[:, :, None], axis=2)[:, :, 0]
+
+        # the lowest set bit is a power of two, its float64 exponent is the bit position
+        lowest_bit = (word & np.negative(word)).astype(np.float64)
+        leaf_idx = (lowest_bit.view(np.int64) >> 52) + (self.leaf_base + 64 * word_idx)
+
+        values = self.leaf_values.take(leaf_idx)
+
+        # sequential sum over the trees, like LightGBM
+        return np.cumsum(values, axis=1)[:, -1]
+
+    def predict(self, data, raw_score=False) -> np.ndarray:
+        """Same output as lgb.Booster.predict for a binary model
+
+        Args:
+            data (np.ndarray/pd.DataFrame): Features, in the order of feature_name()
+            raw_score (bool, optional): Returns the raw scores instead of probabilities. Defaults to False.
+
+        Returns:
+            np.ndarray: Predictions of shape (n,)
+        """
+        X = np.asarray(data, dtype=np.float64)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if X.shape[1] != self.num_features:
+            raise ValueError(f'Expected {self.num_features} features, got {X.shape[1]}')
+
+        score = self.predict_raw(X)
+        if raw_score:
+            return score
+
+        return 1.0 / (1.0 + np.exp(-self.sigmoid * score))
@@ -0,0 +1,277 @@
+"""
+In-process benchmarks of the serving hot paths, with the real dependencies/ artifacts.
+
+Every stage is timed on its own and its median latency is divided by the median of a
+fixed calibration workload timed right before it, so that the stored costs can be
+compared between machines (i.e. a laptop and the GitHub runner). A stage fails when the
+lowest cost of a few rounds exceeds its baseline by more than the threshold of
+benchmark_baseline.json (BENCHMARK_THRESHOLD overrides it). The baseline is the median
+cost of the rounds that recorded it, so that a lucky round does not become the reference.
+
+The cold start (import of app.py, load of the artifacts and first prediction) is timed
+in a new interpreter, once per round.
+
+Use: python -m pytest ../tests/test_benchmarks.py -v
+     BENCHMARK_UPDATE=1 python -m pytest ../tests/test_benchmarks.py -v   (rewrites the baselines)
+"""
+
+from standard_payload import StandardPayload
+from model_predict import Model
+from utils import load_json
+
+from flask import jsonify
+import numpy as np
+import pandas as pd
+import subprocess
+import time
+import sys
+import json
+import os
+
+REF_JSON = 'dependencies/standard_payload.json'
+TRANSFORMER_FILE = 'dependencies/data_transformer.pkl'
+MODEL_FILE = 'dependencies/model.txt'
+MODEL_BUNDLE = 'dependencies/model_bundle.npz'
+
+TEST_DATA_DIR = '../tests/test_files'
+PAYLOAD_VALID = 'payload_valid.json'
+PAYLOAD_LIST = '../../sample_payload/payload_list.json'
+BASELINE_FILE = '../tests/benchmark_baseline.json'
+
+BATCH_SIZE = 100
+MIN_TIME = 0.1
+MIN_CALLS = 20
+ROUNDS = 5
+
+
+def get_test_client():
+    os.environ.setdefault('REF_JSON', REF_JSON)
+    os.environ.setdefault('TRANSFORMER_FILE', TRANSFORMER_FILE)
+    os.environ.setdefault('MODEL_FILE', MODEL_FILE)
+    os.environ.setdefault('CACHE_TYPE', 'NullCache')
+    os.environ.setdefault('CACHE_REDIS_HOST', '')
+    os.environ.setdefault('CACHE_REDIS_PORT', '')
+    os.environ.setdefault('CACHE_REDIS_DB', '')
+    os.environ.setdefault('CACHE_REDIS_URL', '')
+    os.environ.setdefault('CACHE_DEFAULT_TIMEOUT', '0')
+
+    import app
+    return app
+
+
+def calibration_workload():
+    # a fixed mix of the dict, string and small NumPy operations the hot paths are made of
+    table = {f'key{i}' : i for i in range(200)}
+    total = sum(table[f'key{i}'] for i in range(0, 200, 3))
+    values = np.arange(256, dtype=np.float64)
+    return total + float(np.cumsum(values * 0.5)[-1])
+
+
+def median_time(fn, setup=None) -> float:
+    """Median seconds of a call of fn, over at least MIN_CALLS calls and MIN_TIME seconds
+
+    Args:
+        fn (callable): Function without arguments to be timed
+        setup (callable, optional): Untimed function called before every call of fn
+    """
+    fn()
+    timings = []
+    start = time.perf_counter()
+
+    while len(timings) < MIN_CALLS or time.perf_counter() - start < MIN_TIME:
+        if setup is not None:
+            setup()
+        call_start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - call_start)
+
+    return float(np.median(timings))
+
+
+def summarize(rounds : list) -> tuple:
+    """
+    Args:
+        rounds (list): (cost, seconds) of every round
+
+    Returns:
+        tuple: (lowest cost, seconds of that round, median cost)
+    """
+    cost, seconds = min(rounds)
+    return cost, seconds, float(np.median([cost for cost, _ in rounds]))
+
+
+def normalized_cost(fn, setup=None) -> tuple:
+    """
+    Returns:
+        tuple: (lowest cost over ROUNDS rounds, median seconds of that round, median cost)
+    """
+    rounds = []
+    for _ in range(ROUNDS):
+        calibration = median_time(calibration_workload)
+        seconds = median_time(fn, setup)
+        rounds.append((seconds / calibration, seconds))
+    return summarize(rounds)
+
+
+def load_baseline() -> dict:
+    if not os.path.exists(BASELINE_FILE):
+        return {'threshold' : 0.3, 'benchmarks' : {}}
+    return load_json(BASELINE_FILE)
+
+
+def check_cost(name : str, cost : float, seconds : float, median_cost : float) -> bool:
+    """Compares a normalized cost with the baseline
+
+    Args:
+        name (str): Name of the stage in the baseline file
+        cost (float): Lowest normalized cost of the stage
+        seconds (float): Seconds of the stage, only printed
+        median_cost (float): Median normalized cost of the stage, recorded by BENCHMARK_UPDATE=1
+
+    Returns:
+        bool: False if the stage regressed beyond the threshold
+    """
+    baseline = load_baseline()
+    threshold = float(os.environ.get('BENCHMARK_THRESHOLD', baseline['threshold']))
+    expected = baseline['benchmarks'].get(name)
+
+    if os.environ.get('BENCHMARK_UPDATE') == '1':
+        baseline['benchmarks'][name] = round(median_cost, 4)
+        with open(BASELINE_FILE, 'w') as f:
+            json.dump(baseline, f, indent=4, sort_keys=True)
+        expected = median_cost
+
+    print(f'{name}: {seconds * 1e6:.1f} us, cost {cost:.4f}, baseline {expected}')
+
+    return expected is None or cost <= expected * (1 + threshold)
+
+
+def check_benchmark(name : str, fn, setup=None) -> bool:
+    """Times a stage and compares its normalized cost with the baseline
+
+    Args:
+        name (str): Name of the stage in the baseline file
+        fn (callable): Stage without arguments
+        setup (callable, optional): Untimed function called before every call of fn
+
+    Returns:
+        bool: False if the stage regressed beyond the threshold
+    """
+    return check_cost(name, *normalized_cost(fn, setup))
+
+
+def cold_start_seconds(env : dict) -> float:
+    """Seconds from the import of app.py to the end of the first prediction, in a new
+       interpreter (its own start up is not counted)
+    """
+    code = ("import time; start = time.perf_counter(); import app; "
+            f"app.app.test_client().post('/predict_income', json={get_payloads()[0]!r}); "
+            "print(time.perf_counter() - start)")
+    result = subprocess.run([sys.executable, '-c', code], env=dict(os.environ, **env),
+                            check=True, capture_output=True, text=True)
+    return float(result.stdout)
+
+
+def get_payloads():
+    payload = load_json(os.path.join(TEST_DATA_DIR, PAYLOAD_VALID))
+    payload_list = load_json(PAYLOAD_LIST)[:BATCH_SIZE]
+    return payload, payload_list
+
+
+def test_benchmark_validate_data():
+
+    std_payload = StandardPayload(ref_json=REF_JSON)
+    payload, payload_list = get_payloads()
+
+    val1 = check_benchmark('validate_data', lambda: std_payload.validate_data(payload))
+    val2 = check_benchmark('validate_data_batch',
+                           lambda: [std_payload.validate_data(p) for p in payload_list])
+
+    assert val1 and val2, 'test_benchmark_validate_data fails'
+
+
+def test_benchmark_transform_features():
+
+    model = Model(model_file=MODEL_FILE,
+                 transformer_file=TRANSFORMER_FILE)
+    std_payload = StandardPayload(ref_json=REF_JSON)
+    payload, payload_list = get_payloads()
+
+    df_single = pd.DataFrame([std_payload.validate_data(payload)['data']])
+    df_batch = pd.DataFrame([std_payload.validate_data(p)['data'] for p in payload_list])
+
+    val1 = check_benchmark('transform_features', lambda: model.transformer.transform_features(df_single))
+    val2 = check_benchmark('transform_features_batch', lambda: model.transformer.transform_features(df_batch))
+
+    assert val1 and val2, 'test_benchmark_transform_features fails'
+
+
+def test_benchmark_model_predict():
+
+    model = Model(model_file=MODEL_FILE,
+                 transformer_file=TRANSFORMER_FILE)
+    std_payload = StandardPayload(ref_json=REF_JSON)
+    payload, payload_list = get_payloads()
+
+    validated = std_payload.validate_data(payload)['data']
+    validated_list = [std_payload.validate_data(p)['data'] for p in payload_list]
+
+    val1 = check_benchmark('model_predict', lambda: model.predict(validated))
+    val2 = check_benchmark('model_predict_batch', lambda: model.predict_batch(validated_list))
+
+    assert val1 and val2, 'test_benchmark_model_predict fails'
+
+
+def test_benchmark_json_response():
+
+    app = get_test_client().app
+    payload, payload_list = get_payloads()
+
+    with app.test_client() as client:
+        prediction = client.post('/predict_income', json=payload).get_json()
+        predictions = client.post('/predict_income/batch', json=payload_list).get_json()
+
+    with app.app_context():
+        val1 = check_benchmark('json_response', lambda: jsonify(prediction))
+        val2 = check_benchmark('json_response_batch', lambda: jsonify(predictions))
+
+    assert val1 and val2, 'test_benchmark_json_response fails'
+
+
+def test_benchmark_flask_round_trip():
+
+    app_module = get_test_client()
+    client = app_module.app.test_client()
+    payload, payload_list = get_payloads()
+
+    def clear_cache():
+        app_module.prediction_cache.local.entries.clear()
+
+    val1 = check_benchmark('flask_predict_income',
+                           lambda: client.post('/predict_income', json=payload), setup=clear_cache)
+    val2 = check_benchmark('flask_predict_income_cached',
+                           lambda: client.post('/predict_income', json=payload))
+    val3 = check_benchmark('flask_predict_income_batch',
+                           lambda: client.post('/predict_income/batch', json=payload_list))
+
+    assert val1 and val2 and val3, 'test_benchmark_flask_round_trip fails'
+
+
+def test_benchmark_cold_start():
+
+    get_test_client()
+    configs = {
+        'cold_start' : {'MODEL_BUNDLE' : '', 'MODEL_ENGINE' : 'lightgbm'},
+        'cold_start_bundle' : {'MODEL_BUNDLE' : MODEL_BUNDLE, 'MODEL_ENGINE' : 'numpy'}
+    }
+
+    results = []
+    for name, env in configs.items():
+        rounds = []
+        for _ in range(ROUNDS):
+            calibration = median_time(calibration_workload)
+            seconds = cold_start_seconds(env)
+            rounds.append((seconds / calibration, seconds))
+        results.append(check_cost(name, *summarize(rounds)))
+
+    assert all(results), 'test_benchmark_cold_start fails'
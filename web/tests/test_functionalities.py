@@ -4,13 +4,37 @@ Use: python -m pytest ../tests/test_functionalities.py -v
 
 from standard_payload import StandardPayload
 from model_predict import Model
-from utils import load_json
+from tree_ensemble import TreeEnsemble
+from score_table import ScoreTable, file_digest
+from model_bundle import ModelBundle
+from model_registry import ModelRegistry, publish, read_active, write_active
+from prediction_cache import PredictionCache
+from microbatch import MicroBatcher
+from shadow import ShadowScorer
+from bulk_score import score_file
+from profiler import profiling_blueprint
+from utils import load_json, load_pickle
+from preprocess import DataTransformer
 
+from flask import Flask, request
+import lightgbm as lgb
+import pstats
+import shutil
+import numpy as np
+import pandas as pd
+import subprocess
+import threading
+import asyncio
+import sys
+import time
+import json
+import copy
 import os
 
 REF_JSON = 'dependencies/standard_payload.json'
 TRANSFORMER_FILE = 'dependencies/data_transformer.pkl'
 MODEL_FILE = 'dependencies/model.txt'
+MODEL_BUNDLE = 'dependencies/model_bundle.npz'
 
 
 TEST_DATA_DIR = '../tests/test_files'
@@ -20,6 +44,23 @@ PAYLOAD_INVALID_CATEGORY = 'payload_invalid_category.json'
 PAYLOAD_INVALID_DTYPE = 'payload_invalid_dtype.json'
 PAYLOAD_MISSING = 'payload_missing.json'
 PAYLOAD_NEGATIVE = 'payload_negative.json'
+PAYLOAD_LIST = '../../sample_payload/payload_list.json'
+ADULT_CSV = '../../training/adult.csv'
+
+
+def get_test_client():
+    os.environ.setdefault('REF_JSON', REF_JSON)
+    os.environ.setdefault('TRANSFORMER_FILE', TRANSFORMER_FILE)
+    os.environ.setdefault('MODEL_FILE', MODEL_FILE)
+    os.environ.setdefault('CACHE_TYPE', 'NullCache')
+    os.environ.setdefault('CACHE_REDIS_HOST', '')
+    os.environ.setdefault('CACHE_REDIS_PORT', '')
+    os.environ.setdefault('CACHE_REDIS_DB', '')
+    os.environ.setdefault('CACHE_REDIS_URL', '')
+    os.environ.setdefault('CACHE_DEFAULT_TIMEOUT', '0')
+
+    from app import app
+    return app.test_client()
 
 
 def test_valid_payload():
@@ -91,6 +132,30 @@ def test_negative():
     assert validated['error_msg']['error_type'] == 'fields_with_negative', 'test_negative fail'
 
 
+def test_validate_data_matches_staged():
+
+    std_payload = StandardPayload(ref_json=REF_JSON)
+    valid = load_json(os.path.join(TEST_DATA_DIR, PAYLOAD_VALID))
+
+    payloads = [load_json(os.path.join(TEST_DATA_DIR, name)) for name in sorted(os.listdir(TEST_DATA_DIR))]
+    payloads += load_json(PAYLOAD_LIST)
+    payloads += [None, [], 'payload', 1, {}, {'ocean' : 'pacific'}]
+    payloads += [dict(valid, **{field : value}) 
+                 for field in valid 
+                 for value in [None, True, 1.0, -1, '', 'Unknown', ['private'], {'a' : 1}]]
+    payloads += [{k : v for k, v in valid.items() if k != field} for field in valid]
+    payloads += [dict(valid, age=-1, fnlwgt=-2, race='martian', sex='?', education=3)]
+    payloads += [dict(valid, age=-1, fnlwgt=-2, race='martian', Education='X')]
+
+    results = []
+    for payload in payloads:
+        raw = copy.deepcopy(payload)
+        validated = std_payload.validate_data(payload)
+        results.append(validated == std_payload.validate_data_staged(copy.deepcopy(raw)) and payload == raw)
+
+    assert all(results), 'test_validate_data_matches_staged fails'
+
+
 def test_model_predict():
 
     model = Model(model_file=MODEL_FILE, 
@@ -110,12 +175,934 @@ def test_model_predict():
 
     assert val1 and val2 and val3, 'test_model_predict fails'
 
-    
 
+def test_model_predict_batch():
+
+    model = Model(model_file=MODEL_FILE, 
+                 transformer_file=TRANSFORMER_FILE)
+
+    std_payload = StandardPayload(ref_json=REF_JSON)
+    payload_list = [std_payload.validate_data(payload)['data'] 
+                    for payload in load_json(PAYLOAD_LIST)]
+
+    results = model.predict_batch(payload_list)
+    expected = [model.predict(payload) for payload in payload_list]
+
+    assert results == expected, 'test_model_predict_batch fails'
+
+
+def test_predict_batch_endpoint():
+
+    client = get_test_client()
+
+    payload_valid = load_json(os.path.join(TEST_DATA_DIR, PAYLOAD_VALID))
+    payload_missing = load_json(os.path.join(TEST_DATA_DIR, PAYLOAD_MISSING))
+
+    response = client.post('/predict_income/batch', 
+                           json=[payload_valid, payload_missing, payload_valid])
+    predictions = response.get_json()['predictions']
+
+    val1 = len(predictions) == 3
+    val2 = predictions[0]['status'] == 'success' and predictions[2]['status'] == 'success'
+    val3 = predictions[1]['error_type'] == 'missing_fields'
+
+    assert val1 and val2 and val3, 'test_predict_batch_endpoint fails'
+
+
+def test_ordinal_transform_matches_get_range():
+
+    transformer = load_pickle(TRANSFORMER_FILE)
+    ord_transformer = transformer.ord_transformer
+
+    df = pd.read_csv(ADULT_CSV)
+    edge_cases = pd.DataFrame({col : [-1, 0, 5, 9.999, 10, 10.0001, 99.5, 100, 1e4, 1e5, 1e6, 1e9, np.nan]
+                               for col, _ in ord_transformer.transformers})
+    df = pd.concat([df, edge_cases], ignore_index=True)
+
+    df_transform = ord_transformer.transform(df)
+
+    for col, get_col_range in ord_transformer.transformers:
+        expected = df[col].apply(get_col_range)
+        assert (df_transform[col].to_numpy() == expected.to_numpy()).all(), f'{col} binning differs'
+
+
+def read_adult_csv():
+    df = pd.read_csv(ADULT_CSV)
+    return df.applymap(lambda s:s.lower() if type(s) == str else s)
+
+
+def test_transformer_extend():
+
+    transformer = load_pickle(TRANSFORMER_FILE)
+    df = read_adult_csv()[:1000]
+    before = transformer.transform(df)
+    classes = {col : list(encoder.classes_) for col, encoder in transformer.cat_transformer.transformers}
+
+    df_new = df[:3].reset_index(drop=True)
+    df_new['native.country'] = ['atlantis', 'utopia', 'atlantis']
+    df_new['income'] = ['unknown', '<=50k', '>50k']
+    added = transformer.extend(df_new)
+
+    val1 = added == {'native.country' : ['atlantis', 'utopia']}
+    # the known values keep their codes
+    val2 = transformer.transform(df).equals(before)
+    # the new values get the next codes
+    num_classes = len(classes['native.country'])
+    val3 = transformer.transform_features(df_new)['native.country'].tolist() == [num_classes, num_classes + 1, num_classes]
+    # the label is not extended
+    val4 = all(list(encoder.classes_) == classes[col] for col, encoder in transformer.cat_transformer.transformers
+               if col != 'native.country')
+
+    assert val1 and val2 and val3 and val4, 'test_transformer_extend fails'
+
+
+def test_transformer_fit_uniques():
+
+    df = read_adult_csv()
+    # missing values sort after the strings in fit
+    df.loc[::1000, 'workclass'] = np.nan
+    fitted = DataTransformer()
+    fitted.fit(df)
+
+    # gathered chunk by chunk, like training/streaming.py
+    uniques = {col : set() for col, _ in fitted.cat_transformer.transformers}
+    for start in range(0, len(df), 5000):
+        for col in uniques:
+            uniques[col].update(df[col][start:start + 5000].unique())
+    from_uniques = DataTransformer()
+    from_uniques.fit_uniques(uniques)
+
+    val1 = all(pd.Index(encoder.classes_).equals(pd.Index(other.classes_)) for (_, encoder), (_, other)
+               in zip(fitted.cat_transformer.transformers, from_uniques.cat_transformer.transformers))
+    val2 = from_uniques.transform(df).equals(fitted.transform(df))
+
+    assert val1 and val2, 'test_transformer_fit_uniques fails'
+
+
+def test_feature_encoder_matches_transformer():
+
+    model = Model(model_file=MODEL_FILE, 
+                 transformer_file=TRANSFORMER_FILE)
+
+    std_payload = StandardPayload(ref_json=REF_JSON)
+    payload_list = [std_payload.validate_data(payload)['data'] 
+                    for payload in load_json(PAYLOAD_LIST)]
+
+    expected = model.transform_pandas(payload_list)
+
+    val1 = model.encoder.feature_names == list(expected.columns)
+    val2 = (model.encoder.encode_batch(payload_list) == expected.to_numpy()).all()
+    val3 = all((model.encoder.encode(payload)[0] == row).all()
+               for payload, row in zip(payload_list, expected.to_numpy()))
+
+    assert val1 and val2 and val3, 'test_feature_encoder_matches_transformer fails'
+
+
+def test_feature_encoder_unseen_label():
+
+    model = Model(model_file=MODEL_FILE, 
+                 transformer_file=TRANSFORMER_FILE)
+
+    payload = load_json(os.path.join(TEST_DATA_DIR, PAYLOAD_INVALID_CATEGORY))
+
+    try:
+        model.encoder.encode(payload)
+        raised = False
+    except ValueError:
+        raised = True
+
+    assert raised, 'test_feature_encoder_unseen_label fails'
+
+
+def test_model_fast_path_matches_pandas():
+
+    model = Model(model_file=MODEL_FILE, 
+                 transformer_file=TRANSFORMER_FILE)
+    model_pandas = Model(model_file=MODEL_FILE, 
+                         transformer_file=TRANSFORMER_FILE,
+                         fast_path=False)
+
+    std_payload = StandardPayload(ref_json=REF_JSON)
+    payload_list = [std_payload.validate_data(payload)['data'] 
+                    for payload in load_json(PAYLOAD_LIST)]
+
+    val1 = all(model.predict(payload) == model_pandas.predict(payload) for payload in payload_list)
+    val2 = model.predict_batch(payload_list) == model_pandas.predict_batch(payload_list)
+
+    assert val1 and val2, 'test_model_fast_path_matches_pandas fails'
+
+
+def test_tree_ensemble_matches_booster():
+
+    booster = lgb.Booster(model_file=MODEL_FILE)
+    ensemble = TreeEnsemble(MODEL_FILE)
+
+    rng = np.random.default_rng(0)
+    low = np.array([0] * 8 + [1] * 5)
+    high = np.array([15, 8, 6, 14, 5, 4, 1, 41, 9, 9, 9, 9, 9])
+
+    X_binned = rng.integers(low, high + 1, size=(2000, 13)).astype(np.float64)
+    X_real = rng.uniform(-5, 50, size=(2000, 13))
+    X_real[::7, 3] = np.nan
+
+    val1 = ensemble.feature_name() == booster.feature_name()
+    val2 = all(np.abs(ensemble.predict(X) - booster.predict(X)).max() < 1e-12
+               for X in [X_binned, X_binned[:10], X_real, X_real[:10]])
+
+    assert val1 and val2, 'test_tree_ensemble_matches_booster fails'
+
+
+def test_model_numpy_engine():
+
+    model = Model(model_file=MODEL_FILE, 
+                 transformer_file=TRANSFORMER_FILE)
+    model_numpy = Model(model_file=MODEL_FILE, 
+                        transformer_file=TRANSFORMER_FILE,
+                        engine='numpy')
+
+    std_payload = StandardPayload(ref_json=REF_JSON)
+    payload_list = [std_payload.validate_data(payload)['data'] 
+                    for payload in load_json(PAYLOAD_LIST)]
+
+    results = model.predict_batch(payload_list)
+    results_numpy = model_numpy.predict_batch(payload_list)
+
+    val1 = all(r['predicted_income_class'] == r_np['predicted_income_class']
+               for r, r_np in zip(results, results_numpy))
+    val2 = all(abs(r['prediction_raw'] - r_np['prediction_raw']) < 1e-12
+               for r, r_np in zip(results, results_numpy))
+
+    assert val1 and val2, 'test_model_numpy_engine fails'
+
+
+def test_score_table_matches_booster(tmp_path):
+
+    booster = lgb.Booster(model_file=MODEL_FILE)
+    table = ScoreTable.from_ensemble(TreeEnsemble(MODEL_FILE), file_digest(MODEL_FILE))
+    table.save(str(tmp_path))
+    table = ScoreTable.load(str(tmp_path), MODEL_FILE)
+
+    rng = np.random.default_rng(1)
+    low = np.array([0] * 8 + [1] * 5)
+    high = np.array([15, 8, 6, 14, 5, 4, 1, 41, 9, 9, 9, 9, 9])
+
+    X_binned = rng.integers(low, high + 1, size=(2000, 13)).astype(np.float64)
+    X_real = rng.uniform(-5, 50, size=(2000, 13))
+
+    val1 = all(np.abs(table.predict(X) - booster.predict(X)).max() < 1e-12
+               for X in [X_binned, X_binned[:10], X_real, X_real[:10]])
+    val2 = isinstance(table.table, np.memmap)
+
+    assert val1 and val2, 'test_score_table_matches_booster fails'
+
+
+def test_model_bundle(tmp_path):
+
+    bundle_file = str(tmp_path / 'model_bundle.npz')
+    ModelBundle.from_artifacts(MODEL_FILE, TRANSFORMER_FILE).save(bundle_file)
+
+    std_payload = StandardPayload(ref_json=REF_JSON)
+    payload_list = [std_payload.validate_data(payload)['data'] 
+                    for payload in load_json(PAYLOAD_LIST)]
+
+    val1 = True
+    for engine in ['lightgbm', 'numpy', 'table']:
+        model = Model(model_file=MODEL_FILE, transformer_file=TRANSFORMER_FILE, engine=engine)
+        model_bundle = Model(bundle_file=bundle_file, engine=engine)
+        val1 = val1 and model_bundle.predict_batch(payload_list) == model.predict_batch(payload_list)
+
+    # the shipped bundle is the bundle of the shipped model.txt and data_transformer.pkl
+    with np.load(bundle_file) as arrays, np.load(MODEL_BUNDLE) as shipped:
+        val2 = arrays.files == shipped.files and all(np.array_equal(arrays[name], shipped[name]) 
+                                                     for name in arrays.files)
+
+    assert val1 and val2, 'test_model_bundle fails'
+
+
+def test_model_bundle_checks_model_file(tmp_path):
+
+    # a retrained model.txt deployed without rebuilding its bundle
+    model_file = str(tmp_path / 'model.txt')
+    with open(MODEL_FILE, 'r') as src, open(model_file, 'w') as dst:
+        dst.write(src.read().replace('version=v3', 'version=v3\n', 1))
+
+    model = Model(model_file=MODEL_FILE, bundle_file=MODEL_BUNDLE)
+    val1 = model.version == Model(bundle_file=MODEL_BUNDLE).version
+
+    try:
+        Model(model_file=model_file, bundle_file=MODEL_BUNDLE)
+        val2 = False
+    except ValueError:
+        val2 = True
+
+    assert val1 and val2, 'test_model_bundle_checks_model_file fails'
+
+
+def test_training_copies_match():
+
+    # modules imported by both training/ and web/project/, which each import their own copy
+    val1 = True
+    for name in ['preprocess.py', 'binning.py', 'feature_encoder.py', 'model_bundle.py']:
+        with open(name, 'rb') as web, open(os.path.join('../../training', name), 'rb') as training:
+            val1 = val1 and web.read() == training.read()
+
+    assert val1, 'test_training_copies_match fails'
+
+
+def test_model_bundle_imports():
+
+    env = dict(os.environ, REF_JSON=REF_JSON, MODEL_BUNDLE=MODEL_BUNDLE, MODEL_ENGINE='numpy', 
+               TRANSFORMER_FILE='', MODEL_FILE='', CACHE_TYPE='NullCache', CACHE_REDIS_HOST='', 
+               CACHE_REDIS_PORT='', CACHE_REDIS_DB='', CACHE_REDIS_URL='', CACHE_DEFAULT_TIMEOUT='0')
+    code = ("import sys, app; "
+            "print(sorted(name for name in ['sklearn', 'pandas', 'lightgbm', 'scipy'] if name in sys.modules))")
+    imported = subprocess.run([sys.executable, '-c', code], env=env, check=True,
+                              capture_output=True, text=True).stdout.strip()
+
+    assert imported == '[]', 'test_model_bundle_imports fails'
+
+
+class FakeRemoteCache:
+
+    def __init__(self, down=False):
+        self.entries = {}
+        self.down = down
+        self.calls = 0
+
+    def get(self, key):
+        self.calls += 1
+        if self.down:
+            raise ConnectionError('redis is down')
+        return self.entries.get(key)
+
+    def set(self, key, value, timeout=None):
+        self.calls += 1
+        if self.down:
+            raise ConnectionError('redis is down')
+        self.entries[key] = value
+
+
+def test_prediction_cache_keys_never_collide():
+
+    model = Model(model_file=MODEL_FILE, 
+                 transformer_file=TRANSFORMER_FILE)
+    prediction_cache = PredictionCache(model.version)
+
+    df = pd.read_csv(ADULT_CSV)
+    df = df.applymap(lambda s:s.lower() if type(s) == str else s)
+    features = model.encode_batch(df.to_dict('records'))
+
+    num_rows = len(np.unique(features, axis=0))
+    num_keys = len(set(prediction_cache.key(row) for row in features))
+
+    assert num_rows == num_keys, 'test_prediction_cache_keys_never_collide fails'
+
+
+def test_prediction_cache_normalized_key():
+
+    model = Model(model_file=MODEL_FILE, 
+                 transformer_file=TRANSFORMER_FILE)
+    prediction_cache = PredictionCache(model.version)
+    std_payload = StandardPayload(ref_json=REF_JSON)
+
+    payload = load_json(os.path.join(TEST_DATA_DIR, PAYLOAD_VALID))
+    variant = dict(payload, education=payload['education'].upper(), ocean='pacific', age=payload['age'] + 1)
+    other = dict(payload, education='doctorate')
+
+    def key_of(raw_payload, cache=prediction_cache):
+        validated = std_payload.validate_data(dict(raw_payload))
+        return cache.key(model.encode(validated['data']))
+
+    val1 = key_of(payload) == key_of(variant)
+    val2 = key_of(payload) != key_of(other)
+    val3 = key_of(payload) != key_of(payload, PredictionCache('another-version'))
+
+    assert val1 and val2 and val3, 'test_prediction_cache_normalized_key fails'
+
+
+def test_prediction_cache_remote_tier():
+
+    remote = FakeRemoteCache()
+    worker_1 = PredictionCache('v1', local_size=2, remote=remote)
+    worker_2 = PredictionCache('v1', local_size=2, remote=remote)
+
+    worker_1.set('a', {'prediction_raw' : 0.1})
+    worker_1.set('b', {'prediction_raw' : 0.2})
+    worker_1.set('c', {'prediction_raw' : 0.3})
+
+    val1 = worker_1.get('a') == {'prediction_raw' : 0.1} and worker_1.hits_remote == 1
+    val2 = worker_2.get('b') == {'prediction_raw' : 0.2} and worker_2.hits_remote == 1
+    val3 = worker_2.get('b') == {'prediction_raw' : 0.2} and worker_2.hits_local == 1
+    val4 = worker_2.get('d') is None and worker_2.misses == 1
+
+    assert val1 and val2 and val3 and val4, 'test_prediction_cache_remote_tier fails'
+
+
+def test_prediction_cache_coalescing():
+
+    prediction_cache = PredictionCache('v1')
+    started = threading.Event()
+    release = threading.Event()
+    computed = []
 
+    def compute():
+        computed.append(1)
+        started.set()
+        release.wait(5)
+        return {'prediction_raw' : 0.5}
 
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(prediction_cache.get_or_compute('a', compute)))
+               for _ in range(8)]
+    threads[0].start()
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    while prediction_cache.coalesced < 7:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
 
+    val1 = len(computed) == 1 and prediction_cache.coalesced == 7
+    val2 = results == [{'prediction_raw' : 0.5}] * 8
+
+    assert val1 and val2, 'test_prediction_cache_coalescing fails'
+
+
+def test_prediction_cache_remote_down():
+
+    remote = FakeRemoteCache(down=True)
+    prediction_cache = PredictionCache('v1', remote=remote, remote_backoff=60)
+
+    val1 = prediction_cache.get_or_compute('a', lambda: {'prediction_raw' : 0.1}) == {'prediction_raw' : 0.1}
+    val2 = prediction_cache.get_or_compute('b', lambda: {'prediction_raw' : 0.2}) == {'prediction_raw' : 0.2}
+    val3 = prediction_cache.get_or_compute('a', lambda: None) == {'prediction_raw' : 0.1}
+    # the first failure opens the circuit, the remote is not called again during the backoff
+    val4 = remote.calls == 1 and prediction_cache.remote_errors == 1
+
+    assert val1 and val2 and val3 and val4, 'test_prediction_cache_remote_down fails'
+
+
+def test_prediction_cache_local_ttl():
+
+    prediction_cache = PredictionCache('v1', local_ttl=0.01)
+    prediction_cache.set('a', {'prediction_raw' : 0.1})
+
+    val1 = prediction_cache.get('a') == {'prediction_raw' : 0.1}
+    time.sleep(0.02)
+    val2 = prediction_cache.get('a') is None
+
+    assert val1 and val2, 'test_prediction_cache_local_ttl fails'
+
+
+def test_predict_income_cached():
+
+    client = get_test_client()
+    payload = load_json(os.path.join(TEST_DATA_DIR, PAYLOAD_VALID))
+
+    stats_before = client.get('/cache_stats').get_json()
+    first = client.post('/predict_income', json=payload)
+    second = client.post('/predict_income', json=dict(payload, ocean='atlantic'))
+    stats_after = client.get('/cache_stats').get_json()
+
+    val1 = first.get_json() == second.get_json()
+    val2 = stats_after['hits_local'] >= stats_before['hits_local'] + 1
+    val3 = second.headers['X-Prediction-Cache'] == 'hit'
+
+    assert val1 and val2 and val3, 'test_predict_income_cached fails'
+
+
+def train_version(dst_dir, num_rounds):
+    """Trains a small model on adult.csv, encoded like the shipped one, as train.py would save it"""
+    model = Model(model_file=MODEL_FILE, 
+                 transformer_file=TRANSFORMER_FILE)
+    df = pd.read_csv(ADULT_CSV).head(2000)
+    df = df.applymap(lambda s:s.lower() if type(s) == str else s)
+
+    train_data = lgb.Dataset(model.encode_batch(df.to_dict('records')), label=(df['income'] == '>50k').astype(int),
+                             feature_name=model.feature_names)
+    booster = lgb.train({'objective' : 'binary', 'verbose' : -1}, train_data, num_rounds)
+
+    os.makedirs(dst_dir)
+    booster.save_model(os.path.join(dst_dir, 'model.txt'))
+    shutil.copy(TRANSFORMER_FILE, dst_dir)
+
+
+def test_model_registry(tmp_path):
+
+    registry_dir = str(tmp_path / 'models')
+    os.makedirs(registry_dir)
+    train_version(str(tmp_path / 'v1'), 5)
+    train_version(str(tmp_path / 'v2'), 20)
+    os.makedirs(tmp_path / 'broken')
+    (tmp_path / 'broken' / 'model.txt').write_text('not a model')
+
+    std_payload = StandardPayload(ref_json=REF_JSON)
+    payload = std_payload.validate_data(load_json(os.path.join(TEST_DATA_DIR, PAYLOAD_VALID)))['data']
+
+    publish(registry_dir, 'v1', str(tmp_path / 'v1'))
+    registry = ModelRegistry({'engine' : 'numpy'}, registry_dir=registry_dir, max_versions=2, poll_interval=60)
+    registry.load(read_active(registry_dir))
+    _, v1 = registry.get()
+    registry.record(v1.encode(payload))
+
+    publish(registry_dir, 'v2', str(tmp_path / 'v2'))
+    registry.poll()
+    name, v2 = registry.get()
+
+    val1 = name == 'v2' and registry.get('v1') == ('v1', v1)
+    val2 = v2.predict(payload) != v1.predict(payload) and v2.version != v1.version
+
+    # rolling back to a resident version is only a swap
+    write_active(registry_dir, 'v1')
+    registry.poll()
+    val3 = registry.get() == ('v1', v1)
+
+    # v2 is the least recently activated version
+    publish(registry_dir, 'v3', str(tmp_path / 'v2'))
+    registry.poll()
+    val4 = list(registry.models) == ['v1', 'v3']
+
+    # a version that fails to load is reported, the active one keeps serving
+    publish(registry_dir, 'v4', str(tmp_path / 'broken'))
+    registry.poll()
+    val5 = registry.active == 'v3' and 'v4' in registry.stats()['failed']
+
+    errors = []
+    def predict_loop():
+        try:
+            for _ in range(200):
+                registry.get()[1].predict(payload)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=predict_loop) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for i in range(100):
+        registry.activate(['v1', 'v3'][i % 2])
+    for thread in threads:
+        thread.join()
+    val6 = errors == []
+
+    assert val1 and val2 and val3 and val4 and val5 and val6, 'test_model_registry fails'
+
+
+def test_predict_income_model_version():
+
+    client = get_test_client()
+    payload = load_json(os.path.join(TEST_DATA_DIR, PAYLOAD_VALID))
+
+    active = client.post('/predict_income', json=payload)
+    named = client.post('/predict_income?model=default', json=payload)
+    unknown = client.post('/predict_income?model=v9', json=payload)
+    unknown_batch = client.post('/predict_income/batch?model=v9', json=[payload])
+    models = client.get('/models').get_json()
+
+    val1 = named.status_code == 200 and named.get_json() == active.get_json()
+    val2 = unknown.status_code == 404 and unknown.get_json()['error_type'] == 'unknown_model'
+    val3 = unknown_batch.status_code == 404
+    val4 = models['active'] == 'default' and list(models['versions']) == ['default']
+
+    assert val1 and val2 and val3 and val4, 'test_predict_income_model_version fails'
+
+
+def test_shadow_scorer(tmp_path):
+
+    train_version(str(tmp_path / 'candidate'), 5)
+    live = Model(model_file=MODEL_FILE, transformer_file=TRANSFORMER_FILE, engine='numpy')
+    candidate = Model(model_file=str(tmp_path / 'candidate' / 'model.txt'), transformer_file=TRANSFORMER_FILE,
+                      engine='numpy')
+
+    df = pd.read_csv(ADULT_CSV).head(300).drop(columns=['income'])
+    df = df.applymap(lambda s:s.lower() if type(s) == str else s)
+    payloads = df.to_dict('records')
+    live_raw = live.model.predict(live.encode_batch(payloads))
+    candidate_raw = candidate.model.predict(candidate.encode_batch(payloads))
+
+    shadow = ShadowScorer(candidate, fraction=1.0, batch_size=64, interval=60)
+    for payload, raw in zip(payloads, live_raw.tolist()):
+        shadow.offer(payload, raw)
+    shadow.offer(dict(payloads[0], workclass='unknown-workclass'), 0.5)
+    drained = shadow.drain()
+    stats = shadow.stats()
+
+    deltas = np.abs(candidate_raw - live_raw)
+    agreement = ((candidate_raw > 0.5) == (live_raw > 0.5)).mean()
+    val1 = drained == 301 and stats['scored'] == 300 and stats['errors'] == 1 and stats['dropped'] == 0
+    val2 = np.isclose(stats['agreement_rate'], agreement) and 0 < stats['agreement_rate'] < 1
+    val3 = np.isclose(stats['mean_abs_delta'], deltas.mean()) and np.isclose(stats['max_abs_delta'], deltas.max())
+
+    # scoring the live model against itself
+    same = ShadowScorer(live, fraction=1.0, interval=60)
+    for payload, raw in zip(payloads, live_raw.tolist()):
+        same.offer(payload, raw)
+    same.drain()
+    val4 = same.stats()['agreement_rate'] == 1.0 and same.stats()['max_abs_delta'] == 0.0
+
+    # the queue is bounded: while the thread is busy, the rows beyond it are dropped, not waited for
+    class BlockingEngine:
+        def __init__(self, engine):
+            self.engine = engine
+            self.release = threading.Event()
+
+        def predict(self, features):
+            self.release.wait()
+            return self.engine.predict(features)
+
+    candidate.model = BlockingEngine(candidate.model)
+    bounded = ShadowScorer(candidate, fraction=1.0, max_queue=4, interval=0.01)
+    bounded.offer(payloads[0], live_raw[0])
+    deadline = time.monotonic() + 5
+    while bounded.queue.qsize() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    offer_start = time.perf_counter()
+    for payload, raw in zip(payloads[1:11], live_raw[1:11].tolist()):
+        bounded.offer(payload, raw)
+    offer_seconds = time.perf_counter() - offer_start
+    val5 = bounded.stats()['dropped'] == 6 and bounded.stats()['queued'] == 4 and offer_seconds < 1
+
+    candidate.model.release.set()
+    while bounded.stats()['scored'] < 5 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    val6 = bounded.stats()['scored'] == 5
+
+    # sampling
+    sampled = ShadowScorer(live, fraction=0.0, interval=60)
+    sampled.offer(payloads[0], live_raw[0])
+    val7 = sampled.queue.qsize() == 0
+
+    assert val1 and val2 and val3 and val4 and val5 and val6 and val7, 'test_shadow_scorer fails'
+
+
+def test_shadow_scorer_survives_errors():
+
+    live = Model(model_file=MODEL_FILE, transformer_file=TRANSFORMER_FILE, engine='numpy')
+    df = pd.read_csv(ADULT_CSV).head(20).drop(columns=['income'])
+    payloads = df.applymap(lambda s:s.lower() if type(s) == str else s).to_dict('records')
+
+    shadow = ShadowScorer(live, fraction=1.0, interval=0.01)
+    score = shadow.score
+    calls = []
+
+    def failing_score(rows):
+        calls.append(len(rows))
+        if len(calls) == 1:
+            raise RuntimeError('metrics are down')
+        return score(rows)
+
+    def wait_rows(num_rows, timeout=5):
+        deadline = time.monotonic() + timeout
+        while shadow.stats()['scored'] + shadow.stats()['errors'] < num_rows and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    shadow.score = failing_score
+    try:
+        for payload in payloads[:10]:
+            shadow.offer(payload, 0.5)
+        wait_rows(10)
+        for payload in payloads[10:]:
+            shadow.offer(payload, 0.5)
+        wait_rows(20)
+        stats = shadow.stats()
+    finally:
+        shadow.interval = 60
+
+    # the rows offered after the failure were scored by the same thread
+    val1 = stats['errors'] == calls[0] and stats['scored'] == 20 - calls[0]
+    val2 = stats['scored'] >= 10
+
+    assert val1 and val2, 'test_shadow_scorer_survives_errors fails'
+
+
+def test_bulk_score(tmp_path):
+
+    std_payload = StandardPayload(ref_json=REF_JSON)
+    model = Model(model_file=MODEL_FILE, transformer_file=TRANSFORMER_FILE, engine='numpy')
+
+    df = pd.read_csv(ADULT_CSV).head(50).astype({'age' : object})
+    df.loc[3, 'age'] = -1
+    df.loc[5, 'age'] = 'forty'
+    df.loc[8, 'education'] = 'phd'
+    df.loc[13, 'sex'] = None
+    df.loc[21, 'occupation'] = None
+    df.to_csv(tmp_path / 'payloads.csv', index=False)
+
+    payloads = [load_json(os.path.join(TEST_DATA_DIR, name)) for name in 
+                [PAYLOAD_VALID, PAYLOAD_EXCESS, PAYLOAD_INVALID_CATEGORY, PAYLOAD_INVALID_DTYPE, PAYLOAD_MISSING, 
+                 PAYLOAD_NEGATIVE]]
+    with open(tmp_path / 'payloads.jsonl', 'w') as f:
+        for payload in payloads:
+            f.write(json.dumps(payload) + '\n')
+        f.write('{not json\n')
+
+    def expected(payload):
+        validated = std_payload.validate_data(payload)
+        return validated['error_msg'] if validated['has_error'] else model.predict(validated['data'])
+
+    # the rows of the csv, with the types of the reference json and without the empty cells
+    csv_payloads = [{k : v for k, v in record.items() if not pd.isna(v)} for record in df.to_dict('records')]
+
+    summary = score_file(std_payload, model, str(tmp_path / 'payloads.csv'), str(tmp_path / 'out.jsonl'), chunk_size=7)
+    with open(tmp_path / 'out.jsonl') as f:
+        results = [json.loads(line) for line in f]
+    val1 = summary['rows'] == 50 and summary['errors'] == 4
+    val2 = [result.pop('row') for result in results] == list(range(50))
+    val3 = results == [expected(payload) for payload in csv_payloads]
+    val4 = results[21]['status'] == 'success' and results[13]['error_type'] == 'missing_fields'
+
+    summary = score_file(std_payload, model, str(tmp_path / 'payloads.jsonl'), str(tmp_path / 'out.csv'), chunk_size=4)
+    out = pd.read_csv(tmp_path / 'out.csv')
+    expected_status = [expected(payload)['status'] for payload in payloads] + ['error']
+    val5 = summary['rows'] == 7 and out['status'].tolist() == expected_status
+    val6 = out['error_type'].iloc[-1] == 'invalid_json' and out['error_type'].iloc[5] == 'fields_with_negative'
+
+    # the pool of processes writes the same output, in the same order
+    score_file(std_payload, model, str(tmp_path / 'payloads.csv'), str(tmp_path / 'out_pool.jsonl'), chunk_size=7,
+               workers=2)
+    score_file(std_payload, model, str(tmp_path / 'payloads.jsonl'), str(tmp_path / 'out_pool.csv'), chunk_size=4,
+               workers=2)
+    with open(tmp_path / 'out_pool.jsonl') as f:
+        results_pool = [json.loads(line) for line in f]
+    val7 = [result.pop('row') for result in results_pool] == list(range(50)) and results_pool == results
+    val8 = pd.read_csv(tmp_path / 'out_pool.csv').equals(out)
+
+    assert val1 and val2 and val3 and val4 and val5 and val6 and val7 and val8, 'test_bulk_score fails'
+
+
+
+def test_microbatcher():
+
+    model = Model(model_file=MODEL_FILE, 
+                 transformer_file=TRANSFORMER_FILE)
+    df = pd.read_csv(ADULT_CSV).head(10)
+    df = df.applymap(lambda s:s.lower() if type(s) == str else s)
+    features = model.encode_batch(df.to_dict('records'))
+
+    async def score_all(batcher):
+        return await asyncio.gather(*[batcher.submit(features[i:i + 1]) for i in range(len(features))])
+
+    batcher = MicroBatcher(model.predict_features, max_size=4, max_wait=1.0)
+    results = asyncio.run(score_all(batcher))
+
+    val1 = results == model.predict_features(features)
+    # 4 + 4 are flushed when full, the last 2 after max_wait
+    val2 = batcher.batches == 3 and batcher.rows == 10
+
+    # rows of another model (version) in the same batch are scored by a separate call
+    model_numpy = Model(model_file=MODEL_FILE, 
+                        transformer_file=TRANSFORMER_FILE,
+                        engine='numpy')
+
+    async def score_mixed(batcher):
+        return await asyncio.gather(*[batcher.submit(features[i:i + 1], [model, model_numpy][i % 2].predict_features)
+                                      for i in range(4)])
+
+    batcher = MicroBatcher(max_size=4, max_wait=1.0)
+    results = asyncio.run(score_mixed(batcher))
+    expected = [[model, model_numpy][i % 2].predict_features(features[i:i + 1])[0] for i in range(4)]
+    val3 = results == expected and batcher.batches == 2 and batcher.rows == 4
+
+    assert val1 and val2 and val3, 'test_microbatcher fails'
+
+
+def test_asgi_predict_income():
+
+    get_test_client()
+    import asgi
+
+    async def call(method, path, body=b''):
+        messages = [{'type' : 'http.request', 'body' : body, 'more_body' : False}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        await asgi.app({'type' : 'http', 'method' : method, 'path' : path}, receive, send)
+        return sent[0]['status'], json.loads(sent[1]['body'])
+
+    async def run():
+        payload = load_json(os.path.join(TEST_DATA_DIR, PAYLOAD_VALID))
+        negative = load_json(os.path.join(TEST_DATA_DIR, PAYLOAD_NEGATIVE))
+        return await asyncio.gather(call('POST', '/predict_income', json.dumps(payload).encode()),
+                                    call('POST', '/predict_income', json.dumps(negative).encode()),
+                                    call('POST', '/predict_income', b'not a json'),
+                                    call('GET', '/unknown'))
+
+    valid, negative, invalid, unknown = asyncio.run(run())
+
+    model = Model(model_file=MODEL_FILE, 
+                 transformer_file=TRANSFORMER_FILE)
+    payload = StandardPayload(ref_json=REF_JSON).validate_data(load_json(os.path.join(TEST_DATA_DIR, PAYLOAD_VALID)))
+
+    val1 = valid == (200, model.predict(payload['data']))
+    val2 = negative[1]['error_type'] == 'fields_with_negative'
+    val3 = invalid[1]['error_type'] == 'invalid_json'
+    val4 = unknown[0] == 404
+
+    assert val1 and val2 and val3 and val4, 'test_asgi_predict_income fails'
+
+
+def test_asgi_remote_cache_off_event_loop():
+
+    get_test_client()
+    import asgi
+
+    class SlowRemoteCache(FakeRemoteCache):
+
+        def get(self, key):
+            time.sleep(0.2)
+            return super().get(key)
+
+    async def call(body):
+        messages = [{'type' : 'http.request', 'body' : body, 'more_body' : False}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        await asgi.app({'type' : 'http', 'method' : 'POST', 'path' : '/predict_income'}, receive, send)
+        return json.loads(sent[1]['body'])
+
+    async def ticks():
+        # longest wait of this coroutine on the event loop, during the lookup of call
+        longest = 0.0
+        for _ in range(20):
+            start = time.perf_counter()
+            await asyncio.sleep(0.01)
+            longest = max(longest, time.perf_counter() - start)
+        return longest
+
+    async def run():
+        return await asyncio.gather(ticks(), call(json.dumps(payload).encode()))
+
+    payload = load_json(os.path.join(TEST_DATA_DIR, PAYLOAD_VALID))
+    payload['age'] = 77
+    # the batcher runs on the event loop of its first request, a previous asyncio.run
+    asgi.batcher.task = None
+    remote, asgi.prediction_cache.remote = asgi.prediction_cache.remote, SlowRemoteCache()
+    try:
+        longest, response = asyncio.run(run())
+    finally:
+        asgi.prediction_cache.remote = remote
+
+    val1 = response['status'] == 'success'
+    val2 = longest < 0.1
+
+    assert val1 and val2, 'test_asgi_remote_cache_off_event_loop fails'
+
+
+def test_metrics_endpoint():
+
+    client = get_test_client()
+    payload = load_json(os.path.join(TEST_DATA_DIR, PAYLOAD_VALID))
+    negative = load_json(os.path.join(TEST_DATA_DIR, PAYLOAD_NEGATIVE))
+
+    client.post('/predict_income', json=payload)
+    client.post('/predict_income', json=negative)
+    response = client.get('/metrics')
+    text = response.get_data(as_text=True)
+
+    val1 = response.status_code == 200
+    val2 = all(f'predict_income_stage_seconds_count{{stage="{stage}"}}' in text
+               for stage in ['parse', 'validate', 'transform', 'cache', 'serialize', 'total'])
+    val3 = 'payload_validation_errors_total{error_type="fields_with_negative"}' in text
+    val4 = 'prediction_cache_lookups_total{result=' in text and 'prediction_batch_rows_count' in text
+
+    assert val1 and val2 and val3 and val4, 'test_metrics_endpoint fails'
+
+
+def test_metrics_multiprocess(tmp_path):
+
+    # not created yet, like in a gunicorn master that preloads the app
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(tmp_path / 'prometheus'))
+    record = ("import metrics; "
+              "[metrics.count_validation_error('missing_fields') for _ in range(3)]; "
+              "metrics.observe_batch_rows(10)")
+    collect = "import metrics; print(metrics.generate_metrics()[0].decode())"
+
+    # two workers record, a third process serves the aggregate
+    for _ in range(2):
+        subprocess.run([sys.executable, '-c', record], env=env, check=True)
+    text = subprocess.run([sys.executable, '-c', collect], env=env, check=True,
+                          capture_output=True, text=True).stdout
+
+    val1 = 'payload_validation_errors_total{error_type="missing_fields"} 6.0' in text
+    val2 = 'prediction_batch_rows_count 2.0' in text
+
+    assert val1 and val2, 'test_metrics_multiprocess fails'
+
+
+def get_profiling_client(profile_dir, model):
+    std_payload = StandardPayload(ref_json=REF_JSON)
+    app = Flask(__name__)
+
+    @app.route('/predict_income', methods=['POST'])
+    def predict_income():
+        payload = std_payload.validate_data(request.get_json())
+        return model.predict(payload['data'])
+
+    app.register_blueprint(profiling_blueprint({'predict' : (model, 'predict_features')},
+                                               str(profile_dir), token='secret'))
+    return app.test_client()
+
+
+def test_profiler_sample(tmp_path):
+
+    model = Model(model_file=MODEL_FILE, 
+                 transformer_file=TRANSFORMER_FILE)
+    client = get_profiling_client(tmp_path, model)
+    headers = {'X-Profiling-Token' : 'secret'}
+    payload = load_json(os.path.join(TEST_DATA_DIR, PAYLOAD_VALID))
+
+    forbidden = client.post('/admin/profile/sample?seconds=5')
+    started = client.post('/admin/profile/sample?seconds=5&requests=50&interval_ms=1', headers=headers).get_json()
+    busy = client.post('/admin/profile/sample', headers=headers)
+    while client.get('/admin/profile', headers=headers).get_json()['active'] is not None:
+        client.post('/predict_income', json=payload)
+
+    profile = client.get(f"/admin/profile/{started['file']}", headers=headers).get_data(as_text=True)
+    lines = profile.splitlines()
+
+    val1 = forbidden.status_code == 403 and busy.status_code == 409
+    val2 = started['file'].startswith(f'profile-{os.getpid()}-')
+    val3 = len(lines) > 0 and all(line.rsplit(' ', 1)[1].isdigit() for line in lines)
+    # the test itself is on the stack of the main thread for the whole session, unlike the short
+    # handler frames, and the sampler always takes a first sample when it starts
+    val4 = 'test_profiler_sample (test_functionalities.py' in profile
+
+    assert val1 and val2 and val3 and val4, 'test_profiler_sample fails'
+
+
+def test_profiler_cprofile(tmp_path):
+
+    model = Model(model_file=MODEL_FILE, 
+                 transformer_file=TRANSFORMER_FILE)
+    client = get_profiling_client(tmp_path, model)
+    headers = {'X-Profiling-Token' : 'secret'}
+    payload = load_json(os.path.join(TEST_DATA_DIR, PAYLOAD_VALID))
 
+    unknown = client.post('/admin/profile/cprofile?target=unknown', headers=headers)
+    started = client.post('/admin/profile/cprofile?target=predict&seconds=30&requests=3', headers=headers).get_json()
+    for _ in range(5):
+        client.post('/predict_income', json=payload)
+    while client.get('/admin/profile', headers=headers).get_json()['active'] is not None:
+        time.sleep(0.01)
 
+    stats = pstats.Stats(str(tmp_path / started['file']))
+    calls = [ncalls for (_, _, name), (_, ncalls, _, _, _) in stats.stats.items() if name == 'predict_features']
 
+    val1 = unknown.status_code == 400
+    val2 = calls == [3]
+    # the method of the class is restored once the session ends
+    val3 = 'predict_features' not in model.__dict__
 
+    assert val1 and val2 and val3, 'test_profiler_cprofile fails'